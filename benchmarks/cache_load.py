@@ -0,0 +1,115 @@
+"""
+Benchmark loading the GitHub cache for a cold ``msl list --github`` command.
+
+Compares parsing the github.json file (which version 2.5 used) with reading the
+SQLite database, where the tags and the branches of a repository are only loaded
+when they are accessed. A synthetic cache is created so no requests are sent and
+every measurement runs in a new Python process.
+
+Usage::
+
+    python benchmarks/cache_load.py [--repos N] [--tags N] [--branches N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from msl.package_manager import utils  # noqa: E402
+
+METHODS = {
+    'json (version 2.5)': 'json',
+    'sqlite (eager)': 'eager',
+    'sqlite (lazy)': 'lazy',
+}
+
+
+def create_caches(directory, repos, tags, branches):
+    """Create a github.json file and an SQLite database with the same information."""
+    pkgs = {}
+    for i in range(repos):
+        pkgs['msl-repo{:04d}'.format(i)] = {
+            'description': 'The description of repository {}'.format(i),
+            'version': '1.{}.0'.format(i),
+            'tags': ['v1.{}.{}'.format(i, j) for j in range(tags)],
+            'branches': ['branch-{}'.format(j) for j in range(branches)],
+            'pushed_at': '2023-06-16T00:00:00Z',
+            'updated_at': '2023-06-16T00:00:00Z',
+        }
+
+    os.makedirs(os.path.join(directory, 'json'))
+    with open(os.path.join(directory, 'json', 'github.json'), mode='wt') as fp:
+        json.dump(pkgs, fp, indent=2)
+
+    os.makedirs(os.path.join(directory, 'sqlite'))
+    utils._MetadataStore(os.path.join(directory, 'sqlite', 'cache.sqlite3')).replace('github', pkgs)
+
+
+def child(method, directory, trace):
+    """Load the cache and create the lines that ``msl list --github`` shows."""
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    if method == 'json':
+        with open(os.path.join(directory, 'json', 'github.json'), mode='rt') as fp:
+            pkgs = utils._sort_packages(json.load(fp))
+    else:
+        store = utils._MetadataStore(os.path.join(directory, 'sqlite', 'cache.sqlite3'))
+        pkgs = store.load('github', lazy=method == 'lazy')
+    lines = ['{} {} {}'.format(name, value['version'], value['description']) for name, value in pkgs.items()]
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    assert len(lines) == len(pkgs)
+    print('{} {}'.format(elapsed, peak))
+
+
+def run(name, method, directory, repeat):
+    # tracing the memory allocations slows down Python, so the
+    # time and the peak memory are measured in different processes
+    times, peaks = [], []
+    for _ in range(repeat):
+        for trace in ('', 'trace'):
+            out = subprocess.check_output([sys.executable, __file__, '--child', method, directory, trace])
+            elapsed, peak = out.split()
+            if trace:
+                peaks.append(int(peak))
+            else:
+                times.append(float(elapsed))
+    print('{:<20} median {:8.2f} ms  peak memory {:8.2f} MiB'.format(
+        name, statistics.median(times) * 1e3, max(peaks) / 2.**20))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading the GitHub cache.')
+    parser.add_argument('--repos', type=int, default=150, help='The number of repositories.')
+    parser.add_argument('--tags', type=int, default=100, help='The number of tags of each repository.')
+    parser.add_argument('--branches', type=int, default=10, help='The number of branches of each repository.')
+    parser.add_argument('--repeat', type=int, default=5, help='The number of times to load the cache.')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(*args.child)
+
+    directory = tempfile.mkdtemp()
+    try:
+        create_caches(directory, args.repos, args.tags, args.branches)
+        print('{} repositories, {} tags and {} branches per repository'.format(
+            args.repos, args.tags, args.branches))
+        times = dict((method, run(name, method, directory, args.repeat)) for name, method in METHODS.items())
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print('speed up: {:.1f}x'.format(times['json'] / times['lazy']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark a cold refresh of the GitHub and PyPI caches.
+
+Compares the time it takes to refresh the caches when a new connection is
+opened for every request (:func:`urllib.request.urlopen`, which is what
+version 2.5 used) with reusing the keep-alive connections from the
+connection pool.
+
+Usage::
+
+    python benchmarks/cache_refresh.py [--repeat N]
+
+Set the MSL_PM_GITHUB_AUTH environment variable (or run ``msl authorise``)
+to avoid the GitHub rate limit.
+"""
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # then Python 2
+    from urllib2 import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from msl.package_manager import utils  # noqa: E402
+
+
+def cold_refresh():
+    """Refresh both caches in an empty cache directory and return the elapsed time."""
+    home = tempfile.mkdtemp()
+    original = utils._HOME_DIR
+    utils._HOME_DIR = home
+    try:
+        t0 = time.perf_counter()
+        pypi = utils.pypi(update_cache=True)
+        github = utils.github(update_cache=True)
+        elapsed = time.perf_counter() - t0
+    finally:
+        utils._HOME_DIR = original
+        shutil.rmtree(home, ignore_errors=True)
+    if not pypi or not github:
+        sys.exit('Cannot refresh the caches, is there an internet connection?')
+    return elapsed
+
+
+def run(name, repeat):
+    times = [cold_refresh() for _ in range(repeat)]
+    print('{:<24} min {:7.3f}s  median {:7.3f}s  max {:7.3f}s'.format(
+        name, min(times), statistics.median(times), max(times)))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a cold refresh of the GitHub and PyPI caches.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of times to refresh the caches.')
+    args = parser.parse_args()
+
+    utils.set_log_level(logging.CRITICAL + 1)
+
+    pool_urlopen = utils._http_pool.urlopen
+    utils._http_pool.urlopen = urlopen
+    try:
+        before = run('new connection/request', args.repeat)
+    finally:
+        utils._http_pool.urlopen = pool_urlopen
+
+    utils._http_pool.clear()
+    after = run('connection pool', args.repeat)
+    print('speed up: {:.1f}x'.format(before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,500 @@
+"""
+Manage the cached information about the MSL packages.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from . import utils
+
+# the "format" and the "version" of an archive that export_cache creates
+_ARCHIVE_FORMAT = 'msl-package-manager-cache'
+_ARCHIVE_VERSION = 1
+
+
+def export_cache(path):
+    """Export the cached information about the MSL packages to an archive.
+
+    The archive is a single gzip-compressed JSON_ file that contains the GitHub
+    and PyPI caches and a SHA-256 checksum of the information. Copy the archive
+    to a computer that does not have internet access and :func:`import_cache`
+    it so that the ``msl`` commands on that computer can use the information.
+
+    .. _JSON: https://www.json.org/
+
+    .. versionadded:: 2.6.0
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path to the archive (e.g., ``msl-cache.json.gz``). An existing
+        file is replaced once the archive has been written.
+
+    Returns
+    -------
+    :class:`dict`
+        The keys are the caches that were exported ('github' and/or 'pypi')
+        and the values are the number of packages.
+
+    Raises
+    ------
+    ValueError
+        If nothing is cached.
+    """
+    store = utils._store()
+    caches = dict()
+    for where in ('github', 'pypi'):
+        updated = store.updated(where)
+        if updated is None:
+            continue
+        caches[where] = {
+            'updated': updated,
+            'packages': store.load(where, lazy=False),
+            'checked': store.checked(where),
+        }
+    if not caches:
+        raise ValueError('Nothing is cached, there is nothing to export')
+
+    archive = {
+        'format': _ARCHIVE_FORMAT,
+        'version': _ARCHIVE_VERSION,
+        'created': time.time(),
+        'sha256': _checksum(caches),
+        'caches': caches,
+    }
+    path = os.path.abspath(path)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            with gzip.GzipFile(filename='', mode='wb', fileobj=fp) as gz:
+                gz.write(json.dumps(archive).encode('utf-8'))
+        utils._replace_file(tmp, path)
+    except:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return dict((where, len(cache['packages'])) for where, cache in caches.items())
+
+
+def import_cache(path, renew=False):
+    """Import the cached information about the MSL packages from an archive.
+
+    The archive must have been created by :func:`export_cache`. The checksum
+    of the archive is verified before the caches are replaced and the caches
+    in the archive are replaced in a single transaction, so either all of the
+    information is imported or, if an error occurs, nothing changes.
+
+    .. versionadded:: 2.6.0
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path to the archive.
+    renew : :class:`bool`, optional
+        Whether the imported information is considered to have been retrieved
+        now, instead of when it was retrieved by the computer that exported the
+        archive. Use this on a computer that does not have internet access so
+        that the information does not expire until the ``MSL_PM_CACHE_TTL``
+        durations elapse.
+
+    Returns
+    -------
+    :class:`dict`
+        The keys are the caches that were imported ('github' and/or 'pypi')
+        and the values are the number of packages.
+
+    Raises
+    ------
+    ValueError
+        If the file is not an archive, if the archive is corrupt or if the
+        archive was created by a newer version of the MSL Package Manager.
+    """
+    with open(path, mode='rb') as fp:
+        try:
+            with gzip.GzipFile(fileobj=fp, mode='rb') as gz:
+                archive = json.loads(gz.read().decode('utf-8'))
+        except (EOFError, IOError, OSError, ValueError) as e:
+            raise ValueError('{!r} is not an MSL cache archive -- {}'.format(path, e))
+
+    if not isinstance(archive, dict) or archive.get('format') != _ARCHIVE_FORMAT:
+        raise ValueError('{!r} is not an MSL cache archive'.format(path))
+    if not isinstance(archive.get('version'), int) or archive['version'] > _ARCHIVE_VERSION:
+        raise ValueError('{!r} was created by a newer version of the MSL Package Manager '
+                         '(archive version {!r})'.format(path, archive.get('version')))
+    caches = archive.get('caches')
+    try:
+        corrupt = _checksum(caches) != archive.get('sha256')
+    except (TypeError, ValueError):
+        corrupt = True
+    if corrupt or not _valid_caches(caches):
+        raise ValueError('The MSL cache archive {!r} is corrupt'.format(path))
+
+    if renew:
+        now = time.time()
+        for cache in caches.values():
+            cache['updated'] = now
+            cache['checked'] = dict((name, dict((field, now) for field in utils._CACHE_TTL))
+                                    for name in cache['packages'])
+
+    with utils._FileLock(os.path.join(utils._HOME_DIR, 'github.lock')), \
+            utils._FileLock(os.path.join(utils._HOME_DIR, 'pypi.lock')):
+        utils._store().restore(caches)
+
+        # the ETag/Last-Modified values are for the information that was replaced
+        shared_path = utils._etags_path('shared')
+        shared = utils._load_json(shared_path)
+        for where in caches:
+            utils._save_json(utils._etags_path(where), {})
+            shared.pop(where, None)
+        utils._save_json(shared_path, shared)
+
+    utils._invalidate_memo('github', 'pypi', 'installed')
+    return dict((where, len(cache['packages'])) for where, cache in caches.items())
+
+
+def prune(older_than=None):
+    """Remove the stale information from the cache.
+
+    A package is removed if none of its fields (see the ``MSL_PM_CACHE_TTL``
+    environment variable) were retrieved within `older_than` seconds. The
+    PyPI projects that were not found, which are not requested again for a
+    week, are also forgotten after a week. If a package is removed then the
+    cache expires so that the next refresh requests all packages again. The
+    integrity of the database file is checked and the database file is
+    rebuilt to reclaim the space of the removed information.
+
+    .. versionadded:: 2.6.0
+
+    Parameters
+    ----------
+    older_than : :class:`float`, optional
+        The number of seconds. Default is the longest time that a field is
+        valid for plus the maximum staleness (see the ``MSL_PM_CACHE_MAX_STALE``
+        environment variable), since the information about such a package
+        cannot be used anymore.
+
+    Returns
+    -------
+    :class:`dict`
+        The keys are 'github' and 'pypi' and the values are the names of the
+        packages that were removed.
+    """
+    if older_than is None:
+        older_than = max(utils._cache_ttl().values()) + utils._max_stale()
+    ttl = dict((field, older_than) for field in utils._CACHE_TTL)
+
+    store = utils._store()
+    store.check()
+    removed = dict()
+    for where in ('github', 'pypi'):
+        with utils._FileLock(os.path.join(utils._HOME_DIR, where + '.lock')):
+            removed[where] = sorted(name for name, fields in store.expired(where, ttl).items() if fields == set(ttl))
+            if removed[where]:
+                store.delete(where, removed[where], expire=True)
+        utils._invalidate_memo(where, 'installed')
+
+    missing_path = os.path.join(utils._HOME_DIR, 'pypi-missing.json')
+    missing = utils._load_json(missing_path)
+    if missing:
+        now = time.time()
+        utils._save_json(missing_path, dict((k, v) for k, v in missing.items()
+                                            if now - v < utils._PYPI_MISSING_TTL))
+
+    store.vacuum()
+    return removed
+
+
+def refresh(where=None, update_cache=False, every=None):
+    """Update the cached information about the MSL packages.
+
+    Run this function (e.g., from a scheduled task) to warm up the cache
+    so that the ``msl`` commands do not have to wait for GitHub and PyPI.
+
+    .. versionadded:: 2.6.0
+
+    Parameters
+    ----------
+    where : :class:`str`, optional
+        Either 'github' or 'pypi'. Default is both.
+    update_cache : :class:`bool`, optional
+        Whether to update all fields of the cache. By default, a cache is
+        only updated if a field has expired and only the fields that expired
+        are updated.
+    every : :class:`float`, optional
+        The number of seconds to wait before updating the cache again. If
+        :data:`None` then the cache is updated once, otherwise this function
+        does not return (until the process is interrupted).
+    """
+    sources = ('pypi', 'github') if where is None else (where,)
+    try:
+        while True:
+            for source in sources:
+                if _refresh(source, update_cache) is False:
+                    utils.log.info('The %s cache has not expired', source)
+            if every is None:
+                return
+            time.sleep(every)
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(host='localhost', port=8765, directory=None, interval=60):
+    """Share the cached information about the MSL packages with other computers.
+
+    The information about the MSL repositories_ on GitHub and the MSL packages_
+    on PyPI is updated by this process (when a field of the cache expires) and
+    the computers that set the ``MSL_PM_CACHE_URL`` environment variable to the
+    URL of this process (e.g., ``http://hostname:8765``) or to the `directory`
+    get the information from this process instead of from GitHub and PyPI.
+
+    .. _repositories: https://github.com/MSLNZ
+    .. _packages: https://pypi.org/search/?q=%22Measurement+Standards+Laboratory+of+New+Zealand%22
+
+    .. versionadded:: 2.6.0
+
+    Parameters
+    ----------
+    host : :class:`str`, optional
+        The hostname or IP address to listen on. The default only accepts
+        connections from this computer. Use ``'0.0.0.0'`` (or ``''``) to listen
+        on all interfaces. Anyone who can connect can read the cached
+        information, which includes the private repositories that the GitHub
+        authorisation credentials (if any) give access to.
+    port : :class:`int`, optional
+        The port number to listen on. If :data:`None` then the information is
+        only written to the `directory`.
+    directory : :class:`str`, optional
+        A (shared) directory to also write the ``github.json`` and ``pypi.json`` files to.
+    interval : :class:`float`, optional
+        The number of seconds to wait before checking if the cache has expired.
+    """
+    shared = _SharedCache(directory=directory)
+    shared.refresh()
+
+    server = None
+    if port is not None:
+        server = ThreadingHTTPServer((host, port), _SharedCacheHandler)
+        server.shared = shared
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        utils.log.info('Serving the MSL cache on http://%s:%d', host or '0.0.0.0', server.server_address[1])
+    if directory:
+        utils.log.info('Writing the MSL cache to %s', directory)
+
+    try:
+        while True:
+            time.sleep(interval)
+            shared.refresh()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+def stats():
+    """Get the statistics about the cached information.
+
+    .. versionadded:: 2.6.0
+
+    Returns
+    -------
+    :class:`dict`
+        The keys are 'github' and 'pypi' and each value is a :class:`dict` with
+        the number of ``packages`` that are cached, the ``age`` of the cache
+        (in seconds, :data:`None` if nothing is cached), the number of packages
+        for which each field has ``expired``, the ``size`` of the cached
+        information (in bytes), the number of times that an ``msl`` command
+        used the cache (``hits``), used an expired cache while it was updated
+        in the background (``stale``) or had to wait for the cache to be updated
+        (``misses``), the ``hit_rate`` (:data:`None` if the cache was not used)
+        and the number of times that the cache was updated from GitHub or PyPI
+        (``refreshes``) or from the shared cache (``shared``).
+    """
+    store = utils._store()
+    ttl = utils._cache_ttl()
+    statistics = utils._load_lookups()
+    result = dict()
+    for where in ('github', 'pypi'):
+        expired = store.expired(where, ttl)
+        counts = statistics.get(where, {})
+        info = {
+            'packages': len(expired),
+            'age': store.age(where),
+            'expired': dict((field, sum(field in fields for fields in expired.values())) for field in ttl),
+            'size': store.size(where),
+        }
+        for event in ('hits', 'stale', 'misses', 'refreshes', 'shared'):
+            info[event] = counts.get(event, 0)
+        lookups = info['hits'] + info['stale'] + info['misses']
+        info['hit_rate'] = (info['hits'] + info['stale']) / float(lookups) if lookups else None
+        result[where] = info
+    return result
+
+
+def _checksum(caches):
+    """Returns the SHA-256 checksum of the caches in an archive (see :func:`export_cache`)."""
+    data = json.dumps(caches, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _refresh(where, update_cache, shared=True):
+    """Update a cache if a field expired (or if `update_cache` is :data:`True`).
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    update_cache : :class:`bool`
+        Whether to update all fields of the cache.
+    shared : :class:`bool`, optional
+        Whether to first get the information from the shared cache, if there is one.
+
+    Returns
+    -------
+    :class:`bool` or :data:`None`
+        Whether the cache was updated (:data:`None` if it could not be updated).
+    """
+    overdue = utils._store().overdue(where, utils._cache_ttl())
+    if not update_cache and overdue is not None and overdue < 0:
+        return False
+    try:
+        packages = utils._update_cache(where, update_cache=update_cache, shared=shared)
+    except Exception as e:
+        utils.log.error('Cannot update the %s cache -- %s', where, e)
+        return
+    if not packages:
+        return  # the reason was already logged
+    utils.log.info('Updated the %s cache (%d packages)', where, len(packages))
+    return True
+
+
+def _valid_caches(caches):
+    """Check that the caches in an archive (see :func:`export_cache`) have the expected structure."""
+    if not isinstance(caches, dict) or not caches:
+        return False
+    for where, cache in caches.items():
+        if where not in ('github', 'pypi') or not isinstance(cache, dict):
+            return False
+        if not isinstance(cache.get('updated'), (int, float)):
+            return False
+        packages, checked = cache.get('packages'), cache.get('checked')
+        if not isinstance(packages, dict) or not isinstance(checked, dict):
+            return False
+        for value in packages.values():
+            if not isinstance(value, dict):
+                return False
+            if where == 'github' and not all(isinstance(value.get(k, []), list) for k in ('tags', 'branches')):
+                return False
+        for value in checked.values():
+            if not isinstance(value, dict) or not all(isinstance(t, (int, float)) for t in value.values()):
+                return False
+    return True
+
+
+class _SharedCache(object):
+    """The information that a shared cache provides.
+
+    Parameters
+    ----------
+    store : :class:`~msl.package_manager.utils._MetadataStore`, optional
+        The store to share. Default is the store in the HOME directory.
+    directory : :class:`str`, optional
+        A (shared) directory to write the ``github.json`` and ``pypi.json`` files to.
+    """
+
+    def __init__(self, store=None, directory=None):
+        self._store = store
+        self.directory = directory
+        self._snapshots = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        """:class:`~msl.package_manager.utils._MetadataStore`: The store that is shared."""
+        return self._store or utils._store()
+
+    def publish(self):
+        """Create the snapshots of the information in the store (only if the information changed)."""
+        for where in ('github', 'pypi'):
+            updated = self.store.updated(where)
+            if updated is None or updated == self._snapshots.get(where, {}).get('updated'):
+                continue
+            payload = {'updated': updated, 'packages': self.store.load(where, lazy=False)}
+            body = json.dumps(payload).encode('utf-8')
+            with self._lock:
+                self._snapshots[where] = {
+                    'updated': updated,
+                    'etag': '"{}-{!r}"'.format(where, updated),
+                    'body': body,
+                    'gzip': gzip.compress(body),
+                }
+            if self.directory:
+                utils._save_json(os.path.join(self.directory, where + '.json'), payload)
+
+    def refresh(self):
+        """Update the fields of the cache that expired and then :meth:`publish` the information."""
+        for where in ('pypi', 'github'):
+            _refresh(where, False, shared=False)
+        self.publish()
+
+    def snapshot(self, where):
+        """Get the snapshot of the information.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+
+        Returns
+        -------
+        :class:`dict` or :data:`None`
+            The snapshot or :data:`None` if there is no information.
+        """
+        with self._lock:
+            return self._snapshots.get(where)
+
+
+class _SharedCacheHandler(BaseHTTPRequestHandler):
+    """Handles the requests for the ``/github.json`` and ``/pypi.json`` files."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        where = self.path.split('?')[0].strip('/')
+        if where.endswith('.json'):
+            where = where[:-5]
+        snapshot = self.server.shared.snapshot(where)
+        if snapshot is None:
+            self.send_error(404)
+            return
+
+        if self.headers.get('If-None-Match') == snapshot['etag']:
+            self.send_response(304)
+            self.send_header('ETag', snapshot['etag'])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = snapshot['body']
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', snapshot['etag'])
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = snapshot['gzip']
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        utils.log.debug('%s - %s', self.address_string(), fmt % args)
@@ -1,7 +1,7 @@
 """
 Main entry point to either :ref:`install <install-cli>`, :ref:`uninstall <uninstall-cli>`,
 :ref:`update <update-cli>`, :ref:`list <list-cli>` or :ref:`create <create-cli>`
-MSL packages using the command-line interface (CLI).
+MSL packages, or to manage the :ref:`cache <cache-cli>`, using the command-line interface (CLI).
 """
 import logging
 import os
@@ -36,6 +36,7 @@ def configure_parser():
     from .cli_list import add_parser_list
     from .cli_create import add_parser_create
     from .cli_authorise import add_parser_authorise
+    from .cli_cache import add_parser_cache
 
     PARSER = ArgumentParser(description='Install, uninstall, update, list or create MSL packages.')
 
@@ -63,6 +64,7 @@ def configure_parser():
     add_parser_create(command_parser)
     add_parser_authorise(command_parser)
     add_parser_authorise(command_parser, name='authorize')
+    add_parser_cache(command_parser)
 
     return PARSER
 
@@ -179,7 +181,7 @@ def _main(*args):
     # check if there is an update for the MSL Package Manager
     # do not log any messages when checking for the update
     utils.set_log_level(logging.CRITICAL+1)
-    pkgs = utils.pypi()
+    pkgs = utils._pypi(False, names=(_PKG_NAME,))
     if not pkgs:
         return
 
@@ -97,6 +97,22 @@ def add_argument_quiet(parser):
     )
 
 
+def add_argument_sources(parser, help):
+    """Add ``--github`` and ``--pypi`` arguments to the parser."""
+    parser.add_argument(
+        '-g', '--github',
+        action='store_true',
+        default=False,
+        help=help.format('GitHub')
+    )
+    parser.add_argument(
+        '-p', '--pypi',
+        action='store_true',
+        default=False,
+        help=help.format('PyPI')
+    )
+
+
 def add_argument_tag(parser):
     """Add a ``--tag`` argument to the parser."""
     parser.add_argument(
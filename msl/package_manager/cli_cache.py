@@ -0,0 +1,405 @@
+"""
+Command line interface for the :ref:`cache <cache-cli>` command.
+"""
+import json
+import os
+
+from .cache import export_cache
+from .cache import import_cache
+from .cache import prune
+from .cache import refresh
+from .cache import serve
+from .cache import stats
+from .cli_argparse import add_argument_disable_mslpm_version_check
+from .cli_argparse import add_argument_quiet
+from .cli_argparse import add_argument_sources
+from .cli_argparse import add_argument_update_cache
+from .utils import _parse_duration
+from .utils import _store
+from .utils import log
+
+HELP = 'Manage the cached information about MSL packages.'
+
+DESCRIPTION = HELP + """
+
+The information about the MSL repositories that are available on
+GitHub and the MSL packages that are available on PyPI is cached.
+"""
+
+EXAMPLE = """
+Examples:
+    msl cache refresh
+    msl cache stats
+    msl cache prune
+    msl cache export msl-cache.json.gz
+    msl cache import msl-cache.json.gz
+    msl cache serve
+    msl cache serve --port 8000 --dir //server/share/msl-cache
+"""
+
+REFRESH_HELP = 'Update the cached information.'
+
+REFRESH_DESCRIPTION = REFRESH_HELP + """
+
+Only the information that expired is updated, unless the --update-cache
+flag is specified. Run this command from a scheduled task (e.g., cron)
+to warm up the cache so that the other msl commands do not have to wait
+for GitHub and PyPI.
+"""
+
+REFRESH_EXAMPLE = """
+Examples:
+    # update the GitHub and PyPI caches if the information expired
+    msl cache refresh
+
+    # update all information in the PyPI cache
+    msl cache refresh --pypi --update-cache
+
+    # update the caches every hour (until the process is interrupted)
+    msl cache refresh --every 1h
+
+    # a crontab entry to update the caches every 6 hours
+    0 */6 * * * msl cache refresh -qq
+"""
+
+STATS_HELP = 'Show the statistics about the cache.'
+
+STATS_DESCRIPTION = STATS_HELP + """
+
+Shows the number of packages, the age, the number of packages for which
+each field has expired and the size of the GitHub and PyPI caches. Also
+shows the number of times that an msl command used the cache (hits), used
+an expired cache while the cache was updated in the background (stale) or
+had to wait for the cache to be updated (misses), and the number of times
+that the cache was updated from GitHub or PyPI (refreshes) or from the
+shared cache (shared).
+"""
+
+STATS_EXAMPLE = """
+Examples:
+    msl cache stats
+    msl cache stats --json
+"""
+
+PRUNE_HELP = 'Remove the stale information from the cache.'
+
+PRUNE_DESCRIPTION = PRUNE_HELP + """
+
+A package is removed from the cache if none of its information was
+retrieved within the --older-than duration.
+"""
+
+PRUNE_EXAMPLE = """
+Examples:
+    # remove the packages that an msl command can no longer use
+    msl cache prune
+
+    # remove the packages that were not retrieved within 30 days
+    msl cache prune --older-than 30d
+"""
+
+EXPORT_HELP = 'Export the cache to an archive.'
+
+EXPORT_DESCRIPTION = EXPORT_HELP + """
+
+The archive is a single compressed file that contains the GitHub and
+PyPI caches and a checksum. Copy the archive to a computer that does
+not have internet access and import it on that computer.
+"""
+
+EXPORT_EXAMPLE = """
+Examples:
+    msl cache export msl-cache.json.gz
+"""
+
+IMPORT_HELP = 'Import the cache from an archive.'
+
+IMPORT_DESCRIPTION = IMPORT_HELP + """
+
+The checksum of the archive is verified and then the caches are
+replaced in a single step, so either all of the information in the
+archive is imported or nothing changes.
+"""
+
+IMPORT_EXAMPLE = """
+Examples:
+    msl cache import msl-cache.json.gz
+
+    # on a computer that does not have internet access
+    msl cache import msl-cache.json.gz --renew
+"""
+
+SERVE_HELP = 'Share the cache with other computers.'
+
+SERVE_DESCRIPTION = SERVE_HELP + """
+
+This process updates the cache when the information expires and the
+computers that set the MSL_PM_CACHE_URL environment variable to the
+URL of this process (e.g., http://hostname:8765), or to the directory
+that this process writes to, get the information from this process
+instead of sending requests to GitHub and PyPI.
+"""
+
+SERVE_EXAMPLE = """
+Examples:
+    # serve the cache on port 8765 to the other computers
+    msl cache serve --host 0.0.0.0
+
+    # serve the cache on port 8000 and also write the cache to a shared directory
+    msl cache serve --host 0.0.0.0 --port 8000 --dir //server/share/msl-cache
+
+    # only write the cache to a shared directory
+    msl cache serve --no-server --dir /mnt/share/msl-cache
+"""
+
+
+def add_parser_cache(parser):
+    """Add the :ref:`cache <cache-cli>` command to the parser."""
+    p = parser.add_parser(
+        'cache',
+        help=HELP,
+        description=DESCRIPTION,
+        epilog=EXAMPLE,
+    )
+    command_parser = p.add_subparsers(
+        metavar='command',
+        dest='cache_cmd',
+    )
+    command_parser.required = True
+
+    r = command_parser.add_parser(
+        'refresh',
+        help=REFRESH_HELP,
+        description=REFRESH_DESCRIPTION,
+        epilog=REFRESH_EXAMPLE,
+    )
+    add_argument_sources(r, 'Only update the {} cache.')
+    r.add_argument(
+        '--every',
+        type=_parse_duration,
+        help='Update the cache every time this duration elapses,\n'
+             'e.g., 3600 (seconds), 30m, 6h or 1d. By default, the\n'
+             'cache is updated once.'
+    )
+    add_argument_quiet(r)
+    add_argument_update_cache(r)
+    add_argument_disable_mslpm_version_check(r)
+    r.set_defaults(func=execute_refresh)
+
+    st = command_parser.add_parser(
+        'stats',
+        help=STATS_HELP,
+        description=STATS_DESCRIPTION,
+        epilog=STATS_EXAMPLE,
+    )
+    st.add_argument(
+        '-j', '--json',
+        action='store_true',
+        default=False,
+        help='Show the statistics in JSON format.'
+    )
+    add_argument_quiet(st)
+    add_argument_disable_mslpm_version_check(st)
+    st.set_defaults(func=execute_stats)
+
+    pr = command_parser.add_parser(
+        'prune',
+        help=PRUNE_HELP,
+        description=PRUNE_DESCRIPTION,
+        epilog=PRUNE_EXAMPLE,
+    )
+    pr.add_argument(
+        '--older-than',
+        type=_parse_duration,
+        help='Remove the packages that were not retrieved within\n'
+             'this duration, e.g., 30d. Default is the longest time\n'
+             'that the information is valid for plus the maximum\n'
+             'staleness (i.e., the packages that an msl command\n'
+             'cannot use anymore).'
+    )
+    add_argument_quiet(pr)
+    add_argument_disable_mslpm_version_check(pr)
+    pr.set_defaults(func=execute_prune)
+
+    ex = command_parser.add_parser(
+        'export',
+        help=EXPORT_HELP,
+        description=EXPORT_DESCRIPTION,
+        epilog=EXPORT_EXAMPLE,
+    )
+    ex.add_argument(
+        'path',
+        help='The path to the archive to create.'
+    )
+    add_argument_quiet(ex)
+    add_argument_disable_mslpm_version_check(ex)
+    ex.set_defaults(func=execute_export)
+
+    im = command_parser.add_parser(
+        'import',
+        help=IMPORT_HELP,
+        description=IMPORT_DESCRIPTION,
+        epilog=IMPORT_EXAMPLE,
+    )
+    im.add_argument(
+        'path',
+        help='The path to the archive that was exported.'
+    )
+    im.add_argument(
+        '--renew',
+        action='store_true',
+        default=False,
+        help='Consider the information to have been retrieved now\n'
+             '(instead of when the computer that exported the\n'
+             'archive retrieved it). Use this on a computer that\n'
+             'does not have internet access so that the cached\n'
+             'information does not expire.'
+    )
+    add_argument_quiet(im)
+    add_argument_disable_mslpm_version_check(im)
+    im.set_defaults(func=execute_import)
+
+    s = command_parser.add_parser(
+        'serve',
+        help=SERVE_HELP,
+        description=SERVE_DESCRIPTION,
+        epilog=SERVE_EXAMPLE,
+    )
+    s.add_argument(
+        '--host',
+        default='localhost',
+        help='The hostname or IP address to listen on. Default\n'
+             'is localhost. Use 0.0.0.0 to let other computers\n'
+             'connect, anyone who can connect can read the\n'
+             'information about the private repositories that\n'
+             'your GitHub credentials give access to.'
+    )
+    s.add_argument(
+        '--port',
+        type=int,
+        default=8765,
+        help='The port number to listen on. Default is 8765.'
+    )
+    s.add_argument(
+        '--no-server',
+        action='store_true',
+        default=False,
+        help='Do not start the server, only write the cache\n'
+             'to the directory.'
+    )
+    s.add_argument(
+        '--dir',
+        help='A (shared) directory to also write the cache to.'
+    )
+    s.add_argument(
+        '--interval',
+        type=float,
+        default=60,
+        help='The number of seconds to wait before checking\n'
+             'if the cache has expired. Default is 60.'
+    )
+    add_argument_quiet(s)
+    add_argument_disable_mslpm_version_check(s)
+    s.set_defaults(func=execute_serve)
+
+
+def execute_export(args, parser):
+    """Executes the :ref:`cache export <cache-cli>` command."""
+    try:
+        exported = export_cache(args.path)
+    except (IOError, OSError, ValueError) as e:
+        log.error(e)
+        return
+    for where, count in sorted(exported.items()):
+        log.info('Exported %d package(s) from the %s cache', count, where)
+    log.info('Created %s', args.path)
+
+
+def execute_import(args, parser):
+    """Executes the :ref:`cache import <cache-cli>` command."""
+    try:
+        imported = import_cache(args.path, renew=args.renew)
+    except (IOError, OSError, ValueError) as e:
+        log.error(e)
+        return
+    for where, count in sorted(imported.items()):
+        log.info('Imported %d package(s) to the %s cache', count, where)
+
+
+def execute_prune(args, parser):
+    """Executes the :ref:`cache prune <cache-cli>` command."""
+    removed = prune(older_than=args.older_than)
+    for where, names in sorted(removed.items()):
+        log.info('Removed %d package(s) from the %s cache', len(names), where)
+        for name in names:
+            log.debug('  %s', name)
+
+
+def execute_refresh(args, parser):
+    """Executes the :ref:`cache refresh <cache-cli>` command."""
+    if args.github and args.pypi:
+        parser.error('Specify either --github or --pypi, not both')
+    where = 'github' if args.github else ('pypi' if args.pypi else None)
+    refresh(where=where, update_cache=args.update_cache, every=args.every)
+
+
+def execute_serve(args, parser):
+    """Executes the :ref:`cache serve <cache-cli>` command."""
+    if args.no_server and not args.dir:
+        parser.error('The --dir argument is required if --no-server is specified')
+    port = None if args.no_server else args.port
+    serve(host=args.host, port=port, directory=args.dir, interval=args.interval)
+
+
+def execute_stats(args, parser):
+    """Executes the :ref:`cache stats <cache-cli>` command."""
+    result = stats()
+    if args.json:
+        log.info(json.dumps(result, indent=2, sort_keys=True))
+        return
+
+    path = _store().path
+    size = sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.isfile(p))
+    log.info('Cache: %s (%s)', path, _format_size(size))
+    rows = [('Source', 'Packages', 'Age', 'Expired', 'Size', 'Hits', 'Stale', 'Misses',
+             'Hit rate', 'Refreshes', 'Shared')]
+    for where in ('github', 'pypi'):
+        info = result[where]
+        rows.append((
+            'GitHub' if where == 'github' else 'PyPI',
+            str(info['packages']),
+            _format_age(info['age']),
+            ' '.join('{}={}'.format(k, v) for k, v in sorted(info['expired'].items(), reverse=True)),
+            _format_size(info['size']),
+            str(info['hits']),
+            str(info['stale']),
+            str(info['misses']),
+            '-' if info['hit_rate'] is None else '{:.1%}'.format(info['hit_rate']),
+            str(info['refreshes']),
+            str(info['shared']),
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        log.info('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def _format_age(seconds):
+    # e.g., 45s, 12m, 5.2h or 3.1d
+    if seconds is None:
+        return '-'
+    if seconds < 60:
+        return '{:.0f}s'.format(seconds)
+    if seconds < 3600:
+        return '{:.0f}m'.format(seconds / 60.)
+    if seconds < 86400:
+        return '{:.1f}h'.format(seconds / 3600.)
+    return '{:.1f}d'.format(seconds / 86400.)
+
+
+def _format_size(size):
+    # e.g., 512 B, 12.3 kB or 1.5 MB
+    if size < 1e3:
+        return '{:d} B'.format(size)
+    if size < 1e6:
+        return '{:.1f} kB'.format(size / 1e3)
+    return '{:.1f} MB'.format(size / 1e6)
@@ -95,10 +95,15 @@ def install(*names, **kwargs):
     if github_suffix is None:
         return
 
-    # keep the order of the log messages consistent: pypi -> github -> local
-    # utils._create_install_list() does github -> local
-    pkgs_pypi = utils.pypi(update_cache)
-    packages = utils._create_install_list(names, branch, commit, tag, update_cache)
+    # get the information from PyPI, GitHub and the installed packages concurrently,
+    # the order of the log messages is still consistent: pypi -> github -> local
+    pkgs_pypi, pkgs_github, pkgs_installed = utils._gather(
+        lambda: utils._pypi(update_cache, names),
+        lambda: utils._github(update_cache, names=names, branch=branch, tag=tag),
+        utils.installed,
+    )
+    packages = utils._create_install_list(names, branch, commit, tag, update_cache,
+                                          pkgs_github=pkgs_github, pkgs_installed=pkgs_installed)
     if not packages:
         utils.log.info('No MSL packages to install')
         return
@@ -118,6 +123,7 @@ def install(*names, **kwargs):
         pip_options.extend(['--quiet'] * utils._pip_quiet)
     if '--disable-pip-version-check' not in pip_options:
         pip_options.append('--disable-pip-version-check')
+    pip_options.extend(utils._pip_index_options(pip_options))
 
     for name, values in packages.items():
         if name in pkgs_pypi and not (branch or commit or tag):
@@ -139,3 +145,5 @@ def install(*names, **kwargs):
             if values['extras_require']:
                 repo += values['extras_require']
             subprocess.call(exe + pip_options + [repo])
+
+    utils._invalidate_memo('installed')
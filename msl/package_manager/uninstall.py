@@ -110,3 +110,5 @@ def uninstall(*names, **kwargs):
                 fp.writelines(init)
             with open(os.path.join(path, 'examples', '__init__.py'), mode='wt') as fp:
                 fp.writelines(examples_init)
+
+    utils._invalidate_memo('installed')
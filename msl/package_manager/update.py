@@ -95,11 +95,18 @@ def update(*names, **kwargs):
     if github_suffix is None:
         return
 
-    # keep the order of the log messages consistent: pypi -> github -> local
-    pkgs_pypi = utils.pypi(update_cache=update_cache)
-    pkgs_github = utils.github(update_cache=update_cache)
-    pkgs_installed = utils.installed()
-    pkgs_non_msl = utils.outdated_pypi_packages(pkgs_installed) if include_non_msl else {}
+    def local():
+        # the outdated non-MSL packages depend on the installed packages
+        pkgs = utils.installed()
+        return pkgs, utils.outdated_pypi_packages(pkgs) if include_non_msl else {}
+
+    # get the information from PyPI, GitHub and the installed packages concurrently,
+    # the order of the log messages is still consistent: pypi -> github -> local
+    pkgs_pypi, pkgs_github, (pkgs_installed, pkgs_non_msl) = utils._gather(
+        lambda: utils._pypi(update_cache, names=None if all_msl else names),
+        lambda: utils._github(update_cache, names=None if all_msl else names, branch=branch, tag=tag),
+        local,
+    )
     if not pkgs_github and not pkgs_pypi and not pkgs_non_msl:
         return
 
@@ -276,6 +283,7 @@ def update(*names, **kwargs):
         pip_options.extend(['--quiet'] * utils._pip_quiet)
     if '--disable-pip-version-check' not in pip_options:
         pip_options.append('--disable-pip-version-check')
+    pip_options.extend(utils._pip_index_options(pip_options))
 
     # install MSL packages
     for pkg, info in msl_pkgs_to_update.items():
@@ -327,5 +335,7 @@ def update(*names, **kwargs):
                 utils.log.warning('Rolling back to %r', requires)
                 subprocess.call(exe + pip_options + [requires])
 
+    utils._invalidate_memo('installed')
+
     if updating_msl_package_manager:
         return 'updating_msl_package_manager'
@@ -6,30 +6,55 @@ Functions for the API.
 .. _repositories: https://github.com/MSLNZ
 .. _JSON: https://www.json.org/
 """
+import atexit
 import base64
+import codecs
 import collections
+import contextlib
+import copy
 import datetime
 import fnmatch
 import getpass
+import gzip
+import io
 import json
 import logging
 import os
 import platform
+import random
 import re
 import shlex
+import sqlite3
 import struct
 import subprocess
 import sys
+import tempfile
 import textwrap
 import threading
 import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # then Windows
+    import msvcrt
 
 try:
     from importlib import reload
-    from urllib.request import urlopen, Request, HTTPError, URLError
+    from html.parser import HTMLParser
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import unquote, urljoin, urlsplit
+    from urllib.request import Request, HTTPError, URLError, getproxies, proxy_bypass
+    from urllib.request import pathname2url, url2pathname
+    from urllib.request import urlopen as _urlopen
 except ImportError:  # then Python 2
     from imp import reload
-    from urllib2 import urlopen, Request, HTTPError, URLError
+    from HTMLParser import HTMLParser
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib import unquote, getproxies, proxy_bypass, pathname2url, url2pathname
+    from urlparse import urljoin, urlsplit
+    from urllib2 import Request, HTTPError, URLError
+    from urllib2 import urlopen as _urlopen
 
 import pkg_resources
 from colorama import Back
@@ -48,6 +73,81 @@ if not os.path.isdir(_HOME_DIR):
 
 _GITHUB_AUTH_PATH = os.path.join(_HOME_DIR, 'github-auth')
 
+# the permissions of a new file (see _file_mode)
+_new_file_mode = None
+
+# returned when a conditional request replies with "304 Not Modified"
+_NOT_MODIFIED = object()
+
+# returned when a request was not sent because the rate limit is (almost) exhausted
+_RATE_LIMITED = object()
+
+# the media type of the JSON Simple API, see PEP 691
+_PYPI_SIMPLE_JSON = 'application/vnd.pypi.simple.v1+json'
+
+# the MSL projects that are available on PyPI
+_PYPI_PROJECTS = ('msl-package-manager', 'msl-network', 'msl-loadlib', 'msl-io',
+                  'GTC', 'Quantity-Value')
+
+# the PyPI search for the projects of the Measurement Standards Laboratory
+_PYPI_SEARCH = '/search/?q=%22Measurement+Standards+Laboratory+of+New+Zealand%22&o='
+
+# the maximum number of pages of the PyPI search results to request
+_PYPI_SEARCH_MAX_PAGES = 50
+
+# the number of seconds to remember that a project does not exist on PyPI
+_PYPI_MISSING_TTL = 60 * 60 * 24 * 7
+
+# the types of the network filesystems (from /proc/mounts) that SQLite cannot use a write-ahead log on
+_NETWORK_FILESYSTEMS = ('9p', 'afs', 'ceph', 'cifs', 'glusterfs', 'lustre', 'ncpfs', 'nfs', 'nfs4',
+                        'smb3', 'smbfs', 'sshfs', 'webdav')
+
+# the default time that each field of the cached information is valid for,
+# a new version (or a new package) is released more often than a description changes
+_CACHE_TTL = {'version': '1d', 'description': '7d'}
+
+# the GitHub GraphQL queries, the details of a batch of repositories are requested in one query
+_GRAPHQL_BATCH_SIZE = 25
+_GRAPHQL_TAGS_ORDER = {'field': 'TAG_COMMIT_DATE', 'direction': 'DESC'}
+_GRAPHQL_BRANCHES_ORDER = {'field': 'ALPHABETICAL', 'direction': 'ASC'}
+
+_GRAPHQL_REPOS_QUERY = """
+query ($cursor: String) {
+  organization(login: "MSLNZ") {
+    repositories(first: 100, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes { name description primaryLanguage { name } pushedAt updatedAt }
+    }
+  }
+}
+"""
+
+_GRAPHQL_DETAILS_FRAGMENT = """
+fragment details on Repository {
+  name description primaryLanguage { name } pushedAt updatedAt
+  latestRelease { tagName name }
+  tags: refs(refPrefix: "refs/tags/", first: 100, orderBy: {field: TAG_COMMIT_DATE, direction: DESC}) {
+    pageInfo { hasNextPage endCursor }
+    nodes { name }
+  }
+  branches: refs(refPrefix: "refs/heads/", first: 100, orderBy: {field: ALPHABETICAL, direction: ASC}) {
+    pageInfo { hasNextPage endCursor }
+    nodes { name }
+  }
+}
+"""
+
+_GRAPHQL_REFS_QUERY = """
+query ($name: String!, $prefix: String!, $order: RefOrder, $cursor: String) {
+  repository(owner: "MSLNZ", name: $name) {
+    refs(refPrefix: $prefix, first: 100, after: $cursor, orderBy: $order) {
+      pageInfo { hasNextPage endCursor }
+      nodes { name }
+    }
+  }
+}
+"""
+
 # the HOME_DIR changed from ~/.msl to ~/.msl/package-manager
 # move a previously-created github-auth file to the new HOME_DIR
 _old_auth_path = os.path.join(os.path.expanduser('~'), '.msl', '.mslpm-github-auth')
@@ -125,16 +225,72 @@ def github(update_cache=False):
     :class:`dict`
         The information about the MSL repositories_ that are available on GitHub.
     """
-    packages, path = _inspect_github_pypi('github', update_cache)
+    return _github(update_cache)
+
+
+def _github(update_cache, names=None, branch=None, tag=None):
+    """Get the information about the MSL repositories_ that are available on GitHub.
+
+    The `names`, `branch` and `tag` parameters describe what information the
+    command that is running needs. If the cache must be updated, the requests
+    for this information are sent first and the other requests are sent only
+    if the GitHub rate limit allows for it (otherwise the cached information
+    is used).
+
+    Parameters
+    ----------
+    update_cache : :class:`bool`
+        Whether to force the cache to be updated.
+    names : :class:`tuple` of :class:`str`, optional
+        The names of the packages that the command uses. If not specified
+        then the command uses all packages.
+    branch : :class:`str`, optional
+        The name of a git branch that the command uses.
+    tag : :class:`str`, optional
+        The name of a git tag that the command uses.
+
+    Returns
+    -------
+    :class:`dict`
+        The information about the MSL repositories_ that are available on GitHub.
+    """
+    packages = _inspect_github_pypi('github', update_cache)
     if packages:
         return packages
+    return _single_flight('github', lambda: _update_github(names, branch, tag, update_cache))
+
 
-    def fetch(url_suffix):
+def _update_github(names, branch, tag, update_cache):
+    """Update the GitHub cache. See :func:`_github` for the parameters.
+
+    Only the fields that expired are requested again, unless `update_cache` is :data:`True`.
+    """
+    def fetch(url_suffix, state, conditional=False):
+        # If `conditional` is True then the ETag/Last-Modified values from
+        # the previous refresh are sent and _NOT_MODIFIED is returned if
+        # the cached information for this endpoint is still valid.
+        # The errors and the new ETag values are added to `state`.
         url = 'https://api.github.com' + url_suffix
+        request_headers = headers.copy()
+        validator = etags.get(url_suffix, {})
+        if conditional:
+            if validator.get('etag'):
+                request_headers['If-None-Match'] = validator['etag']
+            if validator.get('last-modified'):
+                request_headers['If-Modified-Since'] = validator['last-modified']
+        if not _github_rate_limit.acquire():
+            return _RATE_LIMITED
         try:
-            response = urlopen(Request(url, headers=headers))
+            response = _http_pool.urlopen(Request(url, headers=request_headers))
         except HTTPError as err:
-            if err.code == 401 or (err.code == 403 and 'Forbidden' in err.msg):
+            _github_rate_limit.update(err.headers)
+            if err.code in (403, 429):
+                # could be a primary or a secondary rate limit, slow down
+                pool.throttle()
+            if err.code == 304:
+                state['etags'][url_suffix] = validator
+                return _NOT_MODIFIED
+            elif err.code == 401 or (err.code == 403 and 'Forbidden' in err.msg):
                 msg = ('You have provided invalid authorisation credentials',)
             elif err.code == 404:
                 # Page not found error.
@@ -144,8 +300,11 @@ def github(update_cache=False):
                 # then this error would silently occur but must be fixed.
                 return dict()
             elif err.code == 403:
-                reply = fetch('/rate_limit')
-                core = reply.get('resources', {}).get('core', {})
+                core = _github_rate_limit.core()
+                if core.get('remaining') is None:
+                    # the reply did not include the X-RateLimit-* headers
+                    reply = fetch('/rate_limit', _new_fetch_state())
+                    core = reply.get('resources', {}).get('core', {}) if isinstance(reply, dict) else {}
                 if core.get('remaining') == 0:
                     reset = core.get('reset', -1)
                     if reset > 0:
@@ -159,39 +318,99 @@ def github(update_cache=False):
                     msg = ("%s (no 'remaining' key)", err)
             else:
                 msg = ('Unhandled %s', err)
-            fetch_errors[err.code] = msg
+            state['errors'][err.code] = msg
         except URLError:
             # Possible reasons for this error are:
             # 1. Computer has no internet access
             # 2. GitHub server is offline
             # 3. The hostname for the GitHub API has changed
-            fetch_errors[0] = ('Cannot access %s', url)
+            _github_rate_limit.update(None)
+            state['errors'][0] = ('Cannot access %s', url)
         else:
-            return json.loads(response.read().decode('utf-8'))
-
-    def fetch_latest_release(repo_name):
-        reply = fetch('/repos/MSLNZ/{}/releases/latest'.format(repo_name))
-        if reply:
-            def verify(ver):
-                # ensure that the version is valid according to PEP 440
-                try:
-                    ver = ver.lstrip('v')
-                    packaging.version.Version(ver)
-                    return ver
-                except packaging.version.InvalidVersion:
-                    return ''
-            version = verify(reply['tag_name']) or verify(reply['name'])
+            _github_rate_limit.update(response.headers)
+            try:
+                reply = json.load(response)
+            except (URLError, ValueError) as err:
+                # the body of the reply is truncated or it is not JSON
+                state['errors'][0] = ('Cannot read the reply from %s -- %s', url, err)
+                return
+            validator = {}
+            for key in ('etag', 'last-modified'):
+                value = response.headers.get(key)
+                if value:
+                    validator[key] = value
+            last_page = _last_page(response.headers.get('link'))
+            if last_page > 1:
+                validator['last-page'] = last_page
+            if validator:
+                state['etags'][url_suffix] = validator
+            return reply
+
+    def fetch_all(url_suffix, state, conditional=False):
+        # GitHub paginates the reply. Fetch the first page to get the number of
+        # the last page from the Link header and then fetch the remaining pages
+        # concurrently. Returns _NOT_MODIFIED only if every page was not modified.
+        def suffix(page):
+            return '{}?per_page=100&page={}'.format(url_suffix, page)
+
+        def fetch_page(page):
+            page_state = _new_fetch_state()
+            return fetch(suffix(page), page_state, conditional=first is _NOT_MODIFIED), page_state
+
+        first = fetch(suffix(1), state, conditional=conditional)
+        if not first or first is _RATE_LIMITED:
+            return first
+
+        last_page = state['etags'].get(suffix(1), {}).get('last-page', 1)
+        replies = [first]
+        for reply, page_state in pool.map(fetch_page, range(2, last_page+1)):
+            _merge_fetch_state(state, page_state)
+            replies.append(reply)
+
+        if all(reply is _NOT_MODIFIED for reply in replies):
+            return _NOT_MODIFIED
+
+        # the cached information is not stored per page so if only some of
+        # the pages were modified the unmodified pages must be fetched again
+        items = []
+        for index, reply in enumerate(replies):
+            if reply is _NOT_MODIFIED:
+                reply = fetch(suffix(index+1), state)
+            if reply is None or reply is _RATE_LIMITED:
+                return reply
+            items.extend(reply)
+        return items
+
+    def fetch_repo(name):
+        # runs in a worker thread, the returned state is merged by the calling thread
+        state = _new_fetch_state()
+        reply = fetch('/repos/MSLNZ/{}'.format(name), state, conditional=name in cached)
+        return name, reply, state
+
+    def fetch_details(task):
+        # runs in a worker thread, the returned state is merged by the calling thread
+        repo_name, item = task
+        state = _new_fetch_state()
+        conditional = repo_name in cached
+        if item == 'version':
+            reply = fetch('/repos/MSLNZ/{}/releases/latest'.format(repo_name), state, conditional=conditional)
+            if reply is _RATE_LIMITED:
+                value = _RATE_LIMITED
+            elif reply is _NOT_MODIFIED:
+                value = cached[repo_name]['version']
+            elif reply:
+                value = _release_version(reply['tag_name'], reply['name'])
+            else:
+                value = ''
         else:
-            version = ''
-        pkgs[repo_name]['version'] = version
-
-    def fetch_tags(repo_name):
-        reply = fetch('/repos/MSLNZ/{}/tags'.format(repo_name))
-        pkgs[repo_name]['tags'] = [tag['name'] for tag in reply] if reply else []
-
-    def fetch_branches(repo_name):
-        reply = fetch('/repos/MSLNZ/{}/branches'.format(repo_name))
-        pkgs[repo_name]['branches'] = [branch['name'] for branch in reply] if reply else []
+            reply = fetch_all('/repos/MSLNZ/{}/{}'.format(repo_name, item), state, conditional=conditional)
+            if reply is _RATE_LIMITED:
+                value = _RATE_LIMITED
+            elif reply is _NOT_MODIFIED:
+                value = cached[repo_name][item]
+            else:
+                value = [r['name'] for r in reply] if reply else []
+        return repo_name, item, value, state
 
     # Check if the user specified their GitHub authorisation credentials.
     # The os.environ option is used for CI testing, it is not the
@@ -211,49 +430,143 @@ def github(update_cache=False):
 
     log.debug('Getting the repositories from GitHub')
 
-    fetch_errors = {}
+    # the cached information (even if it has expired) and the ETag/Last-Modified
+    # values of each endpoint are used to send conditional requests, a
+    # "304 Not Modified" reply does not count against the GitHub rate limit
+    cached = _store().load('github')
+    etags = _load_json(_etags_path('github')) if cached else {}
+    valid = _valid_fields('github', update_cache)
 
-    # when more than 100 repos exist we'll need to also fetch "?per_page=100&page=2"
-    repos = fetch('/orgs/MSLNZ/repos?per_page=100&page=1')
-    if not repos:
-        # even though updating the cache was requested just reload the cached data
-        # because GitHub cannot be connected to right now
-        for error in fetch_errors.values():
-            log.warning(*error)
-        cache, _ = _inspect_github_pypi('github', False)
-        return cache
+    # if the command uses specific packages then only get the
+    # information about these repositories and merge it with the cache
+    targets = _explicit_names(names)
+
+    if auth:
+        # The GraphQL API requires authorisation. It gets the information
+        # about all repositories in a few requests instead of 3 requests per
+        # repository. Use the REST API if the GraphQL requests fail.
+        # a forced update requests the details of every repository
+        candidates = [c for name in targets for c in _repo_candidates(name)] if targets else None
+        pkgs = _github_graphql(headers, candidates, None if update_cache else cached)
+        if pkgs and targets and _all_resolved(targets, pkgs):
+            return _merge_cache('github', pkgs)
+        if pkgs and not targets:
+            _store().replace('github', pkgs)
+            return _sort_packages(pkgs)
+
+    # the errors and the new ETag values from all requests are merged into this state
+    state = _new_fetch_state()
+    fetch_errors, new_etags = state['errors'], state['etags']
+
+    pool = _AdaptivePool()
 
     pkgs = dict()
-    for repo in repos:
-        if repo['language'] == 'Python':
-            if repo['description'] is None:
-                repo['description'] = ''
-            pkgs[repo['name']] = {'description': repo['description']}
-
-    threads = [
-        threading.Thread(target=fcn, args=(repo_name,))
-        for fcn in [fetch_latest_release, fetch_tags, fetch_branches]
-        for repo_name in pkgs
-    ]
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
+    if targets:
+        candidates = [c for name in targets for c in _repo_candidates(name)]
+        for candidate, reply, task_state in pool.map(fetch_repo, candidates):
+            _merge_fetch_state(state, task_state)
+            if reply is _NOT_MODIFIED:
+                pkgs[candidate] = _repo_summary(cached[candidate])
+            elif reply and reply is not _RATE_LIMITED and reply.get('language') == 'Python':
+                pkgs[reply['name']] = _repo_summary(reply)
+        if fetch_errors or not _all_resolved(targets, pkgs):
+            # get the information about all repositories instead
+            targets = None
+            pkgs = dict()
+            fetch_errors.clear()
+
+    if not targets:
+        # a "304 Not Modified" reply can only be used if the timestamps were cached
+        # and a forced update does not send a conditional request for the listing
+        conditional = not update_cache and bool(cached) and \
+            all('pushed_at' in value for value in cached.values())
+        repos = fetch_all('/orgs/MSLNZ/repos', state, conditional=conditional)
+        if repos is _RATE_LIMITED:
+            log.warning('The GitHub rate limit is exhausted, using the cached information')
+            return _inspect_github_pypi('github', False) or cached
+        if not repos:
+            # even though updating the cache was requested just reload the cached data
+            # because GitHub cannot be connected to right now
+            for error in fetch_errors.values():
+                log.warning(*error)
+            return _inspect_github_pypi('github', False) or cached
+
+        if repos is _NOT_MODIFIED:
+            for name, value in cached.items():
+                pkgs[name] = _repo_summary(value)
+        else:
+            for repo in repos:
+                if repo['language'] == 'Python':
+                    pkgs[repo['name']] = _repo_summary(repo)
+
+    # the releases, tags and branches of a repository are only requested if
+    # it was pushed to or updated since the cache was last updated and the
+    # version field expired, the description is included in the reply above
+    changed = []
+    checked = dict((name, ['description']) for name in pkgs)
+    for name, value in pkgs.items():
+        unchanged = not update_cache and _unchanged(value, cached.get(name))
+        if unchanged or 'version' in valid.get(name, ()):
+            for item in ('version', 'tags', 'branches'):
+                value[item] = cached[name][item]
+            if unchanged:
+                checked[name].append('version')
+            else:
+                # keep the cached timestamps (and do not send a conditional request for the
+                # repositories next time) so that the change is detected when the version expires
+                value['pushed_at'] = cached[name]['pushed_at']
+                value['updated_at'] = cached[name]['updated_at']
+                for url_suffix in list(new_etags):
+                    if url_suffix.startswith('/orgs/MSLNZ/repos?'):
+                        del new_etags[url_suffix]
+            prefix = '/repos/MSLNZ/{}/'.format(name)
+            for url_suffix, validator in etags.items():
+                if url_suffix.startswith(prefix):
+                    new_etags[url_suffix] = validator
+        else:
+            changed.append(name)
+            checked[name].append('version')
+
+    # the requests for the information that the command needs are sent first,
+    # the pool runs the tasks in order and the remaining requests are only sent
+    # if the rate limit allows (the cached information is used otherwise)
+    needed_item = 'tags' if tag else 'branches' if branch else 'version'
+    needed_repos = _check_wildcards_and_prefix(names, pkgs, quiet=True) if names else pkgs
+    tasks = sorted(
+        ((repo_name, item) for item in ('version', 'tags', 'branches') for repo_name in changed),
+        key=lambda task: (task[1] != needed_item or task[0] not in needed_repos)
+    )
+    rate_limited = []
+    for repo_name, item, value, task_state in pool.map(fetch_details, tasks):
+        if value is _RATE_LIMITED:
+            rate_limited.append(repo_name)
+            value = cached[repo_name][item] if repo_name in cached else ('' if item == 'version' else [])
+            if 'version' in checked[repo_name]:
+                checked[repo_name].remove('version')
+        pkgs[repo_name][item] = value
+        _merge_fetch_state(state, task_state)
     for error in fetch_errors.values():
         log.warning(*error)
+    if rate_limited:
+        reset = _github_rate_limit.core().get('reset', -1)
+        hm = datetime.datetime.fromtimestamp(reset+60).strftime('%I:%M%p') if reset > 0 else 'an hour'
+        log.warning('The GitHub rate limit is almost exhausted, using the cached information for %d '
+                    'repositories. Retry after %s to update the cache.', len(set(rate_limited)), hm)
 
     # replace the failed requests with the cached information
-    if fetch_errors and os.path.isfile(path):
-        with open(path, mode='rt') as fp:
-            cached = json.load(fp)
+    if fetch_errors and cached:
         for name, value in pkgs.items():
             for item in ('version', 'tags', 'branches'):
                 if not value[item] and name in cached:
                     pkgs[name][item] = cached[name][item]
 
-    with open(path, mode='wt') as fp:
-        json.dump(pkgs, fp, indent=2)
+    if targets:
+        etags.update(new_etags)
+        _save_json(_etags_path('github'), etags)
+        return _merge_cache('github', pkgs, checked=checked)
 
+    _store().replace('github', pkgs, checked=checked)
+    _save_json(_etags_path('github'), new_etags)
     return _sort_packages(pkgs)
 
 
@@ -351,7 +664,16 @@ def installed():
     """
     log.debug('Getting the packages from %s', os.path.dirname(sys.executable))
 
-    gh = github(update_cache=False)
+    # the packages that are installed only change if a directory
+    # in sys.path changes (or if the GitHub cache changes)
+    stamp = (_store().stamp(), _sys_path_stamp())
+    pkgs = _memo_get('installed', stamp)
+    if pkgs is not None:
+        return pkgs
+
+    # use the cached information even if it has expired, updating the
+    # cache is only required to know which repositories are available
+    gh = _store().load('github') or github(update_cache=False)
 
     # refresh the working_set
     reload(pkg_resources)
@@ -387,7 +709,7 @@ def installed():
             'requires': requires,
         }
 
-    return _sort_packages(pkgs)
+    return _memo_set('installed', stamp, _sort_packages(pkgs))
 
 
 def outdated_pypi_packages(msl_installed=None):
@@ -410,7 +732,7 @@ def outdated_pypi_packages(msl_installed=None):
     pkgs_to_update = dict()
     log.debug('Checking PyPI for all non-MSL packages that are outdated')
     try:
-        output = subprocess.check_output([sys.executable, '-m', 'pip', 'list', '--outdated'])
+        output = subprocess.check_output([sys.executable, '-m', 'pip', 'list', '--outdated'] + _pip_index_options([]))
     except subprocess.CalledProcessError as e:
         log.error('ERROR: processing "pip list --outdated" raised -> %s', e)
         return pkgs_to_update
@@ -491,66 +813,280 @@ def pypi(update_cache=False):
     :class:`dict`
         The information about the MSL packages_ that are available on PyPI.
     """
-    packages, path = _inspect_github_pypi('pypi', update_cache)
+    return _pypi(update_cache)
+
+
+def _pypi(update_cache, names=None):
+    """Get the information about the MSL packages_ that are available on PyPI.
+
+    If the cache must be updated and the command only uses specific packages
+    (none of the `names` contain a wildcard) then only the information about
+    these packages is retrieved and it is merged with the cached information.
+
+    Parameters
+    ----------
+    update_cache : :class:`bool`
+        Whether to force the cache to be updated.
+    names : :class:`tuple` of :class:`str`, optional
+        The names of the packages that the command uses. If not specified
+        then the command uses all packages.
+
+    Returns
+    -------
+    :class:`dict`
+        The information about the MSL packages_ that are available on PyPI.
+    """
+    packages = _inspect_github_pypi('pypi', update_cache)
     if packages:
         return packages
+    return _single_flight('pypi', lambda: _update_pypi(names, update_cache))
 
-    def request(endpoint):
-        url = 'https://pypi.org' + endpoint
+
+def _update_pypi(names, update_cache):
+    """Update the PyPI cache. See :func:`_pypi` for the parameters.
+
+    Only the fields that expired are requested again, unless `update_cache` is :data:`True`.
+    """
+    def request(url, accept=None, validator=None, stream=False):
+        # returns _NOT_MODIFIED if the ETag/Last-Modified value in `validator` is still valid
+        request_headers = headers.copy()
+        if accept:
+            request_headers['Accept'] = accept
+        if validator and validator.get('etag'):
+            request_headers['If-None-Match'] = validator['etag']
+        if validator and validator.get('last-modified'):
+            request_headers['If-Modified-Since'] = validator['last-modified']
         try:
-            response = urlopen(Request(url, headers=headers))
+            response = _http_pool.urlopen(Request(url, headers=request_headers), stream=stream)
+        except HTTPError as err:
+            if err.code in (304, 404):
+                answered.append(url)
+            if err.code == 304:
+                return _NOT_MODIFIED
+            if err.code == 404 and accept != 'text/html':
+                missing[url] = time.time()
         except URLError:
-            log.error('Cannot access %s', url)
+            pass
         else:
-            return response.read().decode('utf-8')
-
-    def use_json_api():
-        # use the JSON API as a backup way to get the package information from PyPI
-        projects = ('msl-package-manager', 'msl-network', 'msl-loadlib', 'msl-io',
-                    'GTC', 'Quantity-Value')
-        for project in projects:
-            response = request('/pypi/{}/json'.format(project))
-            if response:
-                _info = json.loads(response).get('info')
-                if _info:
-                    pkgs[project] = {
-                        'version': _info.get('version', 'UNKNOWN'),
-                        'description': _info.get('summary', 'UNKNOWN')
-                    }
+            answered.append(url)
+            return response
+
+    def get_validator(response):
+        return dict((k, response.headers.get(k)) for k in ('etag', 'last-modified', 'x-pypi-last-serial')
+                    if response.headers.get(k))
+
+    def search_page(page):
+        # runs in a worker thread, the page is parsed while it is downloaded
+        # and only the names of the projects (and the page numbers) are kept
+        parser = _SearchResultsParser(lambda snippet: found.append(snippet['name']))
+        response = request(root + _PYPI_SEARCH + '&page={}'.format(page), accept='text/html', stream=True)
+        if response:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                try:
+                    chunk = response.read(16384)
+                except URLError:
+                    # the connection was reset, keep the names that were found
+                    break
+                if not chunk:
+                    break
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+        return parser.last_page
+
+    def fetch_version(name):
+        # the JSON Simple API (PEP 691) lists every version and whether the files of
+        # a version were yanked (the /json endpoint does not), returns None if the
+        # version is not available and _NOT_MODIFIED if the cached version is valid
+        url = index + _normalize_name(name) + '/'
+        validator = etags.get(url, {}) if name in cached else {}
+        response = request(url, accept=_PYPI_SIMPLE_JSON, validator=validator)
+        if response is _NOT_MODIFIED:
+            new_etags[url] = validator
+            return _NOT_MODIFIED
+        if not response:
+            return
+        with response:
+            if not response.headers.get('content-type', '').startswith(_PYPI_SIMPLE_JSON):
+                # e.g., the index does not support PEP 691 and replied with HTML
+                response.read()  # releases the connection
+                return
+            try:
+                simple = json.load(response)
+            except (URLError, ValueError):
+                # the body of the reply is truncated or it is not JSON
+                return
+            new_validator = get_validator(response)
+            if new_validator:
+                new_etags[url] = new_validator
+            return _latest_version(simple)
+
+    def keep_validators(name):
+        # the requests for a project were not sent, keep the ETag values
+        for url in (root + '/pypi/{}/json'.format(name), index + _normalize_name(name) + '/'):
+            if url in etags:
+                new_etags[url] = etags[url]
+
+    def fetch_project(project):
+        # runs in a worker thread, a 404 reply means that the project does not exist,
+        # returns the name, the information and the fields that were retrieved
+        url = root + '/pypi/{}/json'.format(project) if warehouse else index + _normalize_name(project) + '/'
+        if time.time() - missing.get(url, 0) < _PYPI_MISSING_TTL:
+            return
+
+        # the fields that have not expired are not requested again (a simple
+        # index does not provide the description so only the version matters)
+        cached_name = cached_names.get(project.lower())
+        fields = valid.get(cached_name, ())
+        if 'version' in fields and (not warehouse or 'description' in fields):
+            keep_validators(cached_name)
+            return cached_name, cached[cached_name], ()
+        if warehouse and 'description' in fields:
+            keep_validators(cached_name)
+            version = fetch_version(cached_name)
+            if version is _NOT_MODIFIED:
+                return cached_name, cached[cached_name], ('version',)
+            if not version:
+                return cached_name, cached[cached_name], ()
+            return cached_name, dict(cached[cached_name], version=version), ('version',)
+
+        # a project that is cached is only downloaded and parsed again if it changed,
+        # i.e., if the ETag or the X-PyPI-Last-Serial value of the project changed
+        validator = etags.get(url, {}) if cached_name else {}
+        accept = None if warehouse else _PYPI_SIMPLE_JSON + ', text/html;q=0.1'
+        response = request(url, accept=accept, validator=validator)
+        if response is _NOT_MODIFIED:
+            keep_validators(cached_name)
+            return cached_name, cached[cached_name], all_fields
+        if not response:
+            if url in missing or not cached_name:
+                return
+            # only a "404 Not Found" reply removes a project, if the request
+            # failed for another reason the cached information is kept
+            keep_validators(cached_name)
+            return cached_name, cached[cached_name], ()
+
+        new_validator = get_validator(response)
+        serial = new_validator.get('x-pypi-last-serial')
+        if cached_name and serial and serial == validator.get('x-pypi-last-serial'):
+            response.read()  # releases the connection
+            keep_validators(cached_name)
+            new_etags[url] = new_validator
+            return cached_name, cached[cached_name], all_fields
+
+        if not warehouse:
+            # a simple index (PEP 503 or PEP 691) does not include the summary of a
+            # project and it cannot be verified that a project is an MSL project
+            simple = _parse_simple(response, _normalize_name(project))
+            if simple is None:
+                # the body of the reply is truncated or it cannot be decoded, keep the cached information
+                if not cached_name:
+                    return
+                keep_validators(cached_name)
+                return cached_name, cached[cached_name], ()
+            version = _latest_version(simple)
+            if not version:
+                missing[url] = time.time()
+                return
+            new_etags[url] = new_validator
+            name = cached_name or github_names.get(project.lower(), project)
+            description = (cached.get(name) or github_cached.get(name) or {}).get('description')
+            return name, {'version': version, 'description': description or 'UNKNOWN'}, all_fields
+
+        try:
+            _info = json.load(response).get('info')
+        except (URLError, ValueError):
+            # the body of the reply is truncated or it is not JSON, keep the cached information
+            if not cached_name:
+                return
+            keep_validators(cached_name)
+            return cached_name, cached[cached_name], ()
+        if not _info or not _is_msl_project(_info):
+            # a package (egg) name of an MSL repository could be the name of another project
+            missing[url] = time.time()
+            return
+        if new_validator:
+            new_etags[url] = new_validator
+        name = _info.get('name', project)
+        description = _info.get('summary') or 'UNKNOWN'
+        if 'version' in fields:
+            keep_validators(name)
+            if new_validator:
+                new_etags[url] = new_validator
+            return name, dict(cached[cached_name], description=description), ('description',)
+
+        version = fetch_version(name)
+        if version is _NOT_MODIFIED:
+            version = cached[name]['version']
+        return name, {
+            'version': version or _info.get('version', 'UNKNOWN'),
+            'description': description,
+        }, all_fields
 
     pkgs = dict()
     log.debug('Getting the packages from PyPI')
     headers = {'User-Agent': _PKG_NAME + '/Python'}
 
-    # use the /search endpoint before the /json endpoint since searching does not
-    # depend on knowing in advance what MSL packages are available on PyPI
-    reply = request('/search/?q=%22Measurement+Standards+Laboratory+of+New+Zealand%22&o=')
-    if reply:
-        items = re.findall(
-            r'<span class="package-snippet__name">(?P<name>.+)</span>\s+'
-            r'<span class="package-snippet__version">(?P<version>.+)</span>\s+'
-            r'<span class="package-snippet__created">.+\s+(?P<created>.+)\s+.+\s+.+\s+'
-            r'<p class="package-snippet__description">(?P<description>.+)</p>',
-            reply,
-        )
-        for item in items:
-            name, version, created, description = item
-            pkgs[name] = {
-                'version': version,
-                'description': description,
-            }
-        if not pkgs:
-            log.warning('The regex pattern is invalid for the /search route, using /json instead')
-            use_json_api()
-    else:
-        use_json_api()
-
-    if not pkgs:
-        return _inspect_github_pypi('pypi', False)[0]
-
-    with open(path, mode='wt') as fp:
-        json.dump(pkgs, fp, indent=2)
-
+    # PyPI (and TestPyPI) also provide the JSON API and the search
+    index = _index_url()
+    parts = urlsplit(index)
+    root = '{}://{}'.format(parts.scheme, parts.netloc)
+    warehouse = parts.netloc in ('pypi.org', 'test.pypi.org')
+
+    # the projects that do not exist (a "404 Not Found" reply) are
+    # not requested again until _PYPI_MISSING_TTL seconds have elapsed
+    missing_path = os.path.join(_HOME_DIR, 'pypi-missing.json')
+    missing = dict((k, v) for k, v in _load_json(missing_path).items() if time.time() - v < _PYPI_MISSING_TTL)
+
+    cached = _store().load('pypi')
+    cached_names = dict((name.lower(), name) for name in cached)
+    github_cached = _store().load('github')
+    github_names = dict((name.lower(), name) for name in github_cached)
+    etags = _load_json(_etags_path('pypi')) if cached else {}
+    new_etags = dict()
+    valid = _valid_fields('pypi', update_cache)
+    all_fields = tuple(_CACHE_TTL)
+    checked = dict()
+    answered = []
+
+    targets = _explicit_names(names)
+    if targets:
+        candidates = [c for name in targets for c in _repo_candidates(name)]
+        for result in _AdaptivePool().map(fetch_project, candidates):
+            if result:
+                pkgs[result[0]], checked[result[0]] = result[1], result[2]
+        if _all_resolved(targets, pkgs):
+            _save_json(missing_path, missing)
+            etags.update(new_etags)
+            _save_json(_etags_path('pypi'), etags)
+            return _merge_cache('pypi', pkgs, checked=checked)
+        # a name could be a package that has a different name on PyPI
+        pkgs = dict()
+
+    # the PyPI search discovers MSL projects that are not an MSL repository on GitHub,
+    # the first page tells how many pages there are and the other pages are
+    # requested concurrently (the search is not required, it may be unavailable)
+    found = []
+    pool = _AdaptivePool()
+    if warehouse:
+        last_page = min(search_page(1), _PYPI_SEARCH_MAX_PAGES)
+        pool.map(search_page, range(2, last_page+1))
+    candidates = _pypi_candidates(egg_names=warehouse)
+    lower = set(c.lower() for c in candidates)
+    candidates.extend(name for name in found if name.lower() not in lower)
+
+    for result in pool.map(fetch_project, candidates):
+        if result:
+            pkgs[result[0]], checked[result[0]] = result[1], result[2]
+    _save_json(missing_path, missing)
+
+    if not pkgs or not answered:
+        log.error('Cannot access %s', index)
+        return _inspect_github_pypi('pypi', False) or cached
+
+    _store().replace('pypi', pkgs, checked=checked)
+    _save_json(_etags_path('pypi'), new_etags)
     return _sort_packages(pkgs)
 
 
@@ -596,13 +1132,63 @@ def _ask_proceed():
             response = _get_input(ask).lower()
 
 
+def _all_resolved(names, pkgs):
+    """Check whether each name matches a package (with or without the msl- prefix).
+
+    Parameters
+    ----------
+    names : :class:`list` of :class:`str`
+        The package names (without wildcards).
+    pkgs : :class:`dict`
+        The packages.
+
+    Returns
+    -------
+    :class:`bool`
+        Whether each name matches a package.
+    """
+    lower = set(p.lower() for p in pkgs)
+    return all(any(c.lower() in lower for c in _repo_candidates(name)) for name in names)
+
+
+def _cache_ttl():
+    """Get the time that each field of the cached information is valid for.
+
+    The value of the ``MSL_PM_CACHE_TTL`` environment variable is a comma-separated
+    list of ``field=duration`` pairs, e.g., ``version=1h,description=30d``. The
+    ``version`` field includes the releases, tags and branches of a repository (and
+    which packages are available) and the ``description`` field is the description
+    of a repository or the summary of a PyPI package. The default value is
+    ``version=1d,description=7d``.
+
+    Returns
+    -------
+    :class:`dict`
+        The number of seconds that each field is valid for.
+    """
+    ttl = dict((field, _parse_duration(value)) for field, value in _CACHE_TTL.items())
+    value = os.environ.get('MSL_PM_CACHE_TTL', '')
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        field, _, duration = item.partition('=')
+        field = field.strip().lower()
+        try:
+            if field not in ttl:
+                raise ValueError
+            ttl[field] = _parse_duration(duration)
+        except ValueError:
+            log.warning('Invalid MSL_PM_CACHE_TTL value %r, using the default value', item)
+    return ttl
+
+
 def _check_kwargs(kwargs, allowed):
     for item in kwargs:
         if item not in allowed:
             log.warning('Invalid kwarg %r', item)
 
 
-def _check_wildcards_and_prefix(names, pkgs):
+def _check_wildcards_and_prefix(names, pkgs, quiet=False):
     """Check if a Unix shell-style wildcard was used or if the package
     name starts with the msl- prefix.
 
@@ -612,6 +1198,8 @@ def _check_wildcards_and_prefix(names, pkgs):
        The package names.
     pkgs : :class:`dict`
        The GitHub repositories or the installed packages.
+    quiet : :class:`bool`, optional
+       Whether to suppress the log messages.
 
     Returns
     -------
@@ -626,7 +1214,8 @@ def _check_wildcards_and_prefix(names, pkgs):
             continue
         result = found.groupdict()
         if not result['package_name']:
-            log.error('Invalid package name %r', name)
+            if not quiet:
+                log.error('Invalid package name %r', name)
             continue
         found_it = False
         for prefix in ['', 'msl-']:
@@ -636,12 +1225,35 @@ def _check_wildcards_and_prefix(names, pkgs):
                     'extras_require': result['extras_require'],
                     'version_requested': result['version_requested']
                 }
-        if not found_it:
+        if not found_it and not quiet:
             log.warning('No MSL packages match %r', name)
     return _packages
 
 
-def _create_install_list(names, branch, commit, tag, update_cache):
+def _count_lookup(where, event):
+    """Count an event of a cache.
+
+    The counts are added to the statistics in the ``cache-stats.json`` file
+    when the process exits (see :func:`_save_lookups`).
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    event : :class:`str`
+        One of 'hits' (the cache was used), 'stale' (an expired cache was used
+        while it is updated in the background), 'misses' (the cache had to be
+        updated first), 'refreshes' (the cache was updated from GitHub or PyPI)
+        or 'shared' (the cache was updated from the shared cache).
+    """
+    with _lookups_lock:
+        if not _lookups:
+            atexit.register(_save_lookups)
+        key = (where, event)
+        _lookups[key] = _lookups.get(key, 0) + 1
+
+
+def _create_install_list(names, branch, commit, tag, update_cache, pkgs_github=None, pkgs_installed=None):
     """Create a list of package names to ``install`` that are GitHub repositories_.
 
     Parameters
@@ -656,6 +1268,10 @@ def _create_install_list(names, branch, commit, tag, update_cache):
         The name of a git tag.
     update_cache : :class:`bool`
         Whether to force the GitHub cache to be updated when you call this function.
+    pkgs_github : :class:`dict`, optional
+        The GitHub repositories (if they were already gathered).
+    pkgs_installed : :class:`dict`, optional
+        The installed packages (if they were already gathered).
 
     Returns
     -------
@@ -667,8 +1283,11 @@ def _create_install_list(names, branch, commit, tag, update_cache):
         return
 
     # keep the order of the log messages consistent: pypi -> github -> local
-    pkgs_github = github(update_cache=update_cache)
-    pkgs_installed = installed()
+    if pkgs_github is None or pkgs_installed is None:
+        pkgs_github, pkgs_installed = _gather(
+            lambda: _github(update_cache, names=names, branch=branch, tag=tag),
+            installed,
+        )
 
     if not names:  # e.g., the --all flag
         packages = dict((pkg, {'extras_require': None, 'version_requested': None})
@@ -729,6 +1348,132 @@ def _create_uninstall_list(names):
     return pkgs
 
 
+def _etags_path(where):
+    """Returns the path to the file that contains the ETag/Last-Modified values.
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github', 'pypi' or 'shared' (the shared cache).
+
+    Returns
+    -------
+    :class:`str`
+        The path to the file.
+    """
+    return os.path.join(_HOME_DIR, where+'-etags.json')
+
+
+def _explicit_names(names):
+    """Get the package names if none of the names contain a wildcard.
+
+    Parameters
+    ----------
+    names : :class:`tuple` of :class:`str` or :data:`None`
+        The package names that were requested (can include the
+        extras_require and version specifiers).
+
+    Returns
+    -------
+    :class:`list` of :class:`str` or :data:`None`
+        The package names (without the extras_require and version specifiers)
+        or :data:`None` if `names` is empty or if a name contains a wildcard.
+    """
+    if not names:
+        return
+    explicit = []
+    for name in names:
+        found = re.search(_package_name_regex, name)
+        package_name = found.group('package_name') if found else ''
+        if not package_name or '*' in package_name:
+            return
+        explicit.append(package_name)
+    return explicit
+
+
+def _file_mode(directory):
+    """Get the permissions that a file which :func:`open` creates would have.
+
+    The permissions depend on the umask. The umask can only be read by
+    setting it, which would also change the permissions of the files that
+    other threads create at the same time, so the permissions of a new file
+    are used instead. The value is only determined once.
+
+    Parameters
+    ----------
+    directory : :class:`str`
+        A directory that a new file can be created in.
+
+    Returns
+    -------
+    :class:`int`
+        The permissions, e.g., 0o644.
+    """
+    global _new_file_mode
+
+    if _new_file_mode is None:
+        tmp = tempfile.mkdtemp(dir=directory)
+        path = os.path.join(tmp, 'mode')
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            _new_file_mode = os.stat(path).st_mode & 0o777
+        finally:
+            if os.path.isfile(path):
+                os.remove(path)
+            os.rmdir(tmp)
+    return _new_file_mode
+
+
+def _gather(*tasks):
+    """Call independent functions concurrently.
+
+    The log messages of each function are buffered and are emitted in the
+    order of `tasks` (not in the order that the messages were created) after
+    all functions have returned.
+
+    Parameters
+    ----------
+    *tasks
+        The functions to call (without arguments).
+
+    Returns
+    -------
+    :class:`list`
+        The value that each function returned.
+    """
+    results = [None] * len(tasks)
+    records = [[] for _ in tasks]
+    errors = [None] * len(tasks)
+
+    def run(index):
+        _log_buffer.local.records = records[index]
+        try:
+            results[index] = tasks[index]()
+        except Exception as e:
+            # a KeyboardInterrupt (or SystemExit) is raised immediately
+            errors[index] = e
+        finally:
+            _log_buffer.local.records = None
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(1, len(tasks))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    run(0)
+    for thread in threads:
+        # a timeout allows for a KeyboardInterrupt to be handled
+        while thread.is_alive():
+            thread.join(0.1)
+
+    for buffered in records:
+        for record in buffered:
+            log.handle(record)
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
 def _get_input(msg):
     """Get input from the user.
 
@@ -783,8 +1528,124 @@ def _get_github_url_suffix(branch=None, commit=None, tag=None):
     return tag
 
 
+def _github_graphql(headers, names=None, cached=None):
+    """Get the information about the MSL repositories_ from the GitHub GraphQL API.
+
+    Parameters
+    ----------
+    headers : :class:`dict`
+        The headers to include with each request. Must include
+        the (Basic) ``Authorization`` header.
+    names : :class:`list` of :class:`str`, optional
+        The names of the repositories to get the information about (a name
+        that is not a repository is ignored). If not specified then get
+        the information about all repositories.
+    cached : :class:`dict`, optional
+        The cached information. The details of a repository are only requested
+        if its ``pushed_at`` or ``updated_at`` timestamp has changed.
+
+    Returns
+    -------
+    :class:`dict` or :data:`None`
+        The information about the MSL repositories_ (in the same format
+        that :func:`github` returns) or :data:`None` if the information
+        could not be retrieved.
+    """
+    # the GraphQL API requires a token, it does not accept "username:token"
+    token = base64.b64decode(headers['Authorization'][6:]).decode('utf-8').split(':')[-1]
+    headers = headers.copy()
+    headers['Authorization'] = 'bearer ' + token
+
+    def query(q, **variables):
+        data = json.dumps({'query': q, 'variables': variables}).encode('utf-8')
+        try:
+            response = _http_pool.urlopen(Request('https://api.github.com/graphql', data=data, headers=headers))
+            reply = json.load(response)
+        except (HTTPError, URLError, ValueError) as err:
+            log.debug('GraphQL request failed -- %s', err)
+            return
+        errors = [e for e in reply.get('errors') or [] if not (names and e.get('type') == 'NOT_FOUND')]
+        if errors or not reply.get('data'):
+            log.debug('GraphQL request failed -- %s', errors[0].get('message') if errors else 'no data')
+            return
+        return reply['data']
+
+    def ref_names(refs, prefix, order, repo_name):
+        # follow the cursor if a repository has more than 100 tags (or branches)
+        items = [node['name'] for node in refs['nodes']]
+        page_info = refs['pageInfo']
+        while page_info['hasNextPage']:
+            data = query(_GRAPHQL_REFS_QUERY, name=repo_name, prefix=prefix,
+                         order=order, cursor=page_info['endCursor'])
+            if data is None:
+                return
+            refs = data['repository']['refs']
+            items.extend(node['name'] for node in refs['nodes'])
+            page_info = refs['pageInfo']
+        return items
+
+    pkgs = dict()
+    cursor = None
+    while names is None:
+        data = query(_GRAPHQL_REPOS_QUERY, cursor=cursor)
+        if data is None:
+            return
+        repositories = data['organization']['repositories']
+        for node in repositories['nodes']:
+            language = node['primaryLanguage'] or {}
+            if language.get('name') == 'Python':
+                pkgs[node['name']] = {
+                    'description': node['description'] or '',
+                    'pushed_at': node['pushedAt'] or '',
+                    'updated_at': node['updatedAt'] or '',
+                }
+        if not repositories['pageInfo']['hasNextPage']:
+            break
+        cursor = repositories['pageInfo']['endCursor']
+
+    # request the details of multiple repositories in each query by using aliases
+    repo_names = names
+    if names is None:
+        repo_names = []
+        for name, value in pkgs.items():
+            if _unchanged(pkgs[name], (cached or {}).get(name)):
+                for key in ('version', 'tags', 'branches'):
+                    value[key] = cached[name][key]
+            else:
+                repo_names.append(name)
+    for i in range(0, len(repo_names), _GRAPHQL_BATCH_SIZE):
+        batch = repo_names[i:i+_GRAPHQL_BATCH_SIZE]
+        aliases = '\n'.join(
+            'r{}: repository(owner: "MSLNZ", name: {}) {{ ...details }}'.format(j, json.dumps(name))
+            for j, name in enumerate(batch)
+        )
+        data = query('query {\n' + aliases + '\n}\n' + _GRAPHQL_DETAILS_FRAGMENT)
+        if data is None:
+            return
+        for j in range(len(batch)):
+            repo = data.get('r{}'.format(j))
+            if not repo or (repo['primaryLanguage'] or {}).get('name') != 'Python':
+                continue
+            name = repo['name']
+            pkgs[name] = {
+                'description': repo['description'] or '',
+                'pushed_at': repo['pushedAt'] or '',
+                'updated_at': repo['updatedAt'] or '',
+            }
+            release = repo['latestRelease']
+            pkgs[name]['version'] = _release_version(release['tagName'], release['name']) if release else ''
+            for key, prefix, order in (('tags', 'refs/tags/', _GRAPHQL_TAGS_ORDER),
+                                       ('branches', 'refs/heads/', _GRAPHQL_BRANCHES_ORDER)):
+                items = ref_names(repo[key], prefix, order, name)
+                if items is None:
+                    return
+                pkgs[name][key] = items
+
+    return pkgs
+
+
 def _inspect_github_pypi(where, update_cache):
-    """Inspects the HOME directory for the cached json file.
+    """Inspects the metadata store for the cached packages.
 
     Parameters
     ----------
@@ -796,9 +1657,7 @@ def _inspect_github_pypi(where, update_cache):
     Returns
     -------
     :class:`dict`
-        The packages.
-    :class:`str`
-        The path to the cached file.
+        The packages. Empty if the cache must be updated.
     """
     if where == 'github':
         suffix = 'GitHub repositories'
@@ -807,79 +1666,800 @@ def _inspect_github_pypi(where, update_cache):
     else:
         assert False, '{!r} != github or pypi'.format(where)
 
-    path = os.path.join(_HOME_DIR, where+'.json')
+    if update_cache:
+        return dict()
+
+    store = _store()
+    stamp = store.stamp()
+    packages = _memo_get(where, stamp)
+    if packages is not None:
+        log.debug('Loaded the cached information about the %s', suffix)
+        return packages
+
+    overdue = store.overdue(where, _cache_ttl())
+    if overdue is None:
+        _count_lookup(where, 'misses')
+        return dict()
+
+    # Each field of the cached information expires separately (see _cache_ttl).
+    # If a field has expired then use the expired (stale) cache and update the
+    # expired fields in a background process unless a field expired more than
+    # the maximum staleness ago, in which case the cache must be updated first.
+    stale = overdue >= 0
+    if stale and overdue >= _max_stale():
+        _count_lookup(where, 'misses')
+        return dict()
+
+    packages = store.load(where)
+    if not packages:
+        _count_lookup(where, 'misses')
+        return dict()
+
+    log.debug('Loaded the cached information about the %s', suffix)
+    if stale:
+        _count_lookup(where, 'stale')
+        _revalidate_in_background(where)
+    else:
+        _count_lookup(where, 'hits')
 
-    cached_pgks = None
-    if os.path.isfile(path):
-        with open(path, mode='rt') as f:
-            cached_pgks = _sort_packages(json.load(f))
+    # the loaded information is reused until a field expires (or until the
+    # maximum staleness, a background process is already updating the cache)
+    # or until the store changes
+    expires = time.time() - overdue + (_max_stale() if stale else 0)
+    return _memo_set(where, stamp, packages, expires=expires)
 
-    one_day = 60 * 60 * 24
-    if (not update_cache) and (cached_pgks is not None) and (time.time() < os.path.getmtime(path) + one_day):
-        # The installed() function also calls github() so this log message could be displayed twice.
-        # Avoid seeing the following log message when the installed() function was previously called.
-        if where == 'pypi' or not _ColourStreamHandler.previous_message.endswith(os.path.dirname(sys.executable)):
-            log.debug('Loaded the cached information about the %s', suffix)
-        return _sort_packages(cached_pgks), path
 
-    return dict(), path
+def _index_url():
+    """Get the URL of the package index.
 
+    The ``MSL_PM_INDEX_URL`` environment variable (or, if it is not defined, the
+    ``PIP_INDEX_URL`` environment variable) can be the URL of a mirror of PyPI,
+    of a devpi server or of a local ``file://`` simple index.
 
-def _log_install_uninstall_message(packages, action, branch=None, commit=None, tag=None, pkgs_pypi=None):
-    """Print the ``install`` or ``uninstall`` summary for what is going to happen.
+    Returns
+    -------
+    :class:`str`
+        The URL of the simple (PEP 503) index. Ends with a ``/``.
+    """
+    url = os.environ.get('MSL_PM_INDEX_URL') or os.environ.get('PIP_INDEX_URL') or 'https://pypi.org/simple/'
+    return url.rstrip('/') + '/'
+
+
+def _invalidate_memo(*keys):
+    """Forget the information that was loaded by this process.
 
     Parameters
     ----------
-    packages : :class:`dict`
-        The packages that are affected.
-    action : :class:`str`
-        The text to show in color and in upper case about what's happening.
-    branch : :class:`str` or :data:`None`
-        The name of a git branch to use. Only used when installing packages.
-    commit : :class:`str` or :data:`None`
-        The hash value of a git commit to use. Only used when installing packages.
-    tag : :class:`str` or :data:`None`
-        The name of a git tag to use. Only used when installing packages.
-    pkgs_pypi : :class:`dict`
-        Packages that are on PyPI. Only used when installing packages.
+    *keys
+        The keys to forget (e.g., 'github', 'pypi' or 'installed').
+        If not specified then forget everything.
     """
-    pkgs = _sort_packages(packages)
+    with _memo_lock:
+        if not keys:
+            _memo.clear()
+        for key in keys:
+            _memo.pop(key, None)
 
-    w = [0, 0]
-    for pkg, values in pkgs.items():
-        if values.get('extras_require'):
-            w[0] = max(w[0], len(pkg + values['extras_require']))
-        else:
-            w[0] = max(w[0], len(pkg))
-        if values.get('version_requested'):
-            w[1] = max(w[1], len(values['version_requested']))
-        else:
-            w[1] = max(w[1], len(values['version']))
 
-    msg = '\n{}The following MSL packages will be {}{}{}:\n'.format(Fore.RESET, Fore.CYAN, action, Fore.RESET)
-    for pkg, values in pkgs.items():
-        name = pkg
-        if values.get('extras_require'):
-            name += values['extras_require']
-        if values.get('version_requested'):
-            version = values['version_requested'].replace('==', '')
-        else:
-            version = '' if (branch or commit or tag) else values['version']
-        msg += '\n  {}  {} '.format(name.ljust(w[0]), version.ljust(w[1]))
-        if action == 'REMOVED':
-            continue
-        if branch is not None:
-            msg += ' [branch:{}]'.format(branch)
-        elif commit is not None:
-            msg += ' [commit:{}]'.format(commit[:7])
-        elif tag is not None:
-            msg += ' [tag:{}]'.format(tag)
-        elif pkg in pkgs_pypi:
-            msg += ' [PyPI]'
-        else:
-            msg += ' [GitHub]'
+def _is_network_path(path):
+    """Check whether a path is on a network share.
 
-    log.info(msg)
+    Parameters
+    ----------
+    path : :class:`str`
+        The path to check.
+
+    Returns
+    -------
+    :class:`bool`
+        Whether the path is on a network share. If it cannot be determined
+        (e.g., on macOS) then :data:`False` is returned.
+    """
+    path = os.path.realpath(path)
+    if _IS_WINDOWS:
+        if path.startswith('\\\\'):
+            return True
+        import ctypes
+        drive = os.path.splitdrive(path)[0] + '\\'
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) == 4  # DRIVE_REMOTE
+
+    try:
+        with open('/proc/mounts', mode='rt') as fp:
+            mounts = [line.split()[1:3] for line in fp if len(line.split()) > 2]
+    except (IOError, OSError):
+        return False
+
+    # the filesystem of the path is the filesystem of the longest mount point that contains the path
+    mount_point, fs_type = '', ''
+    for mount, typ in mounts:
+        mount = mount.replace('\\040', ' ')
+        if (path == mount or path.startswith(mount.rstrip('/') + '/')) and len(mount) >= len(mount_point):
+            mount_point, fs_type = mount, typ
+    return fs_type.split('.')[-1] in _NETWORK_FILESYSTEMS
+
+
+def _is_msl_project(info):
+    """Check whether a project on PyPI is an MSL project.
+
+    Parameters
+    ----------
+    info : :class:`dict`
+        The value of the ``info`` key from the ``/pypi/<project>/json`` endpoint.
+
+    Returns
+    -------
+    :class:`bool`
+        Whether a URL of the project is for MSLNZ or the author
+        (or maintainer) is the Measurement Standards Laboratory.
+    """
+    urls = [info.get('home_page') or '']
+    urls.extend((info.get('project_urls') or {}).values())
+    if any('mslnz' in (url or '').lower() for url in urls):
+        return True
+    people = ' '.join(info.get(key) or '' for key in ('author', 'author_email', 'maintainer', 'maintainer_email'))
+    return 'measurement standards laboratory' in people.lower()
+
+
+def _last_page(link):
+    """Get the number of the last page from the value of a Link header.
+
+    Parameters
+    ----------
+    link : :class:`str` or :data:`None`
+        The value of the Link header, e.g.,
+        ``<https://api.github.com/...&page=2>; rel="next", <https://api.github.com/...&page=5>; rel="last"``
+
+    Returns
+    -------
+    :class:`int`
+        The number of the last page. Returns 1 if there is no ``rel="last"`` link.
+    """
+    if link:
+        for item in link.split(','):
+            found = re.search(r'<[^>]*[?&]page=(\d+)[^>]*>\s*;\s*rel="last"', item)
+            if found:
+                return int(found.group(1))
+    return 1
+
+
+def _latest_version(simple):
+    """Get the latest version of a project from the reply of the JSON Simple API.
+
+    Parameters
+    ----------
+    simple : :class:`dict`
+        The reply from the ``/simple/<project>/`` endpoint (see PEP 691 and PEP 700).
+
+    Returns
+    -------
+    :class:`str`
+        The latest version that has at least one file that was not yanked.
+        A pre-release is only returned if there is no final release. An
+        empty string is returned if the latest version cannot be determined.
+    """
+    def parse(version):
+        try:
+            return packaging.version.parse(version)
+        except packaging.version.InvalidVersion:
+            return
+
+    # the version of a file is not a key of the file so it is parsed from the filename
+    name = re.escape(simple.get('name', '')).replace(r'\-', '-').replace('-', '[-_.]')
+    regex = re.compile(r'^{}-(?P<version>[^-]+?)(?:\.tar\.gz|\.zip|-)'.format(name), flags=re.IGNORECASE)
+
+    files = simple.get('files') or []
+    available = set()
+    for item in files:
+        match = regex.match(item.get('filename', ''))
+        if match and not item.get('yanked'):
+            available.add(parse(match.group('version')))
+
+    parsed = []
+    for version in simple.get('versions') or []:
+        v = parse(version)
+        if v is not None and (not files or v in available):
+            parsed.append((v, version))
+    if not parsed:
+        # PEP 700 (the "versions" key) is not supported by the index
+        parsed = [(v, str(v)) for v in available if v is not None]
+    if not parsed:
+        return ''
+    final = [item for item in parsed if not item[0].is_prerelease]
+    return max(final or parsed)[1]
+
+
+def _load_json(path):
+    """Load a JSON_ file.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path to a JSON_ file.
+
+    Returns
+    -------
+    :class:`dict`
+        The content of the file or an empty :class:`dict` if
+        the file does not exist or if it cannot be decoded.
+    """
+    try:
+        with open(path, mode='rt') as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return dict()
+
+
+def _load_lookups():
+    """Load the statistics of the caches (see :func:`_save_lookups`).
+
+    Returns
+    -------
+    :class:`dict`
+        The keys are 'github' and/or 'pypi' and each value is a :class:`dict`
+        with the number of times that each event (see :func:`_count_lookup`)
+        occurred.
+    """
+    return _load_json(os.path.join(_HOME_DIR, 'cache-stats.json'))
+
+
+def _log_install_uninstall_message(packages, action, branch=None, commit=None, tag=None, pkgs_pypi=None):
+    """Print the ``install`` or ``uninstall`` summary for what is going to happen.
+
+    Parameters
+    ----------
+    packages : :class:`dict`
+        The packages that are affected.
+    action : :class:`str`
+        The text to show in color and in upper case about what's happening.
+    branch : :class:`str` or :data:`None`
+        The name of a git branch to use. Only used when installing packages.
+    commit : :class:`str` or :data:`None`
+        The hash value of a git commit to use. Only used when installing packages.
+    tag : :class:`str` or :data:`None`
+        The name of a git tag to use. Only used when installing packages.
+    pkgs_pypi : :class:`dict`
+        Packages that are on PyPI. Only used when installing packages.
+    """
+    pkgs = _sort_packages(packages)
+
+    w = [0, 0]
+    for pkg, values in pkgs.items():
+        if values.get('extras_require'):
+            w[0] = max(w[0], len(pkg + values['extras_require']))
+        else:
+            w[0] = max(w[0], len(pkg))
+        if values.get('version_requested'):
+            w[1] = max(w[1], len(values['version_requested']))
+        else:
+            w[1] = max(w[1], len(values['version']))
+
+    msg = '\n{}The following MSL packages will be {}{}{}:\n'.format(Fore.RESET, Fore.CYAN, action, Fore.RESET)
+    for pkg, values in pkgs.items():
+        name = pkg
+        if values.get('extras_require'):
+            name += values['extras_require']
+        if values.get('version_requested'):
+            version = values['version_requested'].replace('==', '')
+        else:
+            version = '' if (branch or commit or tag) else values['version']
+        msg += '\n  {}  {} '.format(name.ljust(w[0]), version.ljust(w[1]))
+        if action == 'REMOVED':
+            continue
+        if branch is not None:
+            msg += ' [branch:{}]'.format(branch)
+        elif commit is not None:
+            msg += ' [commit:{}]'.format(commit[:7])
+        elif tag is not None:
+            msg += ' [tag:{}]'.format(tag)
+        elif pkg in pkgs_pypi:
+            msg += ' [PyPI]'
+        else:
+            msg += ' [GitHub]'
+
+    log.info(msg)
+
+
+def _max_stale():
+    """Get the maximum staleness of an expired cache.
+
+    The value of the ``MSL_PM_CACHE_MAX_STALE`` environment variable is a duration,
+    e.g., ``90`` (seconds), ``30m``, ``12h`` or ``7d``. The default value is ``7d``.
+    A value of ``0`` disables using an expired cache.
+
+    Returns
+    -------
+    :class:`float`
+        The number of seconds that an expired cache can be used for
+        (while the cache is updated in a background process).
+    """
+    value = os.environ.get('MSL_PM_CACHE_MAX_STALE', '7d')
+    try:
+        return _parse_duration(value)
+    except ValueError:
+        log.warning('Invalid MSL_PM_CACHE_MAX_STALE value %r, using 7d', value)
+        return _parse_duration('7d')
+
+
+def _memo_get(key, stamp):
+    """Get the information that was already loaded by this process.
+
+    Parameters
+    ----------
+    key : :class:`str`
+        The key, e.g., 'github', 'pypi' or 'installed'.
+    stamp
+        A value that changes if the source of the information changes.
+
+    Returns
+    -------
+    :class:`dict` or :data:`None`
+        A copy of the information or :data:`None` if the information must be
+        loaded again (it was not loaded, it expired or the stamp changed).
+    """
+    with _memo_lock:
+        item = _memo.get(key)
+    if item is None or item[0] != stamp or time.time() >= item[1]:
+        return
+    return copy.deepcopy(item[2])
+
+
+def _memo_set(key, stamp, value, expires=float('inf')):
+    """Remember the information that was loaded by this process.
+
+    Parameters
+    ----------
+    key : :class:`str`
+        The key, e.g., 'github', 'pypi' or 'installed'.
+    stamp
+        A value that changes if the source of the information changes.
+    value : :class:`dict`
+        The information.
+    expires : :class:`float`, optional
+        The time when the information expires.
+
+    Returns
+    -------
+    :class:`dict`
+        The `value` (a copy is remembered so the caller may modify it).
+    """
+    with _memo_lock:
+        _memo[key] = (stamp, expires, copy.deepcopy(value))
+    return value
+
+
+def _merge_cache(where, pkgs, checked=None):
+    """Merge the information about some packages with the cached information.
+
+    The time that the cache was updated does not change so that the
+    information about the other packages still expires when it would have.
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    pkgs : :class:`dict`
+        The information about the packages that was just retrieved.
+    checked : :class:`dict`, optional
+        The fields of each package that were retrieved. Default is all fields.
+
+    Returns
+    -------
+    :class:`collections.OrderedDict`
+        The merged information.
+    """
+    store = _store()
+    store.merge(where, pkgs, checked=checked)
+    return store.load(where)
+
+
+def _merge_fetch_state(state, other):
+    """Merge the errors and the ETag values of a worker thread into `state`.
+
+    Parameters
+    ----------
+    state : :class:`dict`
+        The state to update (see :func:`_new_fetch_state`).
+    other : :class:`dict`
+        The state of a worker thread.
+    """
+    for key, value in other.items():
+        state[key].update(value)
+
+
+def _new_fetch_state():
+    """Create a new state for the requests that a worker thread sends.
+
+    Each worker thread collects its own errors and ETag values and the
+    thread that submitted the task merges them (see :func:`_merge_fetch_state`)
+    so that no state is shared between the worker threads.
+
+    Returns
+    -------
+    :class:`dict`
+        The keys are ``errors`` and ``etags``.
+    """
+    return {'errors': {}, 'etags': {}}
+
+
+def _normalize_name(name):
+    """Normalize the name of a project, see PEP 503.
+
+    Parameters
+    ----------
+    name : :class:`str`
+        The name of a project.
+
+    Returns
+    -------
+    :class:`str`
+        The normalized name.
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def _parse_duration(value):
+    """Convert a duration to seconds.
+
+    Parameters
+    ----------
+    value : :class:`str`
+        A number with an optional ``s``, ``m``, ``h`` or ``d`` suffix
+        (seconds, minutes, hours or days). No suffix means seconds.
+
+    Returns
+    -------
+    :class:`float`
+        The number of seconds.
+
+    Raises
+    ------
+    ValueError
+        If `value` is not a valid duration.
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([smhd]?)\s*$', value.lower())
+    if not match:
+        raise ValueError('Invalid duration {!r}'.format(value))
+    number, unit = match.groups()
+    return float(number) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[unit]
+
+
+def _parse_simple(response, name):
+    """Parse the reply from the page of a project in a simple index.
+
+    Parameters
+    ----------
+    response : :class:`_HTTPResponse`
+        The reply. The format is either JSON (PEP 691) or HTML (PEP 503).
+    name : :class:`str`
+        The normalized name of the project.
+
+    Returns
+    -------
+    :class:`dict` or :data:`None`
+        The reply in the JSON (PEP 691) format, with the ``name`` and
+        ``files`` keys (and the ``versions`` key if the index supports it).
+        :data:`None` if the body of the reply is truncated or if a JSON
+        reply cannot be decoded.
+    """
+    if (response.headers.get('content-type') or '').startswith(_PYPI_SIMPLE_JSON):
+        try:
+            return json.load(response)
+        except (URLError, ValueError):
+            return
+
+    files = []
+
+    class Parser(HTMLParser):
+        def handle_starttag(self, tag, attrs):
+            if tag == 'a':
+                attrs = dict(attrs)
+                path = urlsplit(attrs.get('href') or '').path
+                files.append({'filename': unquote(path.rsplit('/', 1)[-1]), 'yanked': 'data-yanked' in attrs})
+
+    try:
+        body = response.read()
+    except URLError:
+        return
+    parser = Parser()
+    parser.feed(body.decode('utf-8', 'replace'))
+    parser.close()
+    return {'name': name, 'files': files}
+
+
+def _pip_index_options(pip_options):
+    """Get the pip options to use the package index from the ``MSL_PM_INDEX_URL`` environment variable.
+
+    Parameters
+    ----------
+    pip_options : :class:`list` of :class:`str`
+        The options that are passed to pip.
+
+    Returns
+    -------
+    :class:`list` of :class:`str`
+        The ``--index-url`` option, or an empty list if ``MSL_PM_INDEX_URL`` is
+        not defined or if an index option was specified in `pip_options`.
+    """
+    if not os.environ.get('MSL_PM_INDEX_URL'):
+        return []
+    for option in pip_options:
+        # also the combined forms, e.g., -ihttps://... and --index-url=https://...
+        if option == '--no-index' or option.startswith(('-i', '--index-url')):
+            return []
+    return ['--index-url', _index_url()]
+
+
+def _pypi_candidates(egg_names=True):
+    """Get the names of the projects that could be available on PyPI.
+
+    Parameters
+    ----------
+    egg_names : :class:`bool`, optional
+        Whether to include the package (egg) names of the repositories
+        that have a different package name.
+
+    Returns
+    -------
+    :class:`list` of :class:`str`
+        The known MSL projects, the projects in the PyPI cache, the cached
+        GitHub repositories and (optionally) the package (egg) names.
+    """
+    from .install import _egg_name_map
+
+    names = list(_PYPI_PROJECTS)
+    names.extend(_store().names('pypi'))
+    names.extend(_store().names('github'))
+    if egg_names:
+        names.extend(_egg_name_map.values())
+
+    candidates, lower = [], set()
+    for name in names:
+        if name.lower() not in lower:
+            lower.add(name.lower())
+            candidates.append(name)
+    return candidates
+
+
+def _release_version(tag_name, name):
+    """Get the version of a GitHub release.
+
+    Parameters
+    ----------
+    tag_name : :class:`str`
+        The name of the tag of the release.
+    name : :class:`str`
+        The name of the release.
+
+    Returns
+    -------
+    :class:`str`
+        The version (if `tag_name` is not a valid PEP 440
+        version then `name` is checked) or an empty string if
+        neither value is a valid PEP 440 version.
+    """
+    for ver in (tag_name, name):
+        # ensure that the version is valid according to PEP 440
+        try:
+            ver = (ver or '').lstrip('v')
+            packaging.version.Version(ver)
+            return ver
+        except packaging.version.InvalidVersion:
+            pass
+    return ''
+
+
+def _replace_file(tmp, path):
+    """Replace a file with a temporary file that :func:`tempfile.mkstemp` created.
+
+    The temporary file is only readable by the owner, so it gets the permissions
+    that a file which :func:`open` creates would have (which depend on the umask).
+
+    Parameters
+    ----------
+    tmp : :class:`str`
+        The path to the temporary file.
+    path : :class:`str`
+        The path to the file to replace.
+    """
+    os.chmod(tmp, _file_mode(os.path.dirname(tmp)))
+    os.replace(tmp, path)
+
+
+def _repo_candidates(name):
+    """Get the names that a package name could correspond to.
+
+    Parameters
+    ----------
+    name : :class:`str`
+        A package name. The msl- prefix can be omitted.
+
+    Returns
+    -------
+    :class:`list` of :class:`str`
+        The name and the name with the msl- prefix.
+    """
+    if name.lower().startswith('msl-'):
+        return [name]
+    return [name, 'msl-' + name]
+
+
+def _repo_summary(repo):
+    """Get the description and the timestamps of a repository.
+
+    Parameters
+    ----------
+    repo : :class:`dict`
+        The reply from the GitHub API (or the cached information) about a repository.
+
+    Returns
+    -------
+    :class:`dict`
+        The description and the ``pushed_at`` and ``updated_at`` timestamps.
+    """
+    return {
+        'description': repo.get('description') or '',
+        'pushed_at': repo.get('pushed_at') or '',
+        'updated_at': repo.get('updated_at') or '',
+    }
+
+
+def _revalidate(where, home):
+    """Update a cache. Runs in the background process that :func:`_revalidate_in_background` starts.
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    home : :class:`str`
+        The directory where the cache is located.
+    """
+    global _HOME_DIR
+    _HOME_DIR = home
+    set_log_level(logging.CRITICAL + 1)
+    try:
+        _update_cache(where)
+    finally:
+        try:
+            os.remove(os.path.join(home, where + '.revalidating'))
+        except OSError:
+            pass
+
+
+def _revalidate_in_background(where):
+    """Start a detached process that updates an expired cache.
+
+    A process is not started if another process is already updating the cache.
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    """
+    marker = os.path.join(_HOME_DIR, where + '.revalidating')
+    try:
+        if time.time() - os.path.getmtime(marker) < 600:
+            return
+    except OSError:
+        pass
+
+    command = [
+        sys.executable, '-c',
+        'from msl.package_manager import utils; utils._revalidate({!r}, {!r})'.format(where, _HOME_DIR)
+    ]
+    kwargs = {'close_fds': True}
+    if _IS_WINDOWS:
+        kwargs['creationflags'] = 0x00000008 | 0x00000200  # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+
+    try:
+        with open(marker, mode='wt') as fp:
+            fp.write(str(os.getpid()))
+        with open(os.devnull, mode='r+b') as devnull:
+            subprocess.Popen(command, stdin=devnull, stdout=devnull, stderr=devnull, **kwargs)
+    except (IOError, OSError) as err:
+        log.debug('Cannot update the %s cache in the background -- %s', where, err)
+    else:
+        log.debug('Updating the %s cache in the background', where)
+
+
+def _save_json(path, obj):
+    """Save an object to a JSON_ file.
+
+    The object is written to a temporary file which then replaces the
+    JSON_ file, so another process never reads a partially-written file.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path to the JSON_ file.
+    obj
+        The object to save.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wt') as fp:
+            json.dump(obj, fp, indent=2)
+        _replace_file(tmp, path)
+    except:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _save_lookups():
+    """Add the events that :func:`_count_lookup` counted to the statistics.
+
+    The statistics are not saved in the :class:`_MetadataStore`, since writing
+    to the store changes its :meth:`~_MetadataStore.stamp` and the other
+    processes would then load the cached information again.
+    """
+    with _lookups_lock:
+        counts = dict(_lookups)
+        _lookups.clear()
+    if not counts:
+        return
+    path = os.path.join(_HOME_DIR, 'cache-stats.json')
+    with _FileLock(os.path.join(_HOME_DIR, 'cache-stats.lock'), timeout=5) as lock:
+        if not lock.locked:
+            log.debug('Cannot save the cache statistics, the file is locked')
+            return
+        saved = _load_lookups()
+        for (where, event), count in counts.items():
+            saved.setdefault(where, {})[event] = saved.get(where, {}).get(event, 0) + count
+        try:
+            _save_json(path, saved)
+        except (IOError, OSError) as err:
+            log.debug('Cannot save the cache statistics -- %s', err)
+
+
+def _single_flight(where, update, shared=True):
+    """Update a cache while holding a lock that is shared by all processes.
+
+    If another process is already updating the cache then wait for it to
+    finish and use the information that it retrieved (instead of sending
+    the same requests again).
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    update : :obj:`callable`
+        The function to call to update the cache.
+    shared : :class:`bool`, optional
+        Whether to first get the information from the shared
+        cache (see :func:`_update_from_shared`), if there is one.
+
+    Returns
+    -------
+    :class:`dict`
+        The information about the packages.
+    """
+    started = time.time()
+    with _FileLock(os.path.join(_HOME_DIR, where + '.lock')) as lock:
+        if lock.waited:
+            # the cache was updated by the other process while waiting for the lock
+            age = _store().age(where)
+            if age is not None and age <= time.time() - started:
+                packages = _store().load(where)
+                if packages:
+                    log.debug('Another process updated the %s cache', where)
+                    return packages
+        elif not lock.locked:
+            log.debug('Cannot lock the %s cache, updating it anyway', where)
+        try:
+            _store().check()
+            packages = _update_from_shared(where) if shared else None
+            if packages:
+                _count_lookup(where, 'shared')
+                return packages
+            packages = update()
+            _count_lookup(where, 'refreshes')
+            return packages
+        finally:
+            _invalidate_memo(where, 'installed')
 
 
 def _sort_packages(pkgs):
@@ -898,6 +2478,1765 @@ def _sort_packages(pkgs):
     return collections.OrderedDict([(u'{}'.format(k), pkgs[k]) for k in sorted(pkgs)])
 
 
+def _store():
+    """Get the metadata store in the HOME directory.
+
+    Returns
+    -------
+    :class:`_MetadataStore`
+        The store.
+    """
+    path = os.path.join(_HOME_DIR, 'cache.sqlite3')
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = _MetadataStore(path)
+    return store
+
+
+def _sys_path_stamp():
+    """Get the modification time of each directory in :data:`sys.path`.
+
+    Installing, updating or uninstalling a package modifies a directory in :data:`sys.path`.
+
+    Returns
+    -------
+    :class:`tuple`
+        The modification times.
+    """
+    stamp = []
+    for path in sys.path:
+        try:
+            stamp.append((path, os.stat(path or '.').st_mtime_ns))
+        except OSError:
+            pass
+    return tuple(stamp)
+
+
+def _unchanged(repo, cached):
+    """Check whether a repository has not changed since it was cached.
+
+    Parameters
+    ----------
+    repo : :class:`dict`
+        The description and the timestamps of the repository.
+    cached : :class:`dict` or :data:`None`
+        The cached information about the repository.
+
+    Returns
+    -------
+    :class:`bool`
+        Whether the ``pushed_at`` and ``updated_at`` timestamps are the same
+        as the cached timestamps and the cached information is complete.
+    """
+    if not cached or not repo.get('pushed_at') or not repo.get('updated_at'):
+        return False
+    if any(item not in cached for item in ('version', 'tags', 'branches')):
+        return False
+    return repo['pushed_at'] == cached.get('pushed_at') and repo['updated_at'] == cached.get('updated_at')
+
+
+def _update_cache(where, update_cache=False, shared=True):
+    """Update the fields of all packages in a cache that expired.
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    update_cache : :class:`bool`, optional
+        Whether to update all fields (even the fields that have not expired).
+    shared : :class:`bool`, optional
+        Whether to first get the information from the shared cache, if there is one.
+
+    Returns
+    -------
+    :class:`dict`
+        The information about the packages.
+    """
+    if where == 'github':
+        return _single_flight(where, lambda: _update_github(None, None, None, update_cache), shared=shared)
+    return _single_flight(where, lambda: _update_pypi(None, update_cache), shared=shared)
+
+
+def _update_from_shared(where):
+    """Update a cache from the shared cache.
+
+    The ``MSL_PM_CACHE_URL`` environment variable is the location of the shared
+    cache. It is either the URL of a ``msl cache serve`` process (e.g.,
+    ``http://cache-server:8765``) or a (shared) directory that the process writes
+    the ``github.json`` and ``pypi.json`` files to. The process updates the
+    cache on behalf of all computers that use the shared cache.
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+
+    Returns
+    -------
+    :class:`dict`
+        The information about the packages. Empty if there is no shared cache,
+        if it cannot be accessed or if the information in it has expired for
+        longer than the maximum staleness (the cache must then be updated from
+        GitHub or PyPI).
+    """
+    location = os.environ.get('MSL_PM_CACHE_URL', '').strip()
+    if not location:
+        return dict()
+
+    store = _store()
+    validators_path = _etags_path('shared')
+    validators = _load_json(validators_path)
+    validator = validators.get(where, {}) if store.age(where) is not None else {}
+    if location.startswith(('http://', 'https://')):
+        url = location.rstrip('/') + '/{}.json'.format(where)
+        headers = {'User-Agent': _PKG_NAME + '/Python'}
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        try:
+            response = _http_pool.urlopen(Request(url, headers=headers))
+        except HTTPError as err:
+            if err.code != 304:
+                log.warning('Cannot get the %s cache from %s -- %s', where, url, err)
+                return dict()
+            payload, new_validator = None, validator
+        except URLError as err:
+            log.warning('Cannot access the shared cache %s -- %s', url, err)
+            return dict()
+        else:
+            try:
+                payload, new_validator = json.load(response), {'etag': response.headers.get('etag')}
+            except (URLError, ValueError) as err:
+                log.warning('Cannot decode the %s cache from %s -- %s', where, url, err)
+                return dict()
+    else:
+        if location.startswith('file:'):
+            location = url2pathname(urlsplit(location).path)
+        url = os.path.join(location, where + '.json')
+        try:
+            mtime = os.path.getmtime(url)
+        except OSError as err:
+            log.warning('Cannot access the shared cache %s -- %s', url, err)
+            return dict()
+        if mtime == validator.get('mtime'):
+            payload, new_validator = None, validator
+        else:
+            payload, new_validator = _load_json(url), {'mtime': mtime}
+
+    if payload is not None:
+        if not _valid_shared(where, payload):
+            log.warning('The shared cache %s does not contain valid %s information', url, where)
+            return dict()
+        if not payload['packages']:
+            log.warning('The shared cache %s does not contain the %s packages', url, where)
+            return dict()
+        new_validator['updated'] = payload['updated']
+
+    # the shared cache must also be updated regularly
+    age = time.time() - new_validator.get('updated', 0)
+    if age >= _cache_ttl()['version'] + _max_stale():
+        log.warning('The %s information in the shared cache %s has expired', where, url)
+        return dict()
+
+    if payload is not None:
+        log.debug('Updating the %s cache from the shared cache %s', where, url)
+        store.replace(where, payload['packages'], timestamp=payload['updated'])
+        validators[where] = new_validator
+        _save_json(validators_path, validators)
+    return store.load(where)
+
+
+def _valid_fields(where, update_cache):
+    """Get the fields of each cached package that have not expired.
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    update_cache : :class:`bool`
+        Whether updating the cache was forced. If :data:`True`
+        then all fields are considered to have expired.
+
+    Returns
+    -------
+    :class:`dict`
+        The keys are the names of the packages and each value
+        is a :class:`set` of the fields that have not expired.
+    """
+    if update_cache:
+        return dict()
+    ttl = _cache_ttl()
+    return dict((name, set(ttl) - fields) for name, fields in _store().expired(where, ttl).items())
+
+
+def _valid_shared(where, payload):
+    """Check that the information from a shared cache has the expected structure.
+
+    Parameters
+    ----------
+    where : :class:`str`
+        Either 'github' or 'pypi'.
+    payload
+        The decoded ``github.json`` or ``pypi.json`` file of the shared cache.
+
+    Returns
+    -------
+    :class:`bool`
+        Whether `payload` is a :class:`dict` with a numeric ``updated`` value
+        and a ``packages`` :class:`dict` that maps each name to a :class:`dict`.
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('updated'), (int, float)):
+        return False
+    packages = payload.get('packages')
+    if not isinstance(packages, dict):
+        return False
+    for value in packages.values():
+        if not isinstance(value, dict):
+            return False
+        if where == 'github' and not all(isinstance(value.get(k, []), list) for k in ('tags', 'branches')):
+            return False
+    return True
+
+
+class _AdaptivePool(object):
+    """A cancellable pool of daemon threads with an adaptive concurrency limit.
+
+    The number of tasks that run concurrently follows an additive-increase,
+    multiplicative-decrease (AIMD) rule. The limit increases by (about) one
+    task per round trip while the tasks finish quickly and it is halved if a
+    task takes longer than `max_latency` seconds or if a task calls
+    :meth:`throttle` (e.g., the server replied with a 403 or 429 status code).
+
+    Parameters
+    ----------
+    max_workers : :class:`int`, optional
+        The maximum number of tasks that can run concurrently.
+    initial : :class:`int`, optional
+        The initial number of tasks that can run concurrently.
+    max_latency : :class:`float`, optional
+        The maximum number of seconds that a task should take.
+    """
+
+    def __init__(self, max_workers=16, initial=4, max_latency=5.0):
+        self.max_workers = max_workers
+        self.max_latency = max_latency
+        self.limit = float(max(1, min(initial, max_workers)))
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._local = threading.local()
+        self._num_active = 0
+        self._num_threads = 0
+        self._last_decrease = 0.0
+
+    def map(self, fcn, iterable):
+        """Call `fcn` for each item in `iterable` using the worker threads.
+
+        Waiting for the results can be interrupted (e.g., Ctrl+C), in which
+        case the pending tasks are cancelled.
+
+        Parameters
+        ----------
+        fcn : :term:`callable`
+            The function to call. Receives one item as the argument.
+        iterable
+            The items.
+
+        Returns
+        -------
+        :class:`list`
+            The value that `fcn` returned for each item (in the same order).
+        """
+        items = list(iterable)
+        is_worker = getattr(self._local, 'is_worker', False)
+        results = [None] * len(items)
+        errors = []
+        remaining = [len(items)]
+
+        def done():
+            remaining[0] -= 1
+
+        # the log records of the tasks are buffered if the
+        # calling thread buffers its log records (see _gather)
+        records = getattr(_log_buffer.local, 'records', None)
+
+        def run(index, item):
+            previous = getattr(_log_buffer.local, 'records', None)
+            _log_buffer.local.records = records
+            try:
+                results[index] = fcn(item)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                _log_buffer.local.records = previous
+
+        with self._cond:
+            for index, item in enumerate(items):
+                self._queue.append((run, (index, item), done))
+            while self._num_threads < min(self.max_workers, len(self._queue)):
+                self._num_threads += 1
+                t = threading.Thread(target=self._worker)
+                t.daemon = True
+                t.start()
+            self._cond.notify_all()
+
+        try:
+            while True:
+                with self._cond:
+                    if remaining[0] == 0:
+                        break
+                    # if map was called from within a task then the worker thread runs
+                    # the tasks that it submitted (that have not started) instead of
+                    # only waiting, otherwise all workers could end up waiting
+                    task = self._take(done) if is_worker else None
+                    if task is None:
+                        # use a timeout so that a KeyboardInterrupt is handled
+                        self._cond.wait(0.1)
+                        continue
+                self._run(task, nested=True)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def cancel(self):
+        """Cancel the tasks that have not started."""
+        with self._cond:
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def throttle(self):
+        """Notify the pool that a task was throttled."""
+        with self._cond:
+            self._decrease()
+
+    @property
+    def concurrency(self):
+        """:class:`int`: The number of tasks that can currently run concurrently."""
+        return max(1, int(self.limit))
+
+    def _decrease(self):
+        # only decrease once per second since the tasks
+        # that are running concurrently were also sent too fast
+        now = time.time()
+        if now - self._last_decrease > 1.0:
+            self.limit = max(1.0, self.limit / 2.0)
+            self._last_decrease = now
+
+    def _run(self, task, nested=False):
+        # a nested task runs in a worker thread that is already counted as active
+        run, args, done = task
+        t0 = time.time()
+        try:
+            run(*args)
+        finally:
+            elapsed = time.time() - t0
+            with self._cond:
+                if not nested:
+                    self._num_active -= 1
+                if elapsed > self.max_latency:
+                    self._decrease()
+                else:
+                    self.limit = min(float(self.max_workers), self.limit + 1.0 / self.limit)
+                done()
+                self._cond.notify_all()
+
+    def _take(self, done):
+        # remove the first queued task of a map call (must hold the lock)
+        for task in self._queue:
+            if task[2] is done:
+                self._queue.remove(task)
+                return task
+
+    def _worker(self):
+        self._local.is_worker = True
+        while True:
+            with self._cond:
+                while self._queue and self._num_active >= self.concurrency:
+                    self._cond.wait()
+                if not self._queue:
+                    self._num_threads -= 1
+                    return
+                task = self._queue.popleft()
+                self._num_active += 1
+            self._run(task)
+
+
+class _HTTPConnectionPool(object):
+    """Reuses (keep-alive) HTTP connections for each host.
+
+    Opening a new TCP and TLS connection for each request dominates the time
+    it takes to update the caches when the round-trip time to a server is
+    large. The :meth:`urlopen` method is a replacement for
+    :func:`urllib.request.urlopen` that reuses idle connections and negotiates gzip compression.
+
+    Parameters
+    ----------
+    maxsize : :class:`int`, optional
+        The maximum number of idle connections to keep for each host.
+        If 0 then a new connection is opened for each request.
+    timeout : :class:`float`, optional
+        The number of seconds to wait for a server to respond.
+    retries : :class:`int`, optional
+        The maximum number of times to retry a request that failed because of a
+        transient error (the connection failed, reading the body failed or the
+        status code is 500, 502, 503 or 504). The delay before a retry increases exponentially (with
+        random jitter) from `backoff` seconds up to `max_backoff` seconds.
+    backoff : :class:`float`, optional
+        The maximum delay before the first retry.
+    max_backoff : :class:`float`, optional
+        The maximum delay before a retry.
+    """
+
+    max_redirects = 5
+
+    transient_codes = (500, 502, 503, 504)
+
+    def __init__(self, maxsize=8, timeout=15, retries=2, backoff=0.5, max_backoff=4.0):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._idle = collections.defaultdict(list)
+        self._breakers = collections.defaultdict(_CircuitBreaker)
+        self._lock = threading.Lock()
+
+    def urlopen(self, request, stream=False):
+        """Send a request.
+
+        Parameters
+        ----------
+        request : :class:`~urllib.request.Request`
+            The request to send.
+        stream : :class:`bool`, optional
+            Whether the body is read while the caller reads the response. By
+            default the body is read before the response is returned so that a
+            request is also retried if reading the body fails (e.g., the
+            connection was reset).
+
+        Returns
+        -------
+        :class:`_HTTPResponse`
+            The response. Reading the response decompresses the body. The
+            connection is returned to the pool once the body has been read.
+
+        Raises
+        ------
+        HTTPError
+            If the status code of the response is >= 300 (after following redirects).
+        URLError
+            If a connection to the server cannot be established or if the
+            circuit breaker of the host is open (the host is unreachable).
+        """
+        # only read-only requests are sent so every request can be retried
+        url = request.get_full_url()
+        if url.startswith('file:'):
+            return self._open_file(url)
+        netloc = urlsplit(url).netloc
+        with self._lock:
+            breaker = self._breakers[netloc]
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise URLError('{} is unreachable (the circuit breaker is open)'.format(netloc))
+            try:
+                response = self._open(request, url)
+                if not stream:
+                    response.preload()
+            except HTTPError as e:
+                if e.code not in self.transient_codes:
+                    breaker.success()
+                    raise
+                breaker.failure()
+                if attempt == self.retries:
+                    raise
+                delay = e.headers.get('retry-after') if e.headers else None
+            except URLError:
+                breaker.failure()
+                if attempt == self.retries:
+                    raise
+                delay = None
+            else:
+                breaker.success()
+                return response
+
+            # full jitter, see https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+            cap = min(self.max_backoff, self.backoff * 2 ** attempt)
+            try:
+                delay = min(self.max_backoff, float(delay))
+            except (TypeError, ValueError):
+                delay = random.uniform(0, cap)
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _open_file(url):
+        # a local (PEP 503) simple index has an index.html file in each directory
+        path = url2pathname(urlsplit(url).path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            raise HTTPError(url, 404, 'Not Found', {}, None)
+        return _urlopen('file:' + pathname2url(os.path.abspath(path)))
+
+    def _open(self, request, url):
+        # send the request and follow redirects
+        method = request.get_method()
+        data = request.data
+        headers = dict(request.header_items())
+        headers.setdefault('Accept-Encoding', 'gzip')
+        for _ in range(self.max_redirects + 1):
+            response = self._send(method, url, data, headers)
+            location = response.headers.get('location')
+            if response.status not in (301, 302, 303, 307, 308) or not location:
+                break
+            response.read()
+            url = urljoin(url, location)
+            if response.status == 303 or (response.status in (301, 302) and method == 'POST'):
+                method, data = 'GET', None
+
+        if response.status >= 300:
+            raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(response.read()))
+        return response
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            connections = [conn for idle in self._idle.values() for conn, _ in idle]
+            self._idle.clear()
+        for conn in connections:
+            conn.close()
+
+    def _connect(self, scheme, netloc):
+        # returns the connection and whether the request must use the absolute URL
+        parts = urlsplit(scheme + '://' + netloc)
+        host, port = parts.hostname, parts.port
+        cls = HTTPSConnection if scheme == 'https' else HTTPConnection
+        proxy = None if proxy_bypass(host) else getproxies().get(scheme)
+        if not proxy:
+            return cls(host, port, timeout=self.timeout), False
+
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        p = urlsplit(proxy)
+        if scheme == 'http':
+            return HTTPConnection(p.hostname, p.port or 80, timeout=self.timeout), True
+
+        tunnel_headers = {}
+        if p.username:
+            credentials = '{}:{}'.format(unquote(p.username), unquote(p.password or ''))
+            tunnel_headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+        conn = HTTPSConnection(p.hostname, p.port or 80, timeout=self.timeout)
+        conn.set_tunnel(host, port, headers=tunnel_headers)
+        return conn, False
+
+    def _release(self, key, conn, absolute, reusable):
+        with self._lock:
+            if reusable and len(self._idle[key]) < self.maxsize:
+                self._idle[key].append((conn, absolute))
+                return
+        conn.close()
+
+    def _send(self, method, url, data, headers):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        with self._lock:
+            idle = self._idle[key]
+            conn, absolute = idle.pop() if idle else (None, False)
+
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn, absolute = self._connect(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, url if absolute else path, body=data, headers=headers)
+                raw = conn.getresponse()
+            except (HTTPException, OSError) as e:
+                conn.close()
+                if reused:
+                    # the server may have closed an idle (keep-alive) connection
+                    conn, reused = None, False
+                    continue
+                raise URLError(e)
+            return _HTTPResponse(raw, url, lambda reusable: self._release(key, conn, absolute, reusable))
+
+
+class _CircuitBreaker(object):
+    """Stops sending requests to a host that is unreachable.
+
+    After `threshold` consecutive failures the circuit opens and requests
+    fail immediately. After `cooldown` seconds one (trial) request is
+    allowed, the circuit closes if the trial request succeeds.
+
+    Parameters
+    ----------
+    threshold : :class:`int`, optional
+        The number of consecutive failures that opens the circuit.
+    cooldown : :class:`float`, optional
+        The number of seconds to wait before a trial request is allowed.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """:class:`bool`: Whether the circuit is open."""
+        return self._opened is not None
+
+    def allow(self):
+        """Whether a request can be sent.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the request can be sent.
+        """
+        with self._lock:
+            if self._opened is None:
+                return True
+            if time.time() - self._opened < self.cooldown:
+                return False
+            # only allow one trial request per cooldown period
+            self._opened = time.time()
+            return True
+
+    def failure(self):
+        """Record that a request failed."""
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened = time.time()
+
+    def success(self):
+        """Record that a request succeeded."""
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+
+
+class _HTTPResponse(object):
+    """The response from :meth:`_HTTPConnectionPool.urlopen`.
+
+    Behaves like the object that :func:`urllib.request.urlopen` returns (a file-like object with
+    ``status``, ``reason`` and ``headers`` attributes) but the body is decompressed
+    while it is read and the connection is released once the body has been read.
+    """
+
+    def __init__(self, raw, url, release):
+        self.url = url
+        self.status = raw.status
+        self.reason = raw.reason
+        self.headers = raw.msg
+        self._raw = raw
+        self._release = release
+        if (self.headers.get('content-encoding') or '').lower() == 'gzip':
+            self._fp = gzip.GzipFile(fileobj=raw, mode='rb')
+        else:
+            self._fp = raw
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.headers
+
+    def preload(self):
+        """Read the whole body and release the connection.
+
+        Raises
+        ------
+        URLError
+            If the body cannot be read, e.g., it is truncated.
+        """
+        body = self.read()
+        self._fp, self._raw = io.BytesIO(body), None
+
+    def read(self, amt=None):
+        if self._fp is None:
+            return b''
+        try:
+            data = self._fp.read() if amt is None or amt < 0 else self._fp.read(amt)
+        except (HTTPException, OSError, EOFError) as e:
+            self._done(False)
+            raise URLError(e)
+        if amt is None or amt < 0 or not data:
+            self._done(True)
+        return data
+
+    def close(self):
+        self._done(False)
+
+    def _done(self, complete):
+        if self._fp is None:
+            return
+        self._fp = None
+        if self._raw is None:
+            # the body was preloaded, the connection has already been released
+            return
+        reusable = complete and self._raw.isclosed() and not self._raw.will_close
+        if not complete:
+            self._raw.close()
+        self._release(reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignore):
+        self.close()
+
+
+class _RateLimit(object):
+    """Tracks the GitHub rate limit of the REST API from the ``X-RateLimit-*`` headers.
+
+    Call :meth:`acquire` before a request is sent and :meth:`update` with the
+    headers of the response (or with :data:`None` if there was no response).
+    The number of requests that are in progress is subtracted from the number
+    of requests that remain, so that the requests that are sent concurrently
+    are also counted.
+
+    Parameters
+    ----------
+    reserve : :class:`int`, optional
+        The number of requests to keep in reserve, i.e., :meth:`acquire`
+        returns :data:`False` when this many requests remain.
+    """
+
+    def __init__(self, reserve=2):
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._in_progress = 0
+        self._remaining = None
+        self._reset = 0
+
+    def acquire(self):
+        """Check whether the rate limit allows for a request to be sent.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the request can be sent.
+        """
+        with self._lock:
+            if self._remaining is not None and time.time() < self._reset:
+                if self._remaining - self._in_progress <= self.reserve:
+                    return False
+            self._in_progress += 1
+            return True
+
+    def core(self):
+        """:class:`dict`: The ``remaining`` and ``reset`` values (empty if not known)."""
+        with self._lock:
+            if self._remaining is None:
+                return {}
+            return {'remaining': self._remaining, 'reset': self._reset}
+
+    def update(self, headers):
+        """Update the rate limit after a request that :meth:`acquire` allowed has finished.
+
+        Parameters
+        ----------
+        headers : :class:`email.message.Message` or :data:`None`
+            The headers of the response.
+        """
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = int(headers['X-RateLimit-Reset'])
+        except (KeyError, TypeError, ValueError):
+            remaining = None
+
+        with self._lock:
+            self._in_progress = max(0, self._in_progress - 1)
+            if remaining is None:
+                return
+            if reset == self._reset and self._remaining is not None:
+                # the responses of concurrent requests can arrive in any order
+                remaining = min(remaining, self._remaining)
+            self._remaining = remaining
+            self._reset = reset
+
+
+class _MetadataStore(object):
+    """The cached information about the GitHub repositories and the PyPI packages.
+
+    The information is stored in an SQLite_ database (in WAL mode, so that
+    multiple processes can read while another process writes, unless the
+    database is on a network share, which cannot use WAL mode). The cached
+    information from a previous version (the github.json and pypi.json files)
+    is imported when the database is created.
+
+    The time that each field (see :func:`_cache_ttl`) of a package was last
+    retrieved (or revalidated) is stored so that each field can expire separately.
+
+    The header of the database file contains an application ID and the version
+    of the schema. A database that has an older schema is upgraded in place (see
+    the ``_migrate_<version>`` methods). The information about each package has
+    checksums, and a package whose information does not match its checksums is
+    removed from the cache and requested again. The integrity of the database
+    file is checked before the cache is updated (see :meth:`check`) and if the
+    database file is corrupt then the information that can still be read is
+    copied to a new database file.
+
+    .. _SQLite: https://www.sqlite.org/
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path to the database file.
+    """
+
+    #: The application ID in the header of the database file (``MSLP``).
+    application_id = 0x4d534c50
+
+    #: The version of the schema (the user version in the header of the database file).
+    version = 3
+
+    #: The columns of each table (in the latest version of the schema).
+    columns = collections.OrderedDict([
+        ('meta', ('key', 'value')),
+        ('repos', ('name', 'description', 'version', 'pushed_at', 'updated_at',
+                   'checksum', 'tags_checksum', 'branches_checksum')),
+        ('tags', ('repo', 'name', 'position')),
+        ('branches', ('repo', 'name', 'position')),
+        ('pypi', ('name', 'version', 'description', 'checksum')),
+        ('checked', ('source', 'name', 'field', 'time')),
+    ])
+
+    # the tables in version 1 of the schema (a database that was created
+    # before the schema was versioned may already have some of the tables)
+    schema = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS repos (
+        name TEXT PRIMARY KEY,
+        description TEXT NOT NULL,
+        version TEXT NOT NULL,
+        pushed_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS tags (
+        repo TEXT NOT NULL,
+        name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (repo, name)
+    );
+    CREATE INDEX IF NOT EXISTS tags_position ON tags (repo, position, name);
+    CREATE TABLE IF NOT EXISTS branches (
+        repo TEXT NOT NULL,
+        name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (repo, name)
+    );
+    CREATE INDEX IF NOT EXISTS branches_position ON branches (repo, position, name);
+    CREATE TABLE IF NOT EXISTS pypi (
+        name TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        description TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS checked (
+        source TEXT NOT NULL,
+        name TEXT NOT NULL,
+        field TEXT NOT NULL,
+        time REAL NOT NULL,
+        PRIMARY KEY (source, name, field)
+    );
+    CREATE TABLE IF NOT EXISTS stats (
+        source TEXT NOT NULL,
+        event TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (source, event)
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._open()
+        except sqlite3.OperationalError:
+            raise  # e.g., the database is locked
+        except sqlite3.DatabaseError as e:
+            self._recover(e)
+        for where in ('github', 'pypi'):
+            legacy = os.path.join(os.path.dirname(path), where + '.json')
+            if self.age(where) is None and os.path.isfile(legacy):
+                # an entry that is not valid is skipped (it is requested again)
+                pkgs = _load_json(legacy)
+                if isinstance(pkgs, dict):
+                    pkgs = dict((name, value) for name, value in pkgs.items() if isinstance(value, dict))
+                if pkgs:
+                    self.replace(where, pkgs, timestamp=os.path.getmtime(legacy))
+
+    def age(self, where):
+        """Get the number of seconds since the cache was updated.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+
+        Returns
+        -------
+        :class:`float` or :data:`None`
+            The age of the cache or :data:`None` if nothing is cached.
+        """
+        updated = self.updated(where)
+        if updated is None:
+            return
+        return time.time() - updated
+
+    def checked(self, where):
+        """Get the time that each field of each package was last retrieved (or revalidated).
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+
+        Returns
+        -------
+        :class:`dict`
+            The keys are the names of the packages and each value is a
+            :class:`dict` of the time (seconds since the epoch) of each field.
+        """
+        checked = dict()
+        with self._connect() as conn:
+            for name, field, timestamp in conn.execute(
+                    'SELECT name, field, time FROM checked WHERE source = ?', (where,)):
+                checked.setdefault(name, {})[field] = timestamp
+        return checked
+
+    def check(self):
+        """Check the integrity of the database file.
+
+        If the database file is corrupt then the information that can
+        still be read is copied to a new database file.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the database file was corrupt.
+        """
+        try:
+            with self._connect() as conn:
+                result = conn.execute('PRAGMA quick_check').fetchone()[0]
+            if result != 'ok':
+                log.debug('PRAGMA quick_check of %s: %s', self.path, result)
+                raise sqlite3.DatabaseError('database disk image is malformed')
+        except sqlite3.OperationalError:
+            raise  # e.g., the database is locked
+        except sqlite3.DatabaseError as e:
+            self._recover(e)
+            return True
+        return False
+
+    def delete(self, where, names, expire=False):
+        """Delete the information about some packages.
+
+        If no packages remain then nothing is cached (see :meth:`age`).
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+        names : :class:`list` of :class:`str`
+            The names of the packages.
+        expire : :class:`bool`, optional
+            Whether to also expire the cache and forget the ETag values of the
+            list of repositories so that the next refresh requests the deleted
+            packages again.
+        """
+        tables = ('repos', 'tags', 'branches') if where == 'github' else ('pypi',)
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for table in tables:
+                column = 'name' if table in ('repos', 'pypi') else 'repo'
+                conn.executemany('DELETE FROM {} WHERE {} = ?'.format(table, column), [(name,) for name in names])
+            conn.executemany('DELETE FROM checked WHERE source = ? AND name = ?', [(where, name) for name in names])
+            conn.execute('DELETE FROM meta WHERE key = ? AND NOT EXISTS (SELECT 1 FROM {})'.format(tables[0]),
+                         (where,))
+            if expire:
+                conn.execute('UPDATE meta SET value = 0 WHERE key = ?', (where,))
+            conn.execute('COMMIT')
+        if expire and where == 'github':
+            # a "304 Not Modified" reply for the list of repositories would not include these packages
+            path = os.path.join(os.path.dirname(self.path), 'github-etags.json')
+            etags = _load_json(path)
+            prefixes = ('/orgs/MSLNZ/repos',) + tuple('/repos/MSLNZ/{}/'.format(name) for name in names)
+            kept = dict((key, value) for key, value in etags.items() if not key.startswith(prefixes))
+            if len(kept) != len(etags):
+                _save_json(path, kept)
+
+    def expired(self, where, ttl):
+        """Get the fields of each package that have expired.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+        ttl : :class:`dict`
+            The number of seconds that each field is valid for.
+
+        Returns
+        -------
+        :class:`dict`
+            The keys are the names of the packages and each value
+            is a :class:`set` of the fields that have expired.
+        """
+        now = time.time()
+        expired = dict((name, set(ttl)) for name in self.names(where))
+        with self._connect() as conn:
+            for name, field, checked in conn.execute(
+                    'SELECT name, field, time FROM checked WHERE source = ?', (where,)):
+                if name in expired and field in ttl and now - checked < ttl[field]:
+                    expired[name].discard(field)
+        return expired
+
+    def overdue(self, where, ttl):
+        """Get the number of seconds since the first field of a package expired.
+
+        The list of packages expires with the ``version`` field.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+        ttl : :class:`dict`
+            The number of seconds that each field is valid for.
+
+        Returns
+        -------
+        :class:`float` or :data:`None`
+            The number of seconds (negative if no field has expired)
+            or :data:`None` if nothing is cached.
+        """
+        age = self.age(where)
+        if age is None:
+            return
+        overdue = age - ttl['version']
+        count = len(self.names(where))
+        now = time.time()
+        with self._connect() as conn:
+            rows = dict((field, (oldest, n)) for field, oldest, n in conn.execute(
+                'SELECT field, MIN(time), COUNT(*) FROM checked WHERE source = ? GROUP BY field', (where,)))
+        for field, seconds in ttl.items():
+            oldest, n = rows.get(field, (0, 0))
+            if n < count:
+                oldest = 0  # a package that does not have a time for this field
+            overdue = max(overdue, now - oldest - seconds)
+        return overdue
+
+    def has_ref(self, kind, repo, name):
+        """Check whether a repository has a tag or a branch.
+
+        Parameters
+        ----------
+        kind : :class:`str`
+            Either 'tags' or 'branches'.
+        repo : :class:`str`
+            The name of the repository.
+        name : :class:`str`
+            The name of the tag or branch.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the repository has the tag or branch.
+        """
+        assert kind in ('tags', 'branches'), '{!r} != tags or branches'.format(kind)
+        with self._connect() as conn:
+            sql = 'SELECT 1 FROM {} WHERE repo = ? AND name = ?'.format(kind)
+            return conn.execute(sql, (repo, name)).fetchone() is not None
+
+    def load(self, where, lazy=True):
+        """Load the cached packages.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+        lazy : :class:`bool`, optional
+            Whether to load the tags and the branches of a repository when
+            they are first accessed (see :class:`_Repository`) instead of now.
+
+        Returns
+        -------
+        :class:`collections.OrderedDict`
+            The packages, sorted by name.
+        """
+        pkgs = collections.OrderedDict()
+        corrupt = set()
+        checksum = self._checksum
+        with self._connect() as conn:
+            # the rows and their checksums are read in one transaction so that
+            # another process cannot replace the information in between
+            conn.execute('BEGIN')
+            if where == 'pypi':
+                for name, version, description, crc in conn.execute(
+                        'SELECT name, version, description, checksum FROM pypi ORDER BY name'):
+                    if checksum(name, version, description) != crc:
+                        corrupt.add(name)
+                        continue
+                    pkgs[name] = {'version': version, 'description': description}
+            else:
+                refs_crc = dict()
+                for name, description, version, pushed_at, updated_at, crc, tags_crc, branches_crc in conn.execute(
+                        'SELECT name, description, version, pushed_at, updated_at, checksum, '
+                        'tags_checksum, branches_checksum FROM repos ORDER BY name'):
+                    if checksum(name, description, version, pushed_at, updated_at) != crc:
+                        corrupt.add(name)
+                        continue
+                    pkgs[name] = _Repository(self, name, {
+                        'description': description,
+                        'version': version,
+                        'pushed_at': pushed_at,
+                        'updated_at': updated_at,
+                    })
+                    refs_crc[name] = {'tags': tags_crc, 'branches': branches_crc}
+                if not lazy:
+                    for value in pkgs.values():
+                        value.update(tags=[], branches=[])
+                    for kind in ('tags', 'branches'):
+                        sql = 'SELECT repo, name FROM {} ORDER BY repo, position'.format(kind)
+                        for repo, name in conn.execute(sql):
+                            if repo in pkgs:
+                                pkgs[repo][kind].append(name)
+                        for name, value in pkgs.items():
+                            if checksum(*value[kind]) != refs_crc[name][kind]:
+                                corrupt.add(name)
+            conn.execute('COMMIT')
+        if corrupt:
+            self._repair(where, corrupt)
+            for name in corrupt:
+                pkgs.pop(name, None)
+        return pkgs
+
+    def refs(self, kind, repo):
+        """Get the tags or the branches of a repository.
+
+        Parameters
+        ----------
+        kind : :class:`str`
+            Either 'tags' or 'branches'.
+        repo : :class:`str`
+            The name of the repository.
+
+        Returns
+        -------
+        :class:`list` of :class:`str`
+            The names of the tags or branches.
+        """
+        assert kind in ('tags', 'branches'), '{!r} != tags or branches'.format(kind)
+        with self._connect() as conn:
+            # the rows and the checksum are read in one transaction (see load)
+            conn.execute('BEGIN')
+            sql = 'SELECT name FROM {} WHERE repo = ? ORDER BY position'.format(kind)
+            refs = [row[0] for row in conn.execute(sql, (repo,))]
+            row = conn.execute('SELECT {}_checksum FROM repos WHERE name = ?'.format(kind), (repo,)).fetchone()
+            conn.execute('COMMIT')
+        if row is not None and self._checksum(*refs) != row[0]:
+            self._repair('github', [repo])
+            return []
+        return refs
+
+    def merge(self, where, pkgs, checked=None):
+        """Add or replace the information about some packages.
+
+        The time that the cache was updated does not change (if nothing
+        was cached then the cache is considered to have expired).
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+        pkgs : :class:`dict`
+            The information about the packages.
+        checked : :class:`dict`, optional
+            The fields of each package that were retrieved (or revalidated).
+            Default is all fields of all packages.
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._insert(conn, where, pkgs, checked, time.time())
+            conn.execute('INSERT OR IGNORE INTO meta VALUES (?, 0)', (where,))
+            conn.execute('COMMIT')
+
+    def names(self, where):
+        """Get the names of the cached packages.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+
+        Returns
+        -------
+        :class:`list` of :class:`str`
+            The names of the packages.
+        """
+        table = 'repos' if where == 'github' else 'pypi'
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute('SELECT name FROM {} ORDER BY name'.format(table))]
+
+    def replace(self, where, pkgs, checked=None, timestamp=None):
+        """Replace all cached packages.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+        pkgs : :class:`dict`
+            The information about the packages.
+        checked : :class:`dict`, optional
+            The fields of each package that were retrieved (or revalidated).
+            Default is all fields of all packages. The time of a field that
+            was not retrieved does not change.
+        timestamp : :class:`float`, optional
+            The time that the information was retrieved. Default is now.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        tables = ('repos', 'tags', 'branches') if where == 'github' else ('pypi',)
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for table in tables:
+                conn.execute('DELETE FROM {}'.format(table))
+            self._insert(conn, where, pkgs, checked, timestamp)
+            conn.execute('DELETE FROM checked WHERE source = ? AND name NOT IN (SELECT name FROM {})'.format(
+                tables[0]), (where,))
+            conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (where, timestamp))
+            conn.execute('COMMIT')
+
+    def restore(self, caches):
+        """Replace the cached packages of one or more caches in a single transaction.
+
+        Either all caches are replaced or, if an error occurs, nothing changes.
+
+        Parameters
+        ----------
+        caches : :class:`dict`
+            The keys are 'github' and/or 'pypi' and each value is a :class:`dict`
+            with the time that the cache was ``updated``, the ``packages`` and the
+            time that each field of each package was ``checked`` (see :meth:`checked`).
+        """
+        with self._connect() as conn:
+            # if an error occurs then the transaction is rolled back when the connection is closed
+            conn.execute('BEGIN IMMEDIATE')
+            for where, cache in caches.items():
+                tables = ('repos', 'tags', 'branches') if where == 'github' else ('pypi',)
+                for table in tables:
+                    conn.execute('DELETE FROM {}'.format(table))
+                conn.execute('DELETE FROM checked WHERE source = ?', (where,))
+                self._insert(conn, where, cache['packages'], {}, 0)
+                conn.executemany(
+                    'INSERT INTO checked VALUES (?, ?, ?, ?)',
+                    [(where, name, field, timestamp) for name, fields in cache['checked'].items()
+                     if name in cache['packages'] for field, timestamp in fields.items()]
+                )
+                conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (where, cache['updated']))
+            conn.execute('COMMIT')
+
+    def size(self, where):
+        """Get the size of the cached information.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+
+        Returns
+        -------
+        :class:`int`
+            The (approximate) number of bytes of the cached text.
+            The database file is larger since it also contains indexes.
+        """
+        if where == 'pypi':
+            queries = ('SELECT SUM(LENGTH(name) + LENGTH(version) + LENGTH(description)) FROM pypi',)
+        else:
+            queries = ('SELECT SUM(LENGTH(name) + LENGTH(description) + LENGTH(version) + '
+                       'LENGTH(pushed_at) + LENGTH(updated_at)) FROM repos',
+                       'SELECT SUM(LENGTH(name)) FROM tags',
+                       'SELECT SUM(LENGTH(name)) FROM branches')
+        with self._connect() as conn:
+            return sum(conn.execute(sql).fetchone()[0] or 0 for sql in queries)
+
+    def stamp(self):
+        """Get a value that changes when the information in the database changes.
+
+        Returns
+        -------
+        :class:`tuple`
+            The modification time and the size of the database
+            file and of the write-ahead log (WAL) file.
+        """
+        stamp = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    def updated(self, where):
+        """Get the time that the cache was updated.
+
+        Parameters
+        ----------
+        where : :class:`str`
+            Either 'github' or 'pypi'.
+
+        Returns
+        -------
+        :class:`float` or :data:`None`
+            The time (seconds since the epoch) or :data:`None` if nothing is cached.
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM meta WHERE key = ?', (where,)).fetchone()
+        if row is not None:
+            return row[0]
+
+    def vacuum(self):
+        """Rebuild the database file to reclaim the space of the deleted information."""
+        with self._connect() as conn:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.execute('VACUUM')
+
+    @staticmethod
+    def _checksum(*values):
+        # the CRC-32 checksum of some values
+        return zlib.crc32('\x1f'.join(map(str, values)).encode('utf-8')) & 0xffffffff
+
+    def _connect(self):
+        # a new connection is used for each operation so that the
+        # store can be used by multiple threads (and processes)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return contextlib.closing(conn)
+
+    @staticmethod
+    def _header(conn):
+        # the application ID and the version of the schema
+        application_id = conn.execute('PRAGMA application_id').fetchone()[0]
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        return application_id, version
+
+    @classmethod
+    def _insert(cls, conn, where, pkgs, checked, timestamp):
+        conn.executemany(
+            'INSERT OR REPLACE INTO checked VALUES (?, ?, ?, ?)',
+            [(where, name, field, timestamp) for name in pkgs
+             for field in (_CACHE_TTL if checked is None else checked.get(name, ()))]
+        )
+        if where == 'pypi':
+            conn.executemany(
+                'INSERT OR REPLACE INTO pypi VALUES (?, ?, ?, ?)',
+                [cls._row(name, value.get('version') or '', value.get('description') or '')
+                 for name, value in pkgs.items()]
+            )
+            return
+
+        conn.executemany(
+            'INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [cls._row(name, value.get('description') or '', value.get('version') or '',
+                      value.get('pushed_at') or '', value.get('updated_at') or '') +
+             (cls._checksum(*value.get('tags') or []), cls._checksum(*value.get('branches') or []))
+             for name, value in pkgs.items()]
+        )
+        for kind in ('tags', 'branches'):
+            conn.executemany('DELETE FROM {} WHERE repo = ?'.format(kind), [(name,) for name in pkgs])
+            conn.executemany(
+                'INSERT OR REPLACE INTO {} VALUES (?, ?, ?)'.format(kind),
+                [(name, ref, position) for name, value in pkgs.items()
+                 for position, ref in enumerate(value.get(kind) or [])]
+            )
+
+    def _journal(self, conn):
+        # a write-ahead log lets processes read while another process writes, but it requires
+        # shared memory that does not work if the database is on a network filesystem, and if
+        # the write-ahead log cannot be used then SQLite keeps the default (rollback) journal
+        mode = 'delete' if _is_network_path(os.path.dirname(os.path.abspath(self.path))) else 'wal'
+        try:
+            if conn.execute('PRAGMA journal_mode').fetchone()[0].lower() != mode:
+                conn.execute('PRAGMA journal_mode={}'.format(mode))
+        except sqlite3.OperationalError:
+            pass  # e.g., another process is using the database, the mode is changed next time
+
+    def _migrate_1(self, conn):
+        # create the tables
+        for statement in self.schema.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+
+    def _migrate_2(self, conn):
+        # add the checksums of the information about each package
+        for table, column in (('repos', 'checksum'), ('repos', 'tags_checksum'),
+                              ('repos', 'branches_checksum'), ('pypi', 'checksum')):
+            conn.execute('ALTER TABLE {} ADD COLUMN {} INTEGER NOT NULL DEFAULT 0'.format(table, column))
+        rows = conn.execute('SELECT name, version, description FROM pypi').fetchall()
+        conn.executemany('UPDATE pypi SET checksum = ? WHERE name = ?',
+                         [(self._checksum(*row), row[0]) for row in rows])
+        refs = dict()
+        for kind in ('tags', 'branches'):
+            for repo, name in conn.execute('SELECT repo, name FROM {} ORDER BY repo, position'.format(kind)):
+                refs.setdefault((repo, kind), []).append(name)
+        rows = conn.execute('SELECT name, description, version, pushed_at, updated_at FROM repos').fetchall()
+        conn.executemany(
+            'UPDATE repos SET checksum = ?, tags_checksum = ?, branches_checksum = ? WHERE name = ?',
+            [(self._checksum(*row), self._checksum(*refs.get((row[0], 'tags'), [])),
+              self._checksum(*refs.get((row[0], 'branches'), [])), row[0]) for row in rows]
+        )
+
+    def _migrate_3(self, conn):
+        # the statistics are saved in a file (see _save_lookups)
+        conn.execute('DROP TABLE IF EXISTS stats')
+
+    def _open(self):
+        # create the database or upgrade the schema of an existing database
+        with self._connect() as conn:
+            self._journal(conn)
+            header = self._header(conn)
+            if header == (self.application_id, self.version):
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            application_id, version = self._header(conn)  # another process may have upgraded it
+            if application_id not in (0, self.application_id):
+                raise sqlite3.DatabaseError('not an MSL cache (application_id={})'.format(application_id))
+            if version > self.version:
+                # the database was created by a newer version of the
+                # msl-package-manager, the schema cannot be downgraded
+                log.warning('The schema of the cache %s is newer than version %d, '
+                            'the cache is created again', self.path, self.version)
+                for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                        "AND name NOT LIKE 'sqlite_%'").fetchall():
+                    conn.execute('DROP TABLE {}'.format(row[0]))
+                version = 0
+            for v in range(version + 1, self.version + 1):
+                getattr(self, '_migrate_{}'.format(v))(conn)
+            conn.execute('PRAGMA application_id = {:d}'.format(self.application_id))
+            conn.execute('PRAGMA user_version = {:d}'.format(self.version))
+            conn.execute('COMMIT')
+
+    def _recover(self, error):
+        # copy the information that can be read from a corrupt database file to a new file
+        log.warning('The cache %s is corrupt (%s), the information that can be read is recovered',
+                    self.path, error)
+        corrupt = self.path + '.corrupt'
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.replace(self.path + suffix, corrupt + suffix)
+            except OSError:
+                pass
+
+        rows, failed = dict(), set()
+        conn = sqlite3.connect(corrupt)
+        try:
+            for table, columns in self.columns.items():
+                try:
+                    rows[table] = conn.execute('SELECT {} FROM {}'.format(', '.join(columns), table)).fetchall()
+                except sqlite3.DatabaseError:
+                    failed.add(table)
+        finally:
+            conn.close()
+
+        self._open()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for table, values in rows.items():
+                sql = 'INSERT OR IGNORE INTO {} VALUES ({})'.format(table, ', '.join('?' * len(self.columns[table])))
+                conn.executemany(sql, values)
+            # if some of the information about a package could not be read then the
+            # cache is considered to have expired (all fields are requested again)
+            for where, tables in (('github', {'repos', 'tags', 'branches', 'checked'}),
+                                  ('pypi', {'pypi', 'checked'})):
+                if failed & tables:
+                    conn.execute('DELETE FROM checked WHERE source = ?', (where,))
+                    conn.execute('UPDATE meta SET value = 0 WHERE key = ?', (where,))
+            conn.execute('COMMIT')
+
+    def _repair(self, where, names):
+        # remove the packages that do not match their checksums and
+        # expire the cache so that these packages are requested again
+        log.warning('The cached information about %d %s package(s) is corrupt, it will be requested again',
+                    len(names), 'GitHub' if where == 'github' else 'PyPI')
+        log.debug('The corrupt packages: %s', ', '.join(sorted(names)))
+        self.delete(where, names, expire=True)
+
+    @classmethod
+    def _row(cls, *values):
+        # the values and the checksum of the values
+        return values + (cls._checksum(*values),)
+
+
+class _Repository(dict):
+    """The cached information about a GitHub repository.
+
+    Behaves like a :class:`dict`. The tags and the branches of the repository
+    are loaded from the :class:`_MetadataStore` when they are first accessed
+    since most commands only use the version and the description.
+
+    Parameters
+    ----------
+    store : :class:`_MetadataStore`
+        The store to load the tags and the branches from.
+    name : :class:`str`
+        The name of the repository.
+    *args, **kwargs
+        The information that was loaded (passed to :class:`dict`).
+    """
+
+    lazy = ('tags', 'branches')
+
+    def __init__(self, store, name, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._store = store
+        self._name = name
+
+    def __missing__(self, key):
+        if key not in self.lazy:
+            raise KeyError(key)
+        value = self[key] = self._store.refs(key, self._name)
+        return value
+
+    def __contains__(self, key):
+        return key in self.lazy or dict.__contains__(self, key)
+
+    def __deepcopy__(self, memo):
+        # what has not been loaded yet is still loaded lazily by the copy
+        copied = _Repository(self._store, self._name)
+        for key, value in dict.items(self):
+            copied[key] = copy.deepcopy(value, memo)
+        return copied
+
+    def __eq__(self, other):
+        for obj in (self, other):
+            if isinstance(obj, _Repository):
+                obj._load_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __iter__(self):
+        self._load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load_all()
+        return dict.__len__(self)
+
+    def __repr__(self):
+        self._load_all()
+        return dict.__repr__(self)
+
+    def copy(self):
+        self._load_all()
+        return dict(dict.items(self))
+
+    def get(self, key, default=None):
+        if key in self.lazy:
+            return self[key]
+        return dict.get(self, key, default)
+
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+
+    def keys(self):
+        self._load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+
+    def _load_all(self):
+        for key in self.lazy:
+            self[key]
+
+
+class _FileLock(object):
+    """An exclusive (advisory) lock on a file that is shared by all processes.
+
+    The lock is automatically released by the operating system if the
+    process that holds the lock exits.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path to the lock file.
+    timeout : :class:`float`, optional
+        The maximum number of seconds to wait for another process to release
+        the lock. If the lock cannot be acquired within this time then
+        :attr:`locked` is :data:`False` (the caller decides whether to continue).
+    """
+
+    def __init__(self, path, timeout=300):
+        self.path = path
+        self.timeout = timeout
+        self.locked = False
+        self.waited = False
+        self._fp = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *ignore):
+        self.release()
+
+    def acquire(self):
+        """Acquire the lock, waiting for another process to release it.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the lock was acquired.
+        """
+        try:
+            self._fp = open(self.path, mode='a+b')
+        except (IOError, OSError):
+            return False
+
+        delay = 0.05
+        deadline = time.time() + self.timeout
+        while not self._try_lock():
+            self.waited = True
+            if time.time() > deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        self.locked = True
+        return True
+
+    def release(self):
+        """Release the lock."""
+        if self._fp is None:
+            return
+        if self.locked:
+            try:
+                if _IS_WINDOWS:
+                    self._fp.seek(0)
+                    msvcrt.locking(self._fp.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+            except (IOError, OSError):
+                pass
+            self.locked = False
+        self._fp.close()
+        self._fp = None
+
+    def _try_lock(self):
+        try:
+            if _IS_WINDOWS:
+                self._fp.seek(0)
+                msvcrt.locking(self._fp.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+        return True
+
+
+class _SearchResultsParser(HTMLParser):
+    """Parses the HTML of a page of the PyPI search results while it is downloaded.
+
+    Parameters
+    ----------
+    callback : :func:`callable`
+        Called with a :class:`dict` (with ``name``, ``version`` and ``description``
+        keys) as soon as the end of the snippet of a project is parsed.
+    """
+
+    fields = {
+        'package-snippet__name': 'name',
+        'package-snippet__version': 'version',
+        'package-snippet__description': 'description',
+    }
+
+    def __init__(self, callback):
+        HTMLParser.__init__(self)
+        self.callback = callback
+        self.last_page = 1
+        self._snippet = None
+        self._field = None
+        self._depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        if tag == 'a':
+            href = attrs.get('href') or ''
+            match = re.search(r'[?&]page=(\d+)', href)
+            if match:
+                self.last_page = max(self.last_page, int(match.group(1)))
+            if 'package-snippet' in classes:
+                self._emit()
+                self._snippet = {'name': '', 'version': '', 'description': ''}
+                self._depth = 0
+        if self._snippet is None:
+            return
+        if self._field is not None:
+            self._depth += 1
+            return
+        for cls in classes:
+            if cls in self.fields:
+                self._field = self.fields[cls]
+                self._depth = 0
+
+    def handle_endtag(self, tag):
+        if self._field is not None:
+            if self._depth == 0:
+                self._field = None
+            else:
+                self._depth -= 1
+        elif tag == 'a' and self._snippet is not None:
+            self._emit()
+
+    def handle_data(self, data):
+        if self._field is not None:
+            self._snippet[self._field] += data
+
+    def close(self):
+        HTMLParser.close(self)
+        self._emit()
+
+    def _emit(self):
+        snippet, self._snippet, self._field = self._snippet, None, None
+        if snippet and snippet['name'].strip():
+            self.callback(dict((k, ' '.join(v.split())) for k, v in snippet.items()))
+
+
+class _LogBuffer(logging.Filter):
+    """Buffers the log records of a thread instead of emitting the records.
+
+    The records are only buffered if the ``records`` attribute of :attr:`local`
+    is a :class:`list` for the thread that creates the record.
+    """
+
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.local = threading.local()
+
+    def filter(self, record):
+        records = getattr(self.local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
 class _ColourStreamHandler(logging.StreamHandler):
     """A SteamHandler that is compatible with colorama."""
 
@@ -911,10 +4250,7 @@ class _ColourStreamHandler(logging.StreamHandler):
         'CRITICAL': Back.RED + Fore.WHITE
     }
 
-    previous_message = ''
-
     def emit(self, record):
-        _ColourStreamHandler.previous_message = record.getMessage()
         stream = sys.stdout if record.levelno < logging.WARNING else sys.stderr
         try:
             stream.write(self.COLOURS[record.levelname] + self.format(record) + '\n')
@@ -937,6 +4273,24 @@ def _getLogger(name=None, fmt='%(message)s'):
 
 log = _getLogger(_PKG_NAME)
 
+_log_buffer = _LogBuffer()
+log.addFilter(_log_buffer)
+
+_http_pool = _HTTPConnectionPool()
+
+_stores = dict()
+_stores_lock = threading.Lock()
+
+# the information that was already loaded by this process (see _memo_get)
+_memo = dict()
+_memo_lock = threading.Lock()
+
+# the number of times that this process looked up a cache (see _count_lookup)
+_lookups = dict()
+_lookups_lock = threading.Lock()
+
+_github_rate_limit = _RateLimit()
+
 
 def _get_terminal_size():
     """
@@ -0,0 +1,213 @@
+import gzip
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from msl.package_manager import cache
+from msl.package_manager import utils
+
+GITHUB = {
+    'msl-loadlib': {
+        'description': 'Load a shared library',
+        'version': '0.10.0',
+        'tags': ['v0.10.0', 'v0.9.0'],
+        'branches': ['main'],
+        'pushed_at': '2023-06-16T00:00:00Z',
+        'updated_at': '2023-06-16T00:00:00Z',
+    },
+}
+
+PYPI = {'msl-loadlib': {'version': '0.10.0', 'description': 'Load a shared library'}}
+
+
+def create_shared_cache(tmpdir, directory=None):
+    store = utils._MetadataStore(str(tmpdir.join('server.sqlite3')))
+    store.replace('github', GITHUB)
+    store.replace('pypi', PYPI)
+    shared = cache._SharedCache(store=store, directory=directory)
+    shared.publish()
+    return shared
+
+
+def test_shared_cache_server(tmpdir, monkeypatch):
+    shared = create_shared_cache(tmpdir)
+    server = cache.ThreadingHTTPServer(('localhost', 0), cache._SharedCacheHandler)
+    server.shared = shared
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr(utils, '_HOME_DIR', str(tmpdir.mkdir('client')))
+    monkeypatch.setenv('MSL_PM_CACHE_URL', 'http://localhost:{}/'.format(server.server_address[1]))
+    try:
+        assert utils._update_from_shared('github') == GITHUB
+        assert utils._update_from_shared('pypi') == PYPI
+        assert utils._store().age('github') < 10
+
+        # the next request is conditional and the information did not change
+        assert utils._load_json(utils._etags_path('shared'))['github']['etag'] == shared.snapshot('github')['etag']
+        assert utils._update_from_shared('github') == GITHUB
+
+        # the information in the shared cache expired a long time ago
+        shared.store.replace('pypi', PYPI, timestamp=time.time() - 365 * 86400)
+        shared.publish()
+        assert utils._update_from_shared('pypi') == {}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_shared_cache_directory(tmpdir, monkeypatch):
+    directory = str(tmpdir.mkdir('shared'))
+    create_shared_cache(tmpdir, directory=directory)
+    assert sorted(os.listdir(directory)) == ['github.json', 'pypi.json']
+
+    monkeypatch.setattr(utils, '_HOME_DIR', str(tmpdir.mkdir('client')))
+    monkeypatch.setenv('MSL_PM_CACHE_URL', directory)
+    assert utils._update_from_shared('github') == GITHUB
+    assert utils._update_from_shared('github') == GITHUB
+    assert utils._store().load('pypi') == {}
+    assert utils._update_from_shared('pypi') == PYPI
+
+    monkeypatch.setenv('MSL_PM_CACHE_URL', str(tmpdir.join('does-not-exist')))
+    assert utils._update_from_shared('pypi') == {}
+
+    monkeypatch.delenv('MSL_PM_CACHE_URL')
+    assert utils._update_from_shared('pypi') == {}
+
+
+@pytest.mark.parametrize('content', [
+    '{"packages": {"msl-loadlib": {"version": "0.10.0"}}',
+    '{"packages": {"msl-loadlib": {"version": "0.10.0"}}}',
+    '{"packages": [{"version": "0.10.0"}], "updated": 1e12}',
+    '{"packages": {"msl-loadlib": "0.10.0"}, "updated": 1e12}',
+    '[{"packages": {}, "updated": 1e12}]',
+])
+def test_shared_cache_malformed(tmpdir, monkeypatch, content):
+    directory = tmpdir.mkdir('shared')
+    directory.join('pypi.json').write(content)
+    monkeypatch.setattr(utils, '_HOME_DIR', str(tmpdir.mkdir('client')))
+    monkeypatch.setenv('MSL_PM_CACHE_URL', str(directory))
+    assert utils._update_from_shared('pypi') == {}
+    assert utils._store().age('pypi') is None
+
+
+def test_refresh(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, '_HOME_DIR', str(tmpdir))
+    updated = []
+    monkeypatch.setattr(utils, '_update_cache', lambda where, **kwargs: updated.append((where, kwargs)) or PYPI)
+
+    # nothing is cached
+    cache.refresh()
+    assert updated == [('pypi', {'update_cache': False, 'shared': True}),
+                       ('github', {'update_cache': False, 'shared': True})]
+
+    # the cache has not expired
+    del updated[:]
+    utils._store().replace('pypi', PYPI)
+    cache.refresh(where='pypi')
+    assert updated == []
+
+    cache.refresh(where='pypi', update_cache=True)
+    assert updated == [('pypi', {'update_cache': True, 'shared': True})]
+
+
+def test_stats_and_prune(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, '_HOME_DIR', str(tmpdir))
+    store = utils._store()
+    store.replace('github', GITHUB)
+    store.replace('pypi', PYPI)
+
+    # saving the statistics does not change the stamp of the store
+    # (which would make other processes load the information again)
+    monkeypatch.setattr(utils, '_lookups', {})
+    stamp = store.stamp()
+    for event in ('hits', 'hits', 'stale', 'misses', 'refreshes'):
+        utils._count_lookup('github', event)
+    utils._save_lookups()
+    utils._count_lookup('github', 'hits')
+    utils._save_lookups()
+    assert utils._lookups == {}
+    assert store.stamp() == stamp
+
+    stats = cache.stats()
+    assert stats['github']['packages'] == 1
+    assert stats['github']['age'] < 10
+    assert stats['github']['expired'] == {'version': 0, 'description': 0}
+    assert stats['github']['size'] > stats['pypi']['size'] > 0
+    assert stats['github']['hits'] == 3
+    assert stats['github']['stale'] == 1
+    assert stats['github']['misses'] == 1
+    assert stats['github']['refreshes'] == 1
+    assert stats['github']['shared'] == 0
+    assert stats['github']['hit_rate'] == 0.8
+    assert stats['pypi']['hit_rate'] is None
+
+    # the information about msl-io was retrieved a long time ago
+    old = {'msl-io': {'version': '0.1.0', 'description': 'Read and write data files'}}
+    store.merge('pypi', old)
+    store.merge('pypi', old, checked={'msl-io': ()})
+    with store._connect() as conn:
+        conn.execute('UPDATE checked SET time = 0 WHERE name = ?', ('msl-io',))
+    assert cache.stats()['pypi']['expired'] == {'version': 1, 'description': 1}
+
+    utils._save_json(str(tmpdir.join('pypi-missing.json')), {'msl-old': 0, 'msl-new': time.time()})
+    assert cache.prune() == {'github': [], 'pypi': ['msl-io']}
+    assert store.load('pypi') == PYPI
+    assert store.load('github') == GITHUB
+    assert list(utils._load_json(str(tmpdir.join('pypi-missing.json')))) == ['msl-new']
+
+    assert cache.prune(older_than=0) == {'github': ['msl-loadlib'], 'pypi': ['msl-loadlib']}
+    assert store.age('github') is None
+    assert store.age('pypi') is None
+    assert cache.stats()['github']['hits'] == 3
+
+
+def test_export_import(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, '_HOME_DIR', str(tmpdir.mkdir('online')))
+    with pytest.raises(ValueError, match='Nothing is cached'):
+        cache.export_cache(str(tmpdir.join('empty.json.gz')))
+
+    store = utils._store()
+    store.replace('github', GITHUB, timestamp=time.time() - 3600)
+    store.replace('pypi', PYPI)
+    path = str(tmpdir.join('msl-cache.json.gz'))
+    assert cache.export_cache(path) == {'github': 1, 'pypi': 1}
+    assert os.stat(path).st_mode & 0o777 == utils._file_mode(str(tmpdir))
+
+    monkeypatch.setattr(utils, '_HOME_DIR', str(tmpdir.mkdir('offline')))
+    utils._save_json(utils._etags_path('github'), {'/orgs/MSLNZ/repos?page=1': {'etag': 'W/"abc"'}})
+    utils._store().replace('pypi', {'msl-io': {'version': '0.1.0', 'description': 'Read and write data files'}})
+    assert cache.import_cache(path) == {'github': 1, 'pypi': 1}
+    for where in ('github', 'pypi'):
+        assert utils._store().load(where) == store.load(where)
+        assert utils._store().checked(where) == store.checked(where)
+        assert utils._store().updated(where) == store.updated(where)
+    assert utils._load_json(utils._etags_path('github')) == {}
+
+    assert cache.import_cache(path, renew=True) == {'github': 1, 'pypi': 1}
+    assert utils._store().age('github') < 10
+    assert utils._store().load('github') == GITHUB
+
+    # a corrupt archive does not change the cache
+    with gzip.open(path, 'rb') as fp:
+        archive = json.loads(fp.read().decode('utf-8'))
+    archive['caches']['pypi']['packages']['msl-loadlib']['version'] = '1.0.0'
+    with gzip.open(path, 'wb') as fp:
+        fp.write(json.dumps(archive).encode('utf-8'))
+    with pytest.raises(ValueError, match='corrupt'):
+        cache.import_cache(path)
+    assert utils._store().load('pypi') == PYPI
+
+    archive['version'] = 99
+    with gzip.open(path, 'wb') as fp:
+        fp.write(json.dumps(archive).encode('utf-8'))
+    with pytest.raises(ValueError, match='newer version'):
+        cache.import_cache(path)
+
+    with open(path, mode='wb') as fp:
+        fp.write(b'{"format": "msl-package-manager-cache"}')
+    with pytest.raises(ValueError, match='not an MSL cache archive'):
+        cache.import_cache(path)
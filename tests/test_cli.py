@@ -604,3 +604,16 @@ def test_authorise():
         assert args.pip_options[0] == '--invalid-pip-option'
         assert args.pip_options[1] == 'notused'
         assert args.pip_options[2] == '--does-not-get-parsed-by-pip'
+
+
+def test_cache_serve():
+    args = get_args('cache serve')
+    assert args.host == 'localhost'
+    assert args.port == 8765
+    assert not args.no_server
+    assert args.dir is None
+
+    args = get_args('cache serve --host 0.0.0.0 --port 8000 --dir shared')
+    assert args.host == '0.0.0.0'
+    assert args.port == 8000
+    assert args.dir == 'shared'
@@ -1,10 +1,101 @@
+import copy
+import gzip
+import json
 import logging
 import os
+import sqlite3
 import sys
+import threading
+import time
+import zlib
+from email.message import Message
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from http.server import ThreadingHTTPServer
 
+import pytest
+
+from msl.package_manager import cache
 from msl.package_manager import utils
 
 
+@pytest.fixture
+def fake_api(tmpdir, monkeypatch):
+    """A local server that replies to the requests for api.github.com and pypi.org.
+
+    The ``routes`` of the server map a path (with or without the query) to a
+    ``(status, body)`` or a ``(status, body, headers)`` tuple, or to a callable
+    that receives the JSON body of a POST request and returns a tuple. A body of
+    type :class:`bytes` is sent as is (if the headers include a Content-Length
+    value then the connection is closed, e.g., to send a truncated body). A reply
+    includes an ETag, every request is appended to ``requests`` and the address
+    of every new connection is appended to ``connections``.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            server.connections.append(self.client_address)
+            BaseHTTPRequestHandler.setup(self)
+
+        def do_GET(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            server.requests.append((self.path, self.headers, body))
+            route = server.routes.get(self.path) or server.routes.get(self.path.split('?')[0]) or (404, None)
+            if callable(route):
+                route = route(body)
+            status, reply, headers = (route + ({},))[:3]
+            data = reply if isinstance(reply, bytes) else b'' if reply is None else json.dumps(reply).encode()
+            etag = '"{:08x}"'.format(zlib.crc32(data) & 0xffffffff)
+            if status == 200 and self.headers.get('If-None-Match') == etag:
+                status, data = 304, b''
+            self.send_response(status)
+            if status in (200, 304):
+                self.send_header('ETag', etag)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            if 'Content-Length' in headers:
+                self.close_connection = True
+            else:
+                self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_POST = do_GET
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.routes, server.requests, server.connections = {}, [], []
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def request(url, *args, **kwargs):
+        for host in ('https://api.github.com', 'https://pypi.org'):
+            url = url.replace(host, server.url)
+        return Request(url, *args, **kwargs)
+
+    Request = utils.Request
+    monkeypatch.setattr(utils, 'Request', request)
+    monkeypatch.setattr(utils, '_HOME_DIR', str(tmpdir))
+    monkeypatch.setattr(utils, '_GITHUB_AUTH_PATH', str(tmpdir.join('github-auth')))
+    monkeypatch.setattr(utils, '_PYPI_PROJECTS', ('msl-loadlib',))
+    monkeypatch.setattr(utils, '_http_pool', utils._HTTPConnectionPool(retries=0, backoff=0))
+    monkeypatch.setattr(utils, '_github_rate_limit', utils._RateLimit())
+    monkeypatch.setattr(utils, '_lookups', {})
+    for name in ('MSL_PM_CACHE_URL', 'MSL_PM_GITHUB_AUTH', 'MSL_PM_INDEX_URL', 'PIP_INDEX_URL'):
+        monkeypatch.delenv(name, raising=False)
+    try:
+        yield server
+    finally:
+        utils._http_pool.clear()
+        server.shutdown()
+        server.server_close()
+
+
 # see the docs for the caplog fixture
 # https://docs.pytest.org/en/latest/logging.html#caplog-fixture
 def test_info_log(caplog):
@@ -128,3 +219,1166 @@ def test_outdated_pypi_packages():
         assert info['extras_require'] == ''
         assert info['version']
         assert info['repo_name'] == ''
+
+
+def test_last_page():
+    assert utils._last_page(None) == 1
+    assert utils._last_page('') == 1
+    link = '<https://api.github.com/repositories/1/tags?per_page=100&page=2>; rel="next", ' \
+           '<https://api.github.com/repositories/1/tags?per_page=100&page=4>; rel="last"'
+    assert utils._last_page(link) == 4
+    link = '<https://api.github.com/repositories/1/tags?per_page=100&page=1>; rel="prev", ' \
+           '<https://api.github.com/repositories/1/tags?per_page=100&page=1>; rel="first"'
+    assert utils._last_page(link) == 1
+
+
+def test_explicit_names():
+    assert utils._explicit_names(None) is None
+    assert utils._explicit_names(()) is None
+    assert utils._explicit_names(('loadlib*',)) is None
+    assert utils._explicit_names(('loadlib', 'io*')) is None
+    assert utils._explicit_names(('loadlib[java]==0.6.0', 'GTC<1.3')) == ['loadlib', 'GTC']
+    assert utils._repo_candidates('loadlib') == ['loadlib', 'msl-loadlib']
+    assert utils._repo_candidates('MSL-LoadLib') == ['MSL-LoadLib']
+    assert utils._all_resolved(['loadlib', 'gtc'], {'msl-loadlib': {}, 'GTC': {}})
+    assert not utils._all_resolved(['loadlib', 'io'], {'msl-loadlib': {}, 'GTC': {}})
+
+
+def test_unchanged():
+    repo = utils._repo_summary({'description': None, 'pushed_at': 'p', 'updated_at': 'u', 'language': 'Python'})
+    assert repo == {'description': '', 'pushed_at': 'p', 'updated_at': 'u'}
+    cached = {'description': '', 'pushed_at': 'p', 'updated_at': 'u', 'version': '1.0', 'tags': [], 'branches': []}
+    assert utils._unchanged(repo, cached)
+    assert not utils._unchanged(repo, None)
+    assert not utils._unchanged(repo, dict(cached, pushed_at='x'))
+    assert not utils._unchanged(repo, dict(cached, updated_at='x'))
+    assert not utils._unchanged(dict(repo, pushed_at=''), dict(cached, pushed_at=''))
+    del cached['tags']
+    assert not utils._unchanged(repo, cached)
+
+
+def test_parse_duration():
+    assert utils._parse_duration('0') == 0
+    assert utils._parse_duration('90') == 90
+    assert utils._parse_duration('90s') == 90
+    assert utils._parse_duration('1.5m') == 90
+    assert utils._parse_duration(' 12H ') == 12 * 3600
+    assert utils._parse_duration('7d') == 7 * 86400
+    for value in ('', 'd', '-1', '1w', '1 day'):
+        with pytest.raises(ValueError):
+            utils._parse_duration(value)
+
+
+def test_cache_ttl(monkeypatch):
+    monkeypatch.delenv('MSL_PM_CACHE_TTL', raising=False)
+    assert utils._cache_ttl() == {'version': 86400, 'description': 7 * 86400}
+    monkeypatch.setenv('MSL_PM_CACHE_TTL', 'version=1h, Description=30d')
+    assert utils._cache_ttl() == {'version': 3600, 'description': 30 * 86400}
+    monkeypatch.setenv('MSL_PM_CACHE_TTL', 'version=0,tags=1h,description=1w')
+    assert utils._cache_ttl() == {'version': 0, 'description': 7 * 86400}
+
+
+def test_latest_version():
+    simple = {
+        'name': 'msl-loadlib',
+        'versions': ['0.9.0', '0.10.0', '0.11.0', '1.0.0a1'],
+        'files': [
+            {'filename': 'msl-loadlib-0.9.0.tar.gz'},
+            {'filename': 'msl_loadlib-0.10.0-py3-none-any.whl'},
+            {'filename': 'msl_loadlib-0.11.0.tar.gz', 'yanked': 'broken'},
+            {'filename': 'msl_loadlib-1.0.0a1-py3-none-any.whl'},
+        ]
+    }
+    assert utils._latest_version(simple) == '0.10.0'
+
+    # only pre-releases
+    simple['files'] = simple['files'][3:]
+    assert utils._latest_version(simple) == '1.0.0a1'
+
+    # PEP 700 is not supported
+    simple = {'name': 'GTC', 'files': [{'filename': 'GTC-1.3.1.tar.gz'}, {'filename': 'gtc-1.4.0-py3-none-any.whl'}]}
+    assert utils._latest_version(simple) == '1.4.0'
+
+    assert utils._latest_version({'name': 'msl-io'}) == ''
+
+
+def test_is_msl_project():
+    assert utils._is_msl_project({'home_page': 'https://github.com/MSLNZ/GTC'})
+    assert utils._is_msl_project({'project_urls': {'Source': 'https://github.com/MSLNZ/msl-io/'}})
+    assert utils._is_msl_project({'author_email': 'Measurement Standards Laboratory of New Zealand <info@a.b>'})
+    assert not utils._is_msl_project({'home_page': 'https://github.com/tripzero/python-photons', 'author': 'Kevron'})
+    assert not utils._is_msl_project({'home_page': None, 'project_urls': None})
+
+
+def test_search_results_parser():
+    html = '<html><body><ul>' \
+           '<li><a class="package-snippet" href="/project/msl-loadlib/">' \
+           '<h3 class="package-snippet__title"><span class="package-snippet__name">msl-loadlib</span>' \
+           '<span class="package-snippet__version">0.10.0</span>' \
+           '<span class="package-snippet__created"><time>Jan 1, 2023</time></span></h3>' \
+           '<p class="package-snippet__description">Load a <b>library</b></p></a></li>' \
+           '<li><a class="package-snippet" href="/project/GTC/"><span class="package-snippet__name">GTC</span>' \
+           '<span class="package-snippet__version">1.4.0</span>' \
+           '<p class="package-snippet__description">The GUM Tree Calculator</p></a></li>' \
+           '</ul><div class="button-group"><a href="?q=msl&amp;page=2">2</a>' \
+           '<a href="?q=msl&amp;page=3">3</a></div></body></html>'
+    snippets = []
+    parser = utils._SearchResultsParser(snippets.append)
+    for i in range(0, len(html), 7):
+        parser.feed(html[i:i+7])
+        if i < 300:
+            assert not snippets
+    parser.close()
+    assert snippets == [
+        {'name': 'msl-loadlib', 'version': '0.10.0', 'description': 'Load a library'},
+        {'name': 'GTC', 'version': '1.4.0', 'description': 'The GUM Tree Calculator'},
+    ]
+    assert parser.last_page == 3
+
+
+def test_pip_index_options(monkeypatch):
+    monkeypatch.delenv('MSL_PM_INDEX_URL', raising=False)
+    assert utils._pip_index_options([]) == []
+
+    monkeypatch.setenv('MSL_PM_INDEX_URL', 'https://mirror.example.com/simple')
+    assert utils._pip_index_options([]) == ['--index-url', 'https://mirror.example.com/simple/']
+    assert utils._pip_index_options(['--no-deps']) == ['--index-url', 'https://mirror.example.com/simple/']
+    for options in (['-i', 'https://pypi.org/simple'], ['-ihttps://pypi.org/simple'],
+                    ['--index-url', 'https://pypi.org/simple'], ['--index-url=https://pypi.org/simple'],
+                    ['--no-deps', '--no-index']):
+        assert utils._pip_index_options(options) == []
+
+
+def test_local_simple_index(tmpdir):
+    project = tmpdir.mkdir('msl-loadlib')
+    project.join('index.html').write(
+        '<!DOCTYPE html><html><body>'
+        '<a href="../../files/msl_loadlib-0.9.0-py3-none-any.whl#sha256=ab">msl_loadlib-0.9.0-py3-none-any.whl</a>'
+        '<a href="../../files/msl-loadlib-0.10.0.tar.gz" data-yanked="">msl-loadlib-0.10.0.tar.gz</a>'
+        '</body></html>'
+    )
+    url = 'file:' + utils.pathname2url(str(tmpdir))
+    response = utils._http_pool.urlopen(utils.Request(url + '/msl-loadlib/'))
+    simple = utils._parse_simple(response, utils._normalize_name('MSL_LoadLib'))
+    assert simple['name'] == 'msl-loadlib'
+    assert simple['files'] == [
+        {'filename': 'msl_loadlib-0.9.0-py3-none-any.whl', 'yanked': False},
+        {'filename': 'msl-loadlib-0.10.0.tar.gz', 'yanked': True},
+    ]
+    assert utils._latest_version(simple) == '0.9.0'
+
+    with pytest.raises(utils.HTTPError):
+        utils._http_pool.urlopen(utils.Request(url + '/msl-io/'))
+
+
+def pypi_routes(version, name='msl-loadlib'):
+    # the replies of the JSON API and of the JSON Simple API for a project
+    info = {'name': name, 'version': version, 'summary': 'MSL ' + name, 'home_page': 'https://github.com/MSLNZ'}
+    simple = {'name': name, 'files': [{'filename': '{}-{}.tar.gz'.format(name, version), 'yanked': False}]}
+    return {
+        '/pypi/{}/json'.format(name): (200, {'info': info}, {'X-PyPI-Last-Serial': version}),
+        '/simple/{}/'.format(name): (200, simple, {'Content-Type': utils._PYPI_SIMPLE_JSON}),
+    }
+
+
+def test_update_pypi_revalidate(fake_api):
+    fake_api.routes.update(pypi_routes('1.0'))
+    expected = {'msl-loadlib': {'version': '1.0', 'description': 'MSL msl-loadlib'}}
+    assert utils._update_pypi(None, True) == expected
+    etags = utils._load_json(utils._etags_path('pypi'))
+    assert etags['https://pypi.org/pypi/msl-loadlib/json']['x-pypi-last-serial'] == '1.0'
+    assert 'etag' in etags['https://pypi.org/simple/msl-loadlib/']
+
+    def requests():
+        paths = [(path, headers.get('If-None-Match')) for path, headers, _ in fake_api.requests if 'loadlib' in path]
+        del fake_api.requests[:]
+        return paths
+
+    # the project did not change, a "304 Not Modified" reply
+    requests()
+    assert utils._update_pypi(None, True) == expected
+    assert requests() == [('/pypi/msl-loadlib/json', etags['https://pypi.org/pypi/msl-loadlib/json']['etag'])]
+
+    # the reply changed (the server ignored the ETag value) but the last serial is the
+    # same, so the JSON Simple API is not requested and the cached information is used
+    route = fake_api.routes['/pypi/msl-loadlib/json']
+    fake_api.routes['/pypi/msl-loadlib/json'] = (200, dict(route[1], urls=[]), route[2])
+    assert utils._update_pypi(None, True) == expected
+    assert [path for path, _ in requests()] == ['/pypi/msl-loadlib/json']
+
+    # a new release has a new serial
+    fake_api.routes.update(pypi_routes('1.1'))
+    assert utils._update_pypi(None, True) == {'msl-loadlib': {'version': '1.1', 'description': 'MSL msl-loadlib'}}
+    paths = requests()
+    assert [path for path, _ in paths] == ['/pypi/msl-loadlib/json', '/simple/msl-loadlib/']
+    assert paths[1][1] == etags['https://pypi.org/simple/msl-loadlib/']['etag']
+
+
+def test_update_pypi_expired_fields(fake_api):
+    fake_api.routes.update(pypi_routes('1.0'))
+    utils._update_pypi(None, False)
+
+    def expire(field):
+        with utils._store()._connect() as conn:
+            conn.execute('UPDATE checked SET time = 0 WHERE field = ?', (field,))
+        del fake_api.requests[:]
+
+    def requests():
+        return [path for path, _, _ in fake_api.requests if 'loadlib' in path]
+
+    # nothing expired
+    expire('')
+    assert utils._update_pypi(None, False) == {'msl-loadlib': {'version': '1.0', 'description': 'MSL msl-loadlib'}}
+    assert requests() == []
+
+    # only the version expired, the JSON Simple API is requested
+    fake_api.routes.update(pypi_routes('1.1'))
+    expire('version')
+    assert utils._update_pypi(None, False) == {'msl-loadlib': {'version': '1.1', 'description': 'MSL msl-loadlib'}}
+    assert requests() == ['/simple/msl-loadlib/']
+
+    # only the description expired, the JSON API is requested
+    info = fake_api.routes['/pypi/msl-loadlib/json'][1]['info']
+    fake_api.routes['/pypi/msl-loadlib/json'] = (200, {'info': dict(info, summary='new')}, {'X-PyPI-Last-Serial': '2'})
+    expire('description')
+    assert utils._update_pypi(None, False) == {'msl-loadlib': {'version': '1.1', 'description': 'new'}}
+    assert requests() == ['/pypi/msl-loadlib/json']
+
+
+def test_update_pypi_html_reply(fake_api):
+    # the index replied with HTML instead of JSON, the connection is reused
+    fake_api.routes.update(pypi_routes('1.0'))
+    fake_api.routes['/simple/msl-loadlib/'] = (200, '<html></html>', {'Content-Type': 'text/html'})
+    expected = {'msl-loadlib': {'version': '1.0', 'description': 'MSL msl-loadlib'}}
+    for _ in range(3):
+        assert utils._update_pypi(['msl-loadlib'], True) == expected
+    assert [path for path, _, _ in fake_api.requests][:3] == [
+        '/pypi/msl-loadlib/json', '/simple/msl-loadlib/', '/pypi/msl-loadlib/json']
+    assert len(fake_api.connections) == 1
+
+
+def test_update_pypi_transient_error(fake_api):
+    fake_api.routes.update(pypi_routes('1.0'))
+    fake_api.routes.update(pypi_routes('2.0', name='msl-io'))
+    utils._store().replace('github', {'msl-io': {'description': '', 'version': '', 'tags': [], 'branches': []}})
+    expected = {
+        'msl-io': {'version': '2.0', 'description': 'MSL msl-io'},
+        'msl-loadlib': {'version': '1.0', 'description': 'MSL msl-loadlib'},
+    }
+    assert utils._update_pypi(None, True) == expected
+    validators = utils._load_json(utils._etags_path('pypi'))
+
+    # a "503 Service Unavailable" reply does not remove a project
+    # but a "404 Not Found" reply does
+    fake_api.routes['/pypi/msl-io/json'] = (503, None)
+    del fake_api.routes['/pypi/msl-loadlib/json']
+    assert utils._update_pypi(None, True) == {'msl-io': expected['msl-io']}
+    assert utils._store().load('pypi') == {'msl-io': expected['msl-io']}
+    etags = utils._load_json(utils._etags_path('pypi'))
+    assert sorted(etags) == sorted(url for url in validators if 'msl-io' in url)
+
+    # the project is not removed while the failures continue
+    fake_api.routes['/pypi/msl-loadlib/json'] = (503, None)
+    assert utils._update_pypi(None, True) == {'msl-io': expected['msl-io']}
+    assert utils._load_json(utils._etags_path('pypi')) == etags
+
+
+def github_routes(name='msl-io', version='0.1.0', pushed_at='2023-06-16T00:00:00Z'):
+    # the replies of the REST API for an organisation that has one repository
+    repo = {'name': name, 'language': 'Python', 'description': 'Read and write data files',
+            'pushed_at': pushed_at, 'updated_at': '2023-06-16T00:00:00Z'}
+    prefix = '/repos/MSLNZ/{}/'.format(name)
+    return {
+        '/orgs/MSLNZ/repos': (200, [repo]),
+        prefix[:-1]: (200, repo),
+        prefix + 'releases/latest': (200, {'tag_name': 'v' + version, 'name': version}),
+        prefix + 'tags': (200, [{'name': 'v' + version}]),
+        prefix + 'branches': (200, [{'name': 'main'}]),
+    }
+
+
+def graphql_route(name='msl-io', version='0.1.0', pushed_at='2023-06-16T00:00:00Z'):
+    # the replies of the GraphQL API for an organisation that has one repository
+    repo = {'name': name, 'description': 'Read and write data files', 'primaryLanguage': {'name': 'Python'},
+            'pushedAt': pushed_at, 'updatedAt': '2023-06-16T00:00:00Z'}
+    no_next_page = {'hasNextPage': False, 'endCursor': None}
+
+    def reply(body):
+        if 'organization' in body['query']:
+            return 200, {'data': {'organization': {'repositories': {'pageInfo': no_next_page, 'nodes': [repo]}}}}
+        details = dict(repo, latestRelease={'tagName': 'v' + version, 'name': version},
+                       tags={'pageInfo': no_next_page, 'nodes': [{'name': 'v' + version}]},
+                       branches={'pageInfo': no_next_page, 'nodes': [{'name': 'main'}]})
+        return 200, {'data': {'r0': details}}
+
+    return reply
+
+
+def test_update_github_changed(fake_api):
+    def update(pushed_at):
+        routes = github_routes(name='msl-loadlib', pushed_at=pushed_at)
+        fake_api.routes.update(routes)
+        repos = github_routes()['/orgs/MSLNZ/repos'][1] + routes['/orgs/MSLNZ/repos'][1]
+        fake_api.routes['/orgs/MSLNZ/repos'] = (200, repos)
+
+    fake_api.routes.update(github_routes())
+    update('2023-06-16T00:00:00Z')
+    utils._update_github(None, None, None, False)
+
+    # the versions expired, only the details of the repository that was pushed to are requested
+    with utils._store()._connect() as conn:
+        conn.execute("UPDATE checked SET time = 0 WHERE field = 'version'")
+    del fake_api.requests[:]
+    update('2023-07-01T00:00:00Z')
+    pkgs = utils._update_github(None, None, None, False)
+    assert pkgs['msl-loadlib']['pushed_at'] == '2023-07-01T00:00:00Z'
+    assert sorted(path.split('?')[0] for path, _, _ in fake_api.requests) == [
+        '/orgs/MSLNZ/repos', '/repos/MSLNZ/msl-loadlib/branches',
+        '/repos/MSLNZ/msl-loadlib/releases/latest', '/repos/MSLNZ/msl-loadlib/tags',
+    ]
+
+
+def test_update_github_forced(fake_api):
+    fake_api.routes.update(github_routes())
+    expected = {
+        'description': 'Read and write data files',
+        'version': '0.1.0',
+        'tags': ['v0.1.0'],
+        'branches': ['main'],
+        'pushed_at': '2023-06-16T00:00:00Z',
+        'updated_at': '2023-06-16T00:00:00Z',
+    }
+    assert utils._update_github(None, None, None, False) == {'msl-io': expected}
+    assert len(fake_api.requests) == 4
+
+    # the repository did not change, only the (conditional) listing is requested
+    del fake_api.requests[:]
+    assert utils._update_github(None, None, None, False) == {'msl-io': expected}
+    assert [path for path, _, _ in fake_api.requests] == ['/orgs/MSLNZ/repos?per_page=100&page=1']
+    assert fake_api.requests[0][1].get('If-None-Match')
+
+    # a forced update requests everything, even though nothing changed
+    del fake_api.requests[:]
+    fake_api.routes.update(github_routes(version='0.2.0'))
+    assert utils._update_github(None, None, None, True) == {'msl-io': dict(expected, version='0.2.0', tags=['v0.2.0'])}
+    assert len(fake_api.requests) == 4
+    assert not fake_api.requests[0][1].get('If-None-Match')
+
+
+def test_update_github_conditional(fake_api):
+    fake_api.routes.update(github_routes())
+    utils._update_github(None, None, None, False)
+    etags = utils._load_json(utils._etags_path('github'))
+    assert sorted(etags) == [
+        '/orgs/MSLNZ/repos?per_page=100&page=1',
+        '/repos/MSLNZ/msl-io/branches?per_page=100&page=1',
+        '/repos/MSLNZ/msl-io/releases/latest',
+        '/repos/MSLNZ/msl-io/tags?per_page=100&page=1',
+    ]
+
+    # the repository was pushed to, the cached ETag values are sent and
+    # the cached information is used for the endpoints that did not change
+    del fake_api.requests[:]
+    fake_api.routes.update(github_routes(pushed_at='2023-07-01T00:00:00Z'))
+    fake_api.routes['/repos/MSLNZ/msl-io/branches'] = (200, [{'name': 'main'}, {'name': 'develop'}])
+    pkgs = utils._update_github(None, None, None, True)
+    assert pkgs['msl-io']['version'] == '0.1.0'
+    assert pkgs['msl-io']['tags'] == ['v0.1.0']
+    assert pkgs['msl-io']['branches'] == ['main', 'develop']
+    assert pkgs['msl-io']['pushed_at'] == '2023-07-01T00:00:00Z'
+    assert len(fake_api.requests) == 4
+    for path, headers, _ in fake_api.requests[1:]:
+        assert headers['If-None-Match'] == etags[path]['etag']
+    new_etags = utils._load_json(utils._etags_path('github'))
+    assert sorted(new_etags) == sorted(etags)
+    tags, branches = '/repos/MSLNZ/msl-io/tags?per_page=100&page=1', '/repos/MSLNZ/msl-io/branches?per_page=100&page=1'
+    assert new_etags[tags] == etags[tags]
+    assert new_etags[branches] != etags[branches]
+
+
+def test_update_pypi_simple_truncated(fake_api, monkeypatch):
+    # the reply of the JSON Simple API is truncated, the version from the JSON API is used
+    fake_api.routes.update(pypi_routes('1.0'))
+    fake_api.routes['/simple/msl-loadlib/'] = (200, b'{"files": ', {
+        'Content-Type': utils._PYPI_SIMPLE_JSON, 'Content-Length': '1000'})
+    expected = {'msl-loadlib': {'version': '1.0', 'description': 'MSL msl-loadlib'}}
+    assert utils._update_pypi(None, True) == expected
+    assert 'https://pypi.org/simple/msl-loadlib/' not in utils._load_json(utils._etags_path('pypi'))
+
+    # a mirror of PyPI replied with invalid JSON, the cached information is kept
+    monkeypatch.setenv('MSL_PM_INDEX_URL', fake_api.url + '/simple/')
+    fake_api.routes.update(pypi_routes('1.0'))
+    assert utils._update_pypi(None, True) == expected
+    fake_api.routes['/simple/msl-loadlib/'] = (200, b'<html>', {'Content-Type': utils._PYPI_SIMPLE_JSON})
+    assert utils._update_pypi(None, True) == expected
+    fake_api.routes['/simple/msl-loadlib/'] = (200, b'{"files": ', {
+        'Content-Type': utils._PYPI_SIMPLE_JSON, 'Content-Length': '1000'})
+    assert utils._update_pypi(None, True) == expected
+
+
+def test_update_github_truncated(fake_api):
+    # the body of a reply is truncated or it is not JSON, the other information is still updated
+    fake_api.routes.update(github_routes(name='msl-loadlib'))
+    fake_api.routes.update(github_routes())
+    fake_api.routes['/orgs/MSLNZ/repos'] = (200, github_routes()['/orgs/MSLNZ/repos'][1] +
+                                            github_routes(name='msl-loadlib')['/orgs/MSLNZ/repos'][1])
+    fake_api.routes['/repos/MSLNZ/msl-loadlib/tags'] = (200, b'[{"name": ', {'Content-Length': '1000'})
+    fake_api.routes['/repos/MSLNZ/msl-loadlib/branches'] = (200, b'<html></html>')
+    pkgs = utils._update_github(None, None, None, True)
+    assert sorted(pkgs) == ['msl-io', 'msl-loadlib']
+    assert pkgs['msl-io']['tags'] == ['v0.1.0']
+    assert pkgs['msl-io']['branches'] == ['main']
+    assert pkgs['msl-loadlib']['version'] == '0.1.0'
+    assert pkgs['msl-loadlib']['tags'] == []
+    assert pkgs['msl-loadlib']['branches'] == []
+    etags = utils._load_json(utils._etags_path('github'))
+    assert '/repos/MSLNZ/msl-loadlib/tags?per_page=100&page=1' not in etags
+    assert '/repos/MSLNZ/msl-loadlib/branches?per_page=100&page=1' not in etags
+
+    # the GraphQL API
+    headers = {'Authorization': 'Basic ' + utils.base64.b64encode(b'user:token').decode()}
+    fake_api.routes['/graphql'] = (200, b'{"data": ', {'Content-Length': '1000'})
+    assert utils._github_graphql(headers) is None
+    fake_api.routes['/graphql'] = (200, b'<html></html>')
+    assert utils._github_graphql(headers) is None
+
+
+def test_update_pypi_truncated(fake_api):
+    fake_api.routes.update(pypi_routes('1.0'))
+    expected = {'msl-loadlib': {'version': '1.0', 'description': 'MSL msl-loadlib'}}
+    assert utils._update_pypi(None, True) == expected
+
+    # the cached information is kept
+    fake_api.routes['/pypi/msl-loadlib/json'] = (200, b'{"info": ', {'Content-Length': '1000'})
+    assert utils._update_pypi(None, True) == expected
+    fake_api.routes['/pypi/msl-loadlib/json'] = (200, b'<html></html>')
+    assert utils._update_pypi(None, True) == expected
+
+
+def test_github_graphql(fake_api, monkeypatch):
+    headers = {'Authorization': 'Basic ' + utils.base64.b64encode(b'user:token').decode()}
+    route = graphql_route()
+
+    def reply(body):
+        if 'refs(' in body['query'] and 'fragment' not in body['query']:
+            # the second page of the tags
+            assert body['variables'] == {'name': 'msl-io', 'prefix': 'refs/tags/',
+                                         'order': utils._GRAPHQL_TAGS_ORDER, 'cursor': 'c1'}
+            refs = {'pageInfo': {'hasNextPage': False, 'endCursor': None}, 'nodes': [{'name': 'v0.0.1'}]}
+            return 200, {'data': {'repository': {'refs': refs}}}
+        status, data = route(body)
+        if 'organization' not in body['query']:
+            data['data']['r0']['tags']['pageInfo'] = {'hasNextPage': True, 'endCursor': 'c1'}
+            if 'msl-missing' in body['query']:
+                data['data']['r1'] = None
+                data['errors'] = [{'type': 'NOT_FOUND', 'message': 'Could not resolve to a Repository'}]
+        return status, data
+
+    fake_api.routes['/graphql'] = reply
+    pkgs = utils._github_graphql(headers)
+    assert pkgs == {'msl-io': {
+        'description': 'Read and write data files',
+        'version': '0.1.0',
+        'tags': ['v0.1.0', 'v0.0.1'],
+        'branches': ['main'],
+        'pushed_at': '2023-06-16T00:00:00Z',
+        'updated_at': '2023-06-16T00:00:00Z',
+    }}
+    assert fake_api.requests[0][2]['variables'] == {'cursor': None}
+    assert len(fake_api.requests) == 3
+
+    # the details of specific repositories, a repository that does not exist is ignored
+    del fake_api.requests[:]
+    assert utils._github_graphql(headers, names=['msl-io', 'msl-missing']) == pkgs
+    assert len(fake_api.requests) == 2
+
+    # the information about a repository that did not change is not requested again
+    del fake_api.requests[:]
+    assert utils._github_graphql(headers, cached=pkgs) == pkgs
+    assert len(fake_api.requests) == 1
+
+    # the GraphQL API is not available, the REST API is used instead
+    fake_api.routes['/graphql'] = (502, None)
+    fake_api.routes.update(github_routes())
+    monkeypatch.setenv('MSL_PM_GITHUB_AUTH', utils.base64.b64encode(b'user:token').decode())
+    assert utils._github_graphql(headers) is None
+    assert utils._update_github(None, None, None, False) == {'msl-io': dict(pkgs['msl-io'], tags=['v0.1.0'])}
+
+
+def test_github_graphql_forced(fake_api, monkeypatch):
+    monkeypatch.setenv('MSL_PM_GITHUB_AUTH', utils.base64.b64encode(b'user:token').decode())
+    fake_api.routes['/graphql'] = graphql_route()
+    expected = {
+        'description': 'Read and write data files',
+        'version': '0.1.0',
+        'tags': ['v0.1.0'],
+        'branches': ['main'],
+        'pushed_at': '2023-06-16T00:00:00Z',
+        'updated_at': '2023-06-16T00:00:00Z',
+    }
+    assert utils._update_github(None, None, None, False) == {'msl-io': expected}
+    assert len(fake_api.requests) == 2
+    assert fake_api.requests[0][1]['Authorization'] == 'bearer token'
+
+    # the repository did not change, only the listing is requested
+    del fake_api.requests[:]
+    fake_api.routes['/graphql'] = graphql_route(version='0.2.0')
+    assert utils._update_github(None, None, None, False) == {'msl-io': expected}
+    assert len(fake_api.requests) == 1
+
+    # a forced update requests the details of every repository
+    del fake_api.requests[:]
+    assert utils._update_github(None, None, None, True) == {'msl-io': dict(expected, version='0.2.0', tags=['v0.2.0'])}
+    assert len(fake_api.requests) == 2
+
+
+def test_update_github_targeted(fake_api):
+    fake_api.routes.update(github_routes())
+    routes = github_routes(name='msl-loadlib')
+    routes['/orgs/MSLNZ/repos'] = (200, fake_api.routes['/orgs/MSLNZ/repos'][1] + routes['/orgs/MSLNZ/repos'][1])
+    fake_api.routes.update(routes)
+    utils._update_github(None, None, None, False)
+
+    # only the information about the requested repository is updated
+    del fake_api.requests[:]
+    routes = github_routes(version='0.2.0')
+    del routes['/orgs/MSLNZ/repos']
+    fake_api.routes.update(routes)
+    pkgs = utils._update_github(['io'], None, None, True)
+    assert pkgs['msl-io']['version'] == '0.2.0'
+    assert pkgs['msl-loadlib']['version'] == '0.1.0'
+    assert sorted(path.split('?')[0] for path, _, _ in fake_api.requests) == [
+        '/repos/MSLNZ/io', '/repos/MSLNZ/msl-io', '/repos/MSLNZ/msl-io/branches',
+        '/repos/MSLNZ/msl-io/releases/latest', '/repos/MSLNZ/msl-io/tags',
+    ]
+    assert utils._store().load('github') == pkgs
+
+    # a name that is not a repository, all repositories are requested instead
+    del fake_api.requests[:]
+    pkgs = utils._update_github(['msl-missing'], None, None, True)
+    assert sorted(pkgs) == ['msl-io', 'msl-loadlib']
+    assert '/orgs/MSLNZ/repos?per_page=100&page=1' in [path for path, _, _ in fake_api.requests]
+
+
+def test_update_pypi_targeted(fake_api):
+    fake_api.routes.update(pypi_routes('1.0'))
+    fake_api.routes.update(pypi_routes('2.0', name='msl-io'))
+    utils._store().replace('github', {'msl-io': {'description': '', 'version': '', 'tags': [], 'branches': []}})
+    utils._update_pypi(None, True)
+
+    # only the information about the requested project is updated (the search is not used)
+    del fake_api.requests[:]
+    fake_api.routes.update(pypi_routes('2.1', name='msl-io'))
+    pkgs = utils._update_pypi(['msl-io'], True)
+    assert pkgs == {
+        'msl-io': {'version': '2.1', 'description': 'MSL msl-io'},
+        'msl-loadlib': {'version': '1.0', 'description': 'MSL msl-loadlib'},
+    }
+    assert [path for path, _, _ in fake_api.requests] == ['/pypi/msl-io/json', '/simple/msl-io/']
+
+
+def test_single_flight(fake_api):
+    routes = github_routes()
+    listing = routes['/orgs/MSLNZ/repos']
+
+    def slow(body):
+        time.sleep(0.5)
+        return listing
+
+    routes['/orgs/MSLNZ/repos'] = slow
+    fake_api.routes.update(routes)
+
+    # the threads update the cache at the same time, only one of them sends the requests
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(utils._update_cache('github', True)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 3
+    assert all(result == results[0] for result in results)
+    assert results[0]['msl-io']['version'] == '0.1.0'
+    assert [path.split('?')[0] for path, _, _ in fake_api.requests].count('/orgs/MSLNZ/repos') == 1
+
+
+def test_stale_while_revalidate(fake_api, monkeypatch):
+    revalidated = []
+
+    def revalidate(where):
+        # instead of in a background process
+        revalidated.append(where)
+        utils._update_cache(where)
+
+    monkeypatch.setattr(utils, '_revalidate_in_background', revalidate)
+    fake_api.routes.update(github_routes())
+    assert utils._github(False)['msl-io']['version'] == '0.1.0'
+    assert not revalidated
+
+    # the version expired (less than the maximum staleness ago), the stale
+    # information is used and the cache is updated in the background
+    fake_api.routes.update(github_routes(version='0.2.0', pushed_at='2023-07-01T00:00:00Z'))
+    with utils._store()._connect() as conn:
+        conn.execute("UPDATE checked SET time = time - 2 * 86400 WHERE field = 'version'")
+    assert utils._github(False)['msl-io']['version'] == '0.1.0'
+    assert revalidated == ['github']
+    assert utils._github(False)['msl-io']['version'] == '0.2.0'
+
+    # the version expired more than the maximum staleness ago, the cache is updated first
+    fake_api.routes.update(github_routes(version='0.3.0', pushed_at='2023-08-01T00:00:00Z'))
+    with utils._store()._connect() as conn:
+        conn.execute("UPDATE checked SET time = time - 30 * 86400 WHERE field = 'version'")
+    assert utils._github(False)['msl-io']['version'] == '0.3.0'
+    assert revalidated == ['github']
+
+
+def test_update_github_after_prune(fake_api):
+    fake_api.routes.update(github_routes())
+    routes = github_routes(name='msl-loadlib')
+    routes['/orgs/MSLNZ/repos'] = (200, fake_api.routes['/orgs/MSLNZ/repos'][1] + routes['/orgs/MSLNZ/repos'][1])
+    fake_api.routes.update(routes)
+    assert sorted(utils._update_github(None, None, None, False)) == ['msl-io', 'msl-loadlib']
+
+    # the information about msl-io was retrieved a long time ago
+    store = utils._store()
+    with store._connect() as conn:
+        conn.execute('UPDATE checked SET time = 0 WHERE name = ?', ('msl-io',))
+    assert cache.prune() == {'github': ['msl-io'], 'pypi': []}
+    assert store.age('github') > 1e6
+    assert not any(key.startswith('/orgs/') for key in utils._load_json(utils._etags_path('github')))
+
+    # the listing is not conditional so msl-io is cached again
+    assert sorted(utils._update_github(None, None, None, False)) == ['msl-io', 'msl-loadlib']
+    assert sorted(store.names('github')) == ['msl-io', 'msl-loadlib']
+
+
+def test_metadata_store(tmpdir):
+    with open(str(tmpdir.join('pypi.json')), mode='wt') as fp:
+        json.dump({'GTC': {'version': '1.4.0', 'description': 'GUM Tree Calculator'}}, fp)
+    os.utime(str(tmpdir.join('pypi.json')), (1e9, 1e9))
+
+    store = utils._MetadataStore(str(tmpdir.join('cache.sqlite3')))
+    assert store.load('pypi') == {'GTC': {'version': '1.4.0', 'description': 'GUM Tree Calculator'}}
+    assert store.age('pypi') > time.time() - 1e9 - 10
+    assert store.age('github') is None
+    assert store.load('github') == {}
+
+    repo = {'description': 'b', 'version': '1.0', 'tags': ['v1.0', 'v0.9'], 'branches': ['main'],
+            'pushed_at': '2023-01-01T00:00:00Z', 'updated_at': '2023-01-01T00:00:00Z'}
+    store.replace('github', {'msl-b': repo, 'msl-a': dict(repo, tags=[])})
+    assert store.age('github') < 10
+    assert store.names('github') == ['msl-a', 'msl-b']
+    assert store.load('github')['msl-b'] == repo
+    assert store.load('github', lazy=False) == store.load('github')
+
+    # the tags and branches are loaded when they are accessed
+    lazy = store.load('github')['msl-b']
+    assert not dict.__contains__(lazy, 'tags')
+    assert lazy['version'] == '1.0'
+    assert 'tags' in lazy
+    assert not dict.__contains__(lazy, 'tags')
+    assert lazy['tags'] == ['v1.0', 'v0.9']
+    assert dict.__contains__(lazy, 'tags')
+    assert not dict.__contains__(lazy, 'branches')
+    assert lazy.get('branches') == ['main']
+    with pytest.raises(KeyError):
+        lazy['unknown']
+    lazy = copy.deepcopy(store.load('github'))['msl-b']
+    assert json.loads(json.dumps(lazy)) == repo
+    assert dict(lazy) == repo
+    assert store.has_ref('tags', 'msl-b', 'v0.9')
+    assert not store.has_ref('tags', 'msl-a', 'v0.9')
+    assert store.has_ref('branches', 'msl-a', 'main')
+
+    age = store.age('github')
+    store.merge('github', {'msl-b': dict(repo, tags=['v2.0']), 'msl-c': repo})
+    assert store.age('github') >= age
+    assert store.names('github') == ['msl-a', 'msl-b', 'msl-c']
+    assert store.load('github')['msl-b']['tags'] == ['v2.0']
+    assert not store.has_ref('tags', 'msl-b', 'v1.0')
+
+    store.replace('github', {'msl-c': repo})
+    assert store.names('github') == ['msl-c']
+    assert not store.has_ref('branches', 'msl-a', 'main')
+
+    # each field expires separately
+    ttl = {'version': 3600, 'description': 7 * 86400}
+    assert store.overdue('github', ttl) < -3500
+    assert store.expired('github', ttl) == {'msl-c': set()}
+    store.replace('github', {'msl-c': repo, 'msl-d': repo},
+                  checked={'msl-c': ['description'], 'msl-d': ['version', 'description']},
+                  timestamp=time.time() - 7200)
+    assert store.expired('github', ttl) == {'msl-c': set(), 'msl-d': {'version'}}
+    assert 3500 < store.overdue('github', ttl) < 3700
+    assert store.overdue('github', dict(ttl, version=1e9)) < 0
+    store.merge('github', {'msl-d': repo}, checked={'msl-d': ['version']})
+    assert store.expired('github', ttl) == {'msl-c': set(), 'msl-d': set()}
+    store.merge('github', {'msl-e': repo}, checked={'msl-e': ['description']})
+    assert store.expired('github', ttl)['msl-e'] == {'version'}
+
+    # a new instance uses the same database and the legacy file is not imported again
+    tmpdir.join('pypi.json').remove()
+    assert utils._MetadataStore(str(tmpdir.join('cache.sqlite3'))).names('pypi') == ['GTC']
+
+
+def test_metadata_store_schema(tmpdir):
+    repo = {'description': 'b', 'version': '1.0', 'tags': ['v1.0', 'v0.9'], 'branches': ['main'],
+            'pushed_at': '2023-01-01T00:00:00Z', 'updated_at': '2023-01-01T00:00:00Z'}
+
+    # a database that was created before the schema was versioned is upgraded in place
+    path = str(tmpdir.join('cache.sqlite3'))
+    conn = sqlite3.connect(path)
+    conn.executescript(utils._MetadataStore.schema)
+    conn.execute("INSERT INTO repos VALUES ('msl-b', 'b', '1.0', '2023-01-01T00:00:00Z', '2023-01-01T00:00:00Z')")
+    conn.execute("INSERT INTO tags VALUES ('msl-b', 'v1.0', 0), ('msl-b', 'v0.9', 1)")
+    conn.execute("INSERT INTO branches VALUES ('msl-b', 'main', 0)")
+    conn.execute("INSERT INTO pypi VALUES ('GTC', '1.4.0', 'GUM Tree Calculator')")
+    conn.execute("INSERT INTO meta VALUES ('github', 1e9), ('pypi', 1e9)")
+    conn.commit()
+    conn.close()
+    store = utils._MetadataStore(path)
+    assert store.load('github') == {'msl-b': repo}
+    assert store.load('github', lazy=False) == {'msl-b': repo}
+    assert store.load('pypi') == {'GTC': {'version': '1.4.0', 'description': 'GUM Tree Calculator'}}
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == utils._MetadataStore.version
+    assert conn.execute('PRAGMA application_id').fetchone()[0] == utils._MetadataStore.application_id
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'stats'").fetchall()
+
+    # a package that does not match its checksums is removed and the cache expires
+    store.replace('github', {'msl-a': repo, 'msl-b': repo, 'msl-c': repo})
+    conn.execute("UPDATE repos SET version = '9.9' WHERE name = 'msl-a'")
+    conn.execute("DELETE FROM tags WHERE repo = 'msl-b' AND name = 'v0.9'")
+    conn.commit()
+    assert list(store.load('github')) == ['msl-b', 'msl-c']
+    assert store.names('github') == ['msl-b', 'msl-c']
+    assert store.updated('github') == 0
+    assert store.load('github', lazy=False) == {'msl-c': repo}
+    assert store.names('github') == ['msl-c']
+    store.merge('github', {'msl-d': repo})
+    conn.execute("UPDATE branches SET name = 'master' WHERE repo = 'msl-d'")
+    conn.commit()
+    assert store.load('github')['msl-d']['branches'] == []
+    assert store.names('github') == ['msl-c']
+    assert store.load('pypi') == {'GTC': {'version': '1.4.0', 'description': 'GUM Tree Calculator'}}
+
+    # a database that was created by a newer version is created again
+    conn.execute('PRAGMA user_version = 99')
+    conn.commit()
+    conn.close()
+    store = utils._MetadataStore(path)
+    assert store.age('github') is None
+    assert store.load('pypi') == {}
+
+    # a file that is not a database is replaced
+    path = str(tmpdir.join('corrupt.sqlite3'))
+    with open(path, mode='wb') as fp:
+        fp.write(b'not a database' * 1000)
+    store = utils._MetadataStore(path)
+    assert os.path.isfile(path + '.corrupt')
+    assert store.age('github') is None
+    store.replace('pypi', {'GTC': {'version': '1.4.0', 'description': 'GUM Tree Calculator'}})
+    assert not store.check()
+    assert store.load('pypi') == {'GTC': {'version': '1.4.0', 'description': 'GUM Tree Calculator'}}
+
+
+def test_metadata_store_journal(tmpdir, monkeypatch):
+    def journal_mode(store):
+        with store._connect() as conn:
+            return conn.execute('PRAGMA journal_mode').fetchone()[0]
+
+    assert not utils._is_network_path(str(tmpdir))
+    path = str(tmpdir.join('cache.sqlite3'))
+    assert journal_mode(utils._MetadataStore(path)) == 'wal'
+
+    # a write-ahead log cannot be used on a network share, an existing database is converted
+    monkeypatch.setattr(utils, '_is_network_path', lambda path: True)
+    store = utils._MetadataStore(path)
+    assert journal_mode(store) == 'delete'
+    store.replace('pypi', {'msl-io': {'version': '0.1.0', 'description': 'Read and write data files'}})
+    assert not os.path.isfile(path + '-wal')
+    assert journal_mode(utils._MetadataStore(str(tmpdir.join('new.sqlite3')))) == 'delete'
+
+
+def test_metadata_store_concurrency(tmpdir, monkeypatch):
+    # a process that replaces the cache while another process reads
+    # it must not make the information look corrupt to the reader
+    store = utils._MetadataStore(str(tmpdir.join('cache.sqlite3')))
+    repaired = []
+    monkeypatch.setattr(store, '_repair', lambda where, names: repaired.append(names))
+
+    def repos(i):
+        return dict(('msl-{}'.format(n), {
+            'description': 'd', 'version': str(i), 'tags': ['v{}.{}'.format(i, j) for j in range(i % 5)],
+            'branches': ['b{}'.format(j) for j in range(i % 3)], 'pushed_at': str(i), 'updated_at': str(i)}) for n in range(10))
+
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            store.replace('github', repos(i))
+
+    store.replace('github', repos(0))
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        end = time.time() + 2
+        while time.time() < end:
+            for value in store.load('github', lazy=False).values():
+                assert len(value['tags']) == int(value['version']) % 5
+            for value in store.load('github').values():
+                assert value['branches'] in ([], ['b0'], ['b0', 'b1'])
+    finally:
+        stop.set()
+        thread.join()
+    assert not repaired
+
+
+def test_save_json(tmpdir, monkeypatch):
+    # the umask of the process is not changed to get the permissions of a new file
+    def umask(mask):
+        raise AssertionError('the umask was changed')
+
+    monkeypatch.setattr(utils.os, 'umask', umask)
+    monkeypatch.setattr(utils, '_new_file_mode', None)
+    path = str(tmpdir.join('a.json'))
+    utils._save_json(path, {'a': 1})
+    assert utils._load_json(path) == {'a': 1}
+    assert os.listdir(str(tmpdir)) == ['a.json']
+
+    # the file has the same permissions as a file that open() creates
+    with open(str(tmpdir.join('b.json')), mode='wt') as fp:
+        json.dump({'b': 2}, fp)
+    assert os.stat(path).st_mode == os.stat(str(tmpdir.join('b.json'))).st_mode
+
+
+def test_file_lock(tmpdir):
+    path = str(tmpdir.join('github.lock'))
+    with utils._FileLock(path) as lock:
+        assert lock.locked
+        assert not lock.waited
+        other = utils._FileLock(path, timeout=0.2)
+        assert not other.acquire()
+        assert other.waited
+        other.release()
+    assert not lock.locked
+
+    with utils._FileLock(path, timeout=0.2) as lock:
+        assert lock.locked
+
+    path = str(tmpdir.join('pypi-etags.json'))
+    utils._save_json(path, {'a': 1})
+    utils._save_json(path, {'b': 2})
+    assert utils._load_json(path) == {'b': 2}
+    assert sorted(p.basename for p in tmpdir.listdir()) == ['github.lock', 'pypi-etags.json']
+
+
+def test_memo():
+    value = {'msl-loadlib': {'tags': ['v1.0']}}
+    assert utils._memo_set('test', 1, value) is value
+    value['msl-loadlib']['tags'].append('v2.0')
+    assert utils._memo_get('test', 1) == {'msl-loadlib': {'tags': ['v1.0']}}
+    utils._memo_get('test', 1)['msl-loadlib']['tags'].append('v2.0')
+    assert utils._memo_get('test', 1) == {'msl-loadlib': {'tags': ['v1.0']}}
+    assert utils._memo_get('test', 2) is None
+    utils._invalidate_memo('test')
+    assert utils._memo_get('test', 1) is None
+    utils._memo_set('test', 1, value, expires=time.time() - 1)
+    assert utils._memo_get('test', 1) is None
+    assert utils._memo_get('unknown', 1) is None
+
+
+def test_gather(caplog):
+    caplog.set_level(logging.DEBUG, logger=utils._PKG_NAME)
+
+    def task(name, delay):
+        def run():
+            utils.log.debug('%s started', name)
+            time.sleep(delay)
+            utils.log.debug('%s finished', name)
+            return name, threading.current_thread()
+        return run
+
+    caplog.clear()
+    t0 = time.time()
+    results = utils._gather(task('pypi', 0.4), task('github', 0.2), task('local', 0.3))
+    assert time.time() - t0 < 0.8
+    assert [name for name, _ in results] == ['pypi', 'github', 'local']
+    assert len(set(thread for _, thread in results)) == 3
+    assert [r.message for r in caplog.records] == [
+        'pypi started', 'pypi finished',
+        'github started', 'github finished',
+        'local started', 'local finished',
+    ]
+
+    def fails():
+        utils.log.error('cannot do it')
+        raise ValueError('failed')
+
+    caplog.clear()
+    with pytest.raises(ValueError, match='failed'):
+        utils._gather(task('pypi', 0), fails)
+    assert [r.message for r in caplog.records] == ['pypi started', 'pypi finished', 'cannot do it']
+
+    # a KeyboardInterrupt does not wait for the other tasks to finish
+    def interrupt():
+        raise KeyboardInterrupt
+
+    t0 = time.time()
+    with pytest.raises(KeyboardInterrupt):
+        utils._gather(interrupt, task('github', 2))
+    assert time.time() - t0 < 1
+
+    # the records of the worker threads of a pool that a task uses are also buffered
+    def fetch(index):
+        time.sleep(0.1)
+        utils.log.debug('fetched %d', index)
+
+    caplog.clear()
+    utils._gather(task('github', 0.2), lambda: utils._AdaptivePool().map(fetch, range(3)))
+    messages = [r.message for r in caplog.records]
+    assert messages[:2] == ['github started', 'github finished']
+    assert sorted(messages[2:]) == ['fetched 0', 'fetched 1', 'fetched 2']
+
+    # the log records are no longer buffered
+    caplog.clear()
+    utils.log.info('not buffered')
+    assert [r.message for r in caplog.records] == ['not buffered']
+
+
+def test_adaptive_pool():
+    pool = utils._AdaptivePool(max_workers=4, initial=2)
+    assert pool.concurrency == 2
+    assert pool.map(lambda x: x * x, range(20)) == [x * x for x in range(20)]
+    assert pool.map(lambda x: x, []) == []
+
+    # the concurrency increases for fast tasks but never exceeds max_workers
+    assert 2 < pool.concurrency <= 4
+
+    # throttling halves the concurrency
+    limit = pool.limit
+    pool.throttle()
+    assert pool.limit == max(1.0, limit / 2.0)
+
+    # the number of tasks that run concurrently is bounded
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def task(_):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+
+    pool.map(task, range(30))
+    assert 1 <= active[1] <= 4
+
+    # calling map from within a task does not deadlock
+    assert pool.map(lambda x: sum(pool.map(lambda y: y, range(x))), range(10)) == \
+        [sum(range(x)) for x in range(10)]
+
+    # and the tasks that are submitted from within a task also run concurrently
+    pool = utils._AdaptivePool(max_workers=8, initial=8)
+    t0 = time.time()
+    assert pool.map(lambda x: pool.map(lambda y: time.sleep(0.2) or y, range(3)), range(2)) == [[0, 1, 2]] * 2
+    assert time.time() - t0 < 0.5
+
+    # an exception in a task is raised in the calling thread
+    def raises(x):
+        if x == 3:
+            raise ValueError('bad')
+        return x
+
+    try:
+        pool.map(raises, range(5))
+    except ValueError as e:
+        assert str(e) == 'bad'
+    else:
+        assert False, 'did not raise ValueError'
+
+
+def test_http_connection_pool():
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            connections.append(self.client_address)
+            BaseHTTPRequestHandler.setup(self)
+
+        def do_GET(self):
+            if self.path.startswith('/unavailable'):
+                # reply with "503 Service Unavailable" to the first request of each path
+                status = 503 if self.path not in connections else 200
+                connections.append(self.path)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if self.path.startswith('/truncated'):
+                # the body of the first reply of each path is truncated
+                body = json.dumps({'path': self.path}).encode()
+                truncated = self.path not in connections
+                connections.append(self.path)
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if truncated:
+                    self.wfile.write(body[:5])
+                    self.close_connection = True
+                else:
+                    self.wfile.write(body)
+                return
+            if self.path == '/missing':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = json.dumps({'path': self.path}).encode()
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'gzip')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    pool = utils._HTTPConnectionPool()
+    try:
+        for i in range(5):
+            response = pool.urlopen(utils.Request(url + '/{}'.format(i)))
+            assert response.status == 200
+            assert json.load(response) == {'path': '/{}'.format(i)}
+
+        try:
+            pool.urlopen(utils.Request(url + '/missing'))
+        except utils.HTTPError as e:
+            assert e.code == 404
+        else:
+            assert False, 'did not raise HTTPError'
+
+        assert json.load(pool.urlopen(utils.Request(url + '/a'))) == {'path': '/a'}
+
+        # the same (keep-alive) connection was used for every request
+        assert len(connections) == 1
+
+        # a transient error is retried
+        pool.backoff = 0
+        response = pool.urlopen(utils.Request(url + '/unavailable'))
+        assert response.status == 200
+        assert response.read() == b''
+        assert json.load(pool.urlopen(utils.Request(url + '/truncated'))) == {'path': '/truncated'}
+        pool.retries = 0
+        try:
+            pool.urlopen(utils.Request(url + '/unavailable/no-retry'))
+        except utils.HTTPError as e:
+            assert e.code == 503
+        else:
+            assert False, 'did not raise HTTPError'
+
+        # the body of the reply is truncated, the failure is recorded by the circuit breaker
+        breaker = pool._breakers[url[7:]]
+        try:
+            pool.urlopen(utils.Request(url + '/truncated/no-retry'))
+        except utils.URLError as e:
+            assert 'IncompleteRead' in str(e.reason)
+        else:
+            assert False, 'did not raise URLError'
+        assert breaker._failures == 2
+
+        # a streamed body is not read in advance
+        response = pool.urlopen(utils.Request(url + '/truncated/stream'), stream=True)
+        assert response.status == 200
+        with pytest.raises(utils.URLError):
+            response.read()
+    finally:
+        pool.clear()
+        server.shutdown()
+        server.server_close()
+
+    # cannot connect, the circuit breaker opens after 5 consecutive failures
+    pool = utils._HTTPConnectionPool(retries=1, backoff=0)
+    for i in range(3):
+        try:
+            pool.urlopen(utils.Request(url))
+        except utils.URLError as e:
+            assert ('circuit breaker' in str(e.reason)) is (i == 2)
+        else:
+            assert False, 'did not raise URLError'
+
+
+def test_circuit_breaker():
+    breaker = utils._CircuitBreaker(threshold=2, cooldown=0.2)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.allow()
+    breaker.success()
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+    time.sleep(0.25)
+    assert breaker.allow()  # trial request
+    assert not breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.25)
+    assert breaker.allow()
+    breaker.success()
+    assert not breaker.is_open
+    assert breaker.allow()
+
+
+def test_rate_limit():
+    def headers(remaining, reset):
+        m = Message()
+        m['X-RateLimit-Remaining'] = str(remaining)
+        m['X-RateLimit-Reset'] = str(reset)
+        return m
+
+    rate_limit = utils._RateLimit(reserve=2)
+    assert rate_limit.core() == {}
+
+    # unknown rate limit
+    assert rate_limit.acquire()
+    rate_limit.update(None)
+    assert rate_limit.core() == {}
+
+    reset = int(time.time()) + 600
+    assert rate_limit.acquire()
+    rate_limit.update(headers(5, reset))
+    assert rate_limit.core() == {'remaining': 5, 'reset': reset}
+
+    # the requests that are in progress are counted
+    assert rate_limit.acquire()
+    assert rate_limit.acquire()
+    assert rate_limit.acquire()
+    assert not rate_limit.acquire()
+
+    # a response that arrives late does not increase the number remaining
+    rate_limit.update(headers(3, reset))
+    rate_limit.update(headers(4, reset))
+    assert rate_limit.core()['remaining'] == 3
+    rate_limit.update(headers(2, reset))
+    assert not rate_limit.acquire()
+
+    # the rate-limit window was reset
+    rate_limit.update(headers(0, int(time.time()) - 1))
+    assert rate_limit.acquire()